@@ -0,0 +1,282 @@
+"""Approximate nearest‑neighbour index (random‑projection forest).
+
+Brute‑force neighbour search over high‑dimensional embeddings is quadratic in
+practice, which makes ``cluster_dbscan`` impractical beyond a few ten thousand
+prompts.  This module builds a small forest of random‑projection trees in
+plain NumPy:
+
+* Every tree uses one random direction per depth level.  All rows are
+  projected onto it with a single mat‑vec and every node is split at the
+  median of its members' projections, so the trees are perfectly balanced and
+  building one costs ``depth`` mat‑vecs.
+* Rows that share a leaf in any tree are neighbour candidates.  Exact
+  distances are computed per leaf block and merged into a k‑NN graph, which
+  is then refined by looking at neighbours of neighbours.
+* New vectors are routed to one leaf per tree and compared against the
+  members of those leaves only.
+
+Distances are Euclidean.  For cosine distance, build the index on
+L2‑normalised rows and convert with ``d_cos = d² / 2``.
+
+The index (including the k‑NN graph, the expensive part) can be saved as an
+``.npz`` file and reloaded, e.g. next to the embedding cache.
+"""
+
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+from lazy_imports import np
+
+INDEX_VERSION = 1
+
+
+def _pairwise_sq(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    sq = np.einsum("ij,ij->i", a, a)[:, None] - 2 * a @ b.T + np.einsum("ij,ij->i", b, b)
+    return np.maximum(sq, 0)
+
+
+class RPForestIndex:
+    """Random‑projection forest plus the k‑NN graph of the indexed rows."""
+
+    def __init__(
+        self,
+        directions: np.ndarray,
+        thresholds: np.ndarray,
+        leaves: np.ndarray,
+        knn_indices: np.ndarray,
+        knn_distances: np.ndarray,
+        fingerprint: str = "",
+    ) -> None:
+        self.directions = directions  # (trees, depth, dim)
+        self.thresholds = thresholds  # (trees, 2**depth - 1), heap order
+        self.leaves = leaves  # (trees, n) leaf id of every row
+        self.knn_indices = knn_indices  # (n, k), self excluded, ascending distance
+        self.knn_distances = knn_distances  # (n, k)
+        self.fingerprint = fingerprint
+        self._leaf_members: list[tuple[np.ndarray, np.ndarray]] | None = None
+
+    @property
+    def n_neighbors(self) -> int:
+        return self.knn_indices.shape[1]
+
+    # ------------------------------------------------------------------
+    # Construction
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def build(
+        cls,
+        matrix: np.ndarray,
+        n_neighbors: int,
+        *,
+        n_trees: int = 8,
+        leaf_size: int = 64,
+        refine: int = 2,
+        seed: int = 42,
+        fingerprint: str = "",
+    ) -> "RPForestIndex":
+        """Build the forest and the approximate k‑NN graph of *matrix*."""
+
+        n, dim = matrix.shape
+        if n <= n_neighbors:
+            raise ValueError("Need more rows than neighbours to build an index.")
+        leaf_size = max(leaf_size, n_neighbors + 1)
+        depth = max(0, int(np.ceil(np.log2(n / leaf_size))))
+
+        rng = np.random.default_rng(seed)
+        directions = rng.standard_normal((n_trees, depth, dim)).astype(np.float32)
+        directions /= np.linalg.norm(directions, axis=2, keepdims=True)
+        thresholds = np.zeros((n_trees, 2**depth - 1), dtype=np.float32)
+        leaves = np.empty((n_trees, n), dtype=np.int32)
+
+        for t in range(n_trees):
+            leaves[t] = cls._grow(matrix, directions[t], thresholds[t])
+
+        index = cls(
+            directions,
+            thresholds,
+            leaves,
+            np.full((n, n_neighbors), -1, dtype=np.int64),
+            np.full((n, n_neighbors), np.inf, dtype=np.float32),
+            fingerprint,
+        )
+        for t in range(n_trees):
+            index._scan_leaves(matrix, t)
+        for _ in range(refine):
+            index._refine(matrix)
+        return index
+
+    @staticmethod
+    def _grow(matrix: np.ndarray, directions: np.ndarray, thresholds: np.ndarray) -> np.ndarray:
+        """Assign every row to a leaf, filling *thresholds* (heap layout)."""
+
+        n = len(matrix)
+        node = np.zeros(n, dtype=np.int64)  # heap index of the current node
+        for level, direction in enumerate(directions):
+            proj = np.asarray(matrix @ direction, dtype=np.float32)
+            order = np.lexsort((proj, node))
+            sorted_nodes = node[order]
+            uniq, starts, sizes = np.unique(sorted_nodes, return_index=True, return_counts=True)
+
+            half = sizes // 2
+            rank = np.arange(n) - np.repeat(starts, sizes)
+            right = rank >= np.repeat(half, sizes)
+
+            # Threshold half‑way between the two middle projections.
+            lo = proj[order[starts + np.maximum(half - 1, 0)]]
+            hi = proj[order[np.minimum(starts + half, starts + sizes - 1)]]
+            thresholds[uniq] = (lo + hi) / 2
+
+            child = 2 * sorted_nodes + 1 + right
+            node[order] = child
+
+        first_leaf = 2 ** len(directions) - 1
+        return (node - first_leaf).astype(np.int32)
+
+    def _leaf_groups(self, tree: int) -> tuple[np.ndarray, np.ndarray]:
+        if self._leaf_members is None:
+            self._leaf_members = []
+            n_leaves = self.thresholds.shape[1] + 1
+            for leaves in self.leaves:
+                order = np.argsort(leaves, kind="stable")
+                bounds = np.searchsorted(leaves[order], np.arange(n_leaves + 1))
+                self._leaf_members.append((order, bounds))
+        return self._leaf_members[tree]
+
+    def _merge(self, rows: np.ndarray, cand_idx: np.ndarray, cand_dist: np.ndarray) -> None:
+        """Merge candidate neighbours into the k‑NN lists of *rows*."""
+
+        k = self.n_neighbors
+        idx = np.concatenate([self.knn_indices[rows], cand_idx], axis=1)
+        dist = np.concatenate([self.knn_distances[rows], cand_dist], axis=1)
+
+        # Drop self matches and duplicates (the same neighbour found twice).
+        dist[idx == rows[:, None]] = np.inf
+        order = np.argsort(idx, axis=1, kind="stable")
+        idx = np.take_along_axis(idx, order, axis=1)
+        dist = np.take_along_axis(dist, order, axis=1)
+        dup = np.zeros_like(idx, dtype=bool)
+        dup[:, 1:] = idx[:, 1:] == idx[:, :-1]
+        dist[dup | (idx < 0)] = np.inf
+
+        best = np.argsort(dist, axis=1, kind="stable")[:, :k]
+        self.knn_indices[rows] = np.take_along_axis(idx, best, axis=1)
+        self.knn_distances[rows] = np.take_along_axis(dist, best, axis=1)
+
+    def _scan_leaves(self, matrix: np.ndarray, tree: int) -> None:
+        order, bounds = self._leaf_groups(tree)
+        for leaf in range(len(bounds) - 1):
+            members = order[bounds[leaf] : bounds[leaf + 1]]
+            if len(members) < 2:
+                continue
+            block = np.asarray(matrix[members], dtype=np.float32)
+            dist = np.sqrt(_pairwise_sq(block, block)).astype(np.float32)
+            cand = np.broadcast_to(members, dist.shape)
+            self._merge(members, cand, dist)
+
+    def _refine(self, matrix: np.ndarray, chunk_bytes: int = 64 << 20) -> None:
+        """One round of neighbour‑of‑neighbour exploration (NN‑descent style)."""
+
+        k = self.n_neighbors
+        # Keep the (rows, k², dim) difference tensor around *chunk_bytes*.
+        chunk_rows = max(1, chunk_bytes // (k * k * matrix.shape[1] * 4))
+        for start in range(0, len(matrix), chunk_rows):
+            rows = np.arange(start, min(start + chunk_rows, len(matrix)))
+            neigh = self.knn_indices[rows]
+            cand = self.knn_indices[np.maximum(neigh, 0)].reshape(len(rows), k * k)
+            block = np.asarray(matrix[rows], dtype=np.float32)
+            diff = np.asarray(matrix[cand.ravel()], dtype=np.float32).reshape(len(rows), k * k, -1)
+            diff -= block[:, None, :]
+            dist = np.sqrt(np.einsum("ijk,ijk->ij", diff, diff)).astype(np.float32)
+            self._merge(rows, cand, dist)
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def _route(self, vectors: np.ndarray) -> np.ndarray:
+        """Leaf id of every vector in every tree, shape (trees, q)."""
+
+        n_trees, depth, _ = self.directions.shape
+        out = np.empty((n_trees, len(vectors)), dtype=np.int64)
+        for t in range(n_trees):
+            node = np.zeros(len(vectors), dtype=np.int64)
+            proj = vectors @ self.directions[t].T  # (q, depth)
+            for level in range(depth):
+                right = proj[:, level] >= self.thresholds[t][node]
+                node = 2 * node + 1 + right
+            out[t] = node - (2**depth - 1)
+        return out
+
+    def query(
+        self, matrix: np.ndarray, vectors: np.ndarray, k: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Approximate *k* nearest indexed rows of every vector.
+
+        *matrix* must be the matrix the index was built on.  Returns
+        ``(indices, distances)``, each of shape ``(len(vectors), k)``; missing
+        neighbours (tiny indexes) are ``-1`` / ``inf``.
+        """
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        routes = self._route(vectors)
+        indices = np.full((len(vectors), k), -1, dtype=np.int64)
+        distances = np.full((len(vectors), k), np.inf, dtype=np.float32)
+
+        for q in range(len(vectors)):
+            groups = []
+            for t in range(len(routes)):
+                order, bounds = self._leaf_groups(t)
+                leaf = routes[t, q]
+                groups.append(order[bounds[leaf] : bounds[leaf + 1]])
+            cand = np.unique(np.concatenate(groups))
+            # Neighbours of the leaf members widen the net like _refine does.
+            cand = np.unique(np.concatenate([cand, self.knn_indices[cand].ravel()]))
+            cand = cand[cand >= 0]
+            dist = np.sqrt(_pairwise_sq(vectors[q : q + 1], np.asarray(matrix[cand]))[0])
+            best = np.argsort(dist, kind="stable")[:k]
+            indices[q, : len(best)] = cand[best]
+            distances[q, : len(best)] = dist[best]
+        return indices, distances
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def save(self, path: Path) -> None:
+        """Write the index atomically to *path* (``.npz``)."""
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as fh:
+            np.savez(
+                fh,
+                version=INDEX_VERSION,
+                directions=self.directions,
+                thresholds=self.thresholds,
+                leaves=self.leaves,
+                knn_indices=self.knn_indices,
+                knn_distances=self.knn_distances,
+                fingerprint=self.fingerprint,
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "RPForestIndex | None":
+        """Load an index saved by :meth:`save`; ``None`` if missing/outdated."""
+
+        if not path.exists():
+            return None
+        with np.load(path) as data:
+            if int(data["version"]) != INDEX_VERSION:
+                return None
+            return cls(
+                data["directions"],
+                data["thresholds"],
+                data["leaves"],
+                data["knn_indices"],
+                data["knn_distances"],
+                str(data["fingerprint"]),
+            )
@@ -0,0 +1,117 @@
+"""Content‑addressed cache of pipeline stage outputs.
+
+The embedding store makes embedding a rerun cheap, but everything after it –
+the k sweep, the projection, the PNGs – used to be recomputed even when
+nothing had changed.  :class:`ArtifactCache` keeps the output of a stage
+under a key derived from everything the stage depends on (input
+fingerprints, labels, parameters; see :func:`artifact_key`):
+
+    <cache>/stages/<stage>/<key>/arrays.npz   – NumPy outputs
+    <cache>/stages/<stage>/<key>/<file>       – files such as PNGs
+
+A rerun with identical inputs loads the outputs instead of recomputing them;
+changing one flag changes only the keys of the stages that depend on it, so
+only those run again.  Entries are written to a temporary directory and
+renamed into place, so readers never see a partial entry.  Only the
+``MAX_ENTRIES`` most recently used entries per stage are kept.
+
+Stages named in *force* are never read from the cache (but still written),
+which is what ``--force-stage`` maps to.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Any, Iterable, Sequence
+
+from lazy_imports import np
+
+ARTIFACT_VERSION = 1
+MAX_ENTRIES = 8
+
+
+def artifact_key(stage: str, *parts: Any) -> str:
+    """Hash of *stage* and its inputs; arrays are hashed by dtype, shape and content."""
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{ARTIFACT_VERSION}:{stage}".encode())
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            digest.update(f"\0array:{part.dtype.str}:{part.shape}:".encode())
+            digest.update(np.ascontiguousarray(part).data)
+        else:
+            digest.update(f"\0{part!r}".encode())
+    return digest.hexdigest()
+
+
+class ArtifactCache:
+    """Stage outputs under *root*, one directory per stage and key."""
+
+    def __init__(self, root: Path, force: Iterable[str] = ()) -> None:
+        self.root = root
+        self.force = frozenset(force)
+
+    def _entry(self, stage: str, key: str) -> Path | None:
+        if stage in self.force:
+            return None
+        entry = self.root / stage / key
+        if not entry.is_dir():
+            return None
+        os.utime(entry)  # most recently used
+        return entry
+
+    def load_arrays(self, stage: str, key: str) -> dict[str, np.ndarray] | None:
+        entry = self._entry(stage, key)
+        if entry is None or not (entry / "arrays.npz").exists():
+            return None
+        with np.load(entry / "arrays.npz", allow_pickle=False) as data:
+            return {name: data[name] for name in data.files}
+
+    def load_files(self, stage: str, key: str, names: Sequence[str], dest: Path) -> bool:
+        """Copy the cached files *names* into *dest*; ``False`` on a miss."""
+
+        entry = self._entry(stage, key)
+        if entry is None or not all((entry / name).exists() for name in names):
+            return False
+        dest.mkdir(parents=True, exist_ok=True)
+        for name in names:
+            shutil.copyfile(entry / name, dest / name)
+        return True
+
+    def save(
+        self,
+        stage: str,
+        key: str,
+        *,
+        arrays: dict[str, np.ndarray] | None = None,
+        files: Sequence[Path] = (),
+    ) -> None:
+        """Store an entry atomically, replacing an existing one for *key*."""
+
+        stage_dir = self.root / stage
+        stage_dir.mkdir(parents=True, exist_ok=True)
+        tmp = Path(tempfile.mkdtemp(prefix=f".{key}.", dir=stage_dir))
+        try:
+            if arrays is not None:
+                with open(tmp / "arrays.npz", "wb") as fh:
+                    np.savez(fh, **arrays)
+            for path in files:
+                shutil.copyfile(path, tmp / path.name)
+            shutil.rmtree(stage_dir / key, ignore_errors=True)
+            try:
+                os.replace(tmp, stage_dir / key)
+            except OSError:  # a concurrent run stored the same entry first
+                pass
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        self._prune(stage_dir)
+
+    def _prune(self, stage_dir: Path) -> None:
+        entries = [p for p in stage_dir.iterdir() if p.is_dir() and not p.name.startswith(".")]
+        entries.sort(key=lambda p: p.stat().st_mtime, reverse=True)
+        for stale in entries[MAX_ENTRIES:]:
+            shutil.rmtree(stale, ignore_errors=True)
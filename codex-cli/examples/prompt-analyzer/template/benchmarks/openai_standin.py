@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""Local stand‑in for the two OpenAI endpoints the analyzer calls.
+
+Benchmarks against the real API measure the network and the account's rate
+limits rather than the pipeline, cost money and are not repeatable.  This
+server answers
+
+``POST /v1/embeddings``
+    deterministic embeddings: the normalised mean of a fixed pseudo‑random
+    vector per word, so prompts sharing words (e.g. of one synthetic topic)
+    get similar vectors.  Both ``encoding_format`` values (``float`` and the
+    client's default ``base64``) are supported.
+``POST /v1/chat/completions``
+    a deterministic ``{"name", "description"}`` JSON reply, as requested by
+    ``label_clusters``.
+``GET /stats``
+    request, input and 429 counters, for per‑stage accounting.
+
+Every request sleeps ``--latency-ms``; a share ``--fail-rate`` of them is
+answered with ``429`` and a ``retry-after-ms`` header instead, to exercise
+the client's back‑off.  Point the ``openai`` client at it with::
+
+    python benchmarks/openai_standin.py --port 8900 --latency-ms 80 --fail-rate 0.02 &
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 OPENAI_API_KEY=standin \\
+        python cluster_prompts.py --csv corpus-10k.csv
+
+:class:`StandinServer` can also be started in‑process (``run_benchmarks.py``
+does).
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+import numpy as np
+
+WORD = re.compile(r"\w+")
+
+
+class _Embedder:
+    """Word‑hash embeddings with a per‑word vector cache."""
+
+    def __init__(self, dim: int) -> None:
+        self.dim = dim
+        self._words: dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def _word(self, word: str) -> np.ndarray:
+        vec = self._words.get(word)
+        if vec is None:
+            seed = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+            vec = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+            with self._lock:
+                self._words[word] = vec
+        return vec
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            words = WORD.findall(text.lower()) or [""]
+            out[i] = np.sum([self._word(w) for w in words], axis=0)
+        out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        return out
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "StandinServer"
+
+    def _reply(self, status: int, body: Any, headers: dict[str, str] | None = None) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:  # noqa: N802 – http.server API
+        if self.path.rstrip("/").endswith("/stats"):
+            self._reply(HTTPStatus.OK, self.server.stats())
+        else:
+            self._reply(HTTPStatus.NOT_FOUND, {"error": {"message": "not found"}})
+
+    def do_POST(self) -> None:  # noqa: N802 – http.server API
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        time.sleep(server.latency)
+        if server.should_fail():
+            self._reply(
+                HTTPStatus.TOO_MANY_REQUESTS,
+                {"error": {"message": "Rate limit reached (stand-in).", "type": "requests"}},
+                {"retry-after-ms": str(server.retry_after_ms)},
+            )
+            return
+
+        if self.path.endswith("/embeddings"):
+            texts = body["input"]
+            texts = [texts] if isinstance(texts, str) else texts
+            vectors = server.embedder.embed(texts)
+            as_base64 = body.get("encoding_format") == "base64"
+            data = [
+                {
+                    "object": "embedding",
+                    "index": i,
+                    "embedding": (
+                        base64.b64encode(vec.astype("<f4").tobytes()).decode("ascii")
+                        if as_base64
+                        else vec.tolist()
+                    ),
+                }
+                for i, vec in enumerate(vectors)
+            ]
+            tokens = sum(len(t) // 4 + 1 for t in texts)
+            server.count(embedding_requests=1, embedding_inputs=len(texts), tokens=tokens)
+            self._reply(
+                HTTPStatus.OK,
+                {
+                    "object": "list",
+                    "data": data,
+                    "model": body.get("model", ""),
+                    "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+                },
+            )
+        elif self.path.endswith("/chat/completions"):
+            prompt = json.dumps(body.get("messages", []), sort_keys=True)
+            tag = hashlib.blake2b(prompt.encode(), digest_size=3).hexdigest()
+            content = json.dumps(
+                {"name": f"Topic {tag}", "description": f"Stand-in description {tag}."}
+            )
+            server.count(chat_requests=1)
+            self._reply(
+                HTTPStatus.OK,
+                {
+                    "id": f"chatcmpl-{tag}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", ""),
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+                },
+            )
+        else:
+            self._reply(HTTPStatus.NOT_FOUND, {"error": {"message": "not found"}})
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        pass
+
+
+class StandinServer(ThreadingHTTPServer):
+    """The stand‑in; ``serve_in_thread`` runs it in the background."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int] = ("127.0.0.1", 0),
+        *,
+        dim: int = 1536,
+        latency_ms: float = 0.0,
+        fail_rate: float = 0.0,
+        retry_after_ms: int = 50,
+        seed: int = 0,
+    ) -> None:
+        super().__init__(address, _Handler)
+        self.embedder = _Embedder(dim)
+        self.latency = latency_ms / 1000
+        self.fail_rate = fail_rate
+        self.retry_after_ms = retry_after_ms
+        self._random = random.Random(seed)
+        self._counters: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            fail = self._random.random() < self.fail_rate
+        if fail:
+            self.count(rate_limited=1)
+        return fail
+
+    def count(self, **counters: int) -> None:
+        with self._lock:
+            for name, n in counters.items():
+                self._counters[name] = self._counters.get(name, 0) + n
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def serve_in_thread(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, name="openai-standin", daemon=True)
+        thread.start()
+        return thread
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Deterministic local stand-in for the OpenAI embeddings and chat endpoints.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimension.")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Delay of every request.")
+    parser.add_argument(
+        "--fail-rate", type=float, default=0.0, help="Share of requests answered with 429."
+    )
+    parser.add_argument(
+        "--retry-after-ms", type=int, default=50, help="retry-after-ms header of 429 replies."
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the 429 injection.")
+    args = parser.parse_args()
+
+    server = StandinServer(
+        (args.host, args.port),
+        dim=args.dim,
+        latency_ms=args.latency_ms,
+        fail_rate=args.fail_rate,
+        retry_after_ms=args.retry_after_ms,
+        seed=args.seed,
+    )
+    print(f"OpenAI stand-in listening on {server.base_url} – Ctrl+C to stop.", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
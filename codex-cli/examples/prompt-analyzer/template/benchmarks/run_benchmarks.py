@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+"""Benchmark the prompt‑analyzer pipeline stage by stage.
+
+For every corpus size the harness generates a synthetic corpus (see
+``synthetic_corpus.py``; cached in ``--work-dir``), starts the OpenAI
+stand‑in (``openai_standin.py``) in‑process and runs each stage of
+``cluster_prompts.py`` in a fresh worker process:
+
+============== ===============================================================
+``embed``      ``load_or_create_embeddings`` into an empty embedding cache
+``embed-warm`` the same again, every prompt a cache hit
+``kmeans``     ``cluster_kmeans`` (also scored against the true topics)
+``dbscan``     ``cluster_dbscan`` (cosine; ANN neighbours above 20k rows)
+``label``      ``label_clusters`` of the K‑Means clusters, without label cache
+``plots``      ``create_plots`` of the K‑Means clusters
+``serve``      ``cluster_prompts.py serve`` until it answers, then one
+               ``/assign`` batch; the neighbour search uses the ANN index at
+               every size (its threshold is lowered to 0)
+============== ===============================================================
+
+A fresh process per stage keeps the measurements independent: the wall and
+CPU time cover only the stage call, and the peak RSS is that of a process
+which has loaded the stage's inputs and run the stage (``rss_before_mib``
+is the peak before the call).  Requests, inputs and 429s the stand‑in saw
+during the stage are recorded as well.  Stages run in the order above and
+read their inputs from the earlier ones' outputs in the work directory.
+
+Before the stages, the startup of ``cluster_prompts.py`` is checked in a
+fresh interpreter: importing it and handling ``--help`` must stay within
+``--startup-budget-ms`` and must not import any of ``HEAVY_MODULES`` (they
+load on first use, see ``lazy_imports.py``).  A violated budget is reported
+and makes the harness exit with status 1 after writing the results.
+
+The results are written as JSON (``--out``) together with the git commit
+and machine details, so runs on different commits can be compared; with
+``--baseline old.json`` a comparison table is printed::
+
+    python benchmarks/run_benchmarks.py --sizes 1k,10k --out bench-new.json \\
+        --baseline bench-old.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))  # cluster_prompts.py and its modules
+sys.path.insert(0, str(HERE))
+
+from openai_standin import StandinServer  # noqa: E402
+from synthetic_corpus import generate_corpus, parse_size, write_corpus  # noqa: E402
+
+RESULTS_VERSION = 1
+STAGES = ("embed", "embed-warm", "kmeans", "dbscan", "label", "plots", "serve")
+EMBEDDING_MODEL = "text-embedding-3-small"
+DBSCAN_ANN_ROWS = 20_000
+HEAVY_MODULES = ("numpy", "pandas", "sklearn", "scipy", "matplotlib", "openai", "pyarrow")
+STARTUP_RUNS = 5
+SERVE_ASSIGN_PROMPTS = 100
+SERVE_READY_TIMEOUT_S = 600
+
+# Run in a fresh interpreter: time the import of cluster_prompts and --help.
+_STARTUP_PROBE = f"""
+import contextlib, io, json, sys, time
+start = time.perf_counter()
+import cluster_prompts
+imported = time.perf_counter()
+sys.argv = ["cluster_prompts.py", "--help"]
+with contextlib.redirect_stdout(io.StringIO()), contextlib.suppress(SystemExit):
+    cluster_prompts.parse_cli()
+done = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - start) * 1e3,
+    "help_ms": (done - start) * 1e3,
+    "heavy": [m for m in {HEAVY_MODULES!r} if m in sys.modules],
+}}))
+"""
+
+
+@dataclass(frozen=True)
+class Config:
+    clusters: int = 20
+    overlap: float = 0.3
+    dim: int = 1536
+    latency_ms: float = 20.0
+    fail_rate: float = 0.01
+    concurrency: int = 8
+    k_max: int = 30
+    projection: str = "pca"
+    seed: int = 0
+
+
+# ---------------------------------------------------------------------------
+# Worker side
+# ---------------------------------------------------------------------------
+
+
+def _standin_stats() -> dict[str, int]:
+    with urllib.request.urlopen(os.environ["OPENAI_BASE_URL"] + "/stats") as resp:
+        return json.loads(resp.read())
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _serve(cp: Any, corpus: str, work: Path, prompts: list[str], config: Config) -> dict:
+    """Run ``serve`` in a thread until ``/health`` answers, then time one ``/assign``."""
+
+    # Serving is the ANN path's only caller below 20k rows; make every size use it.
+    cp.SERVE_EXACT_NEIGHBOR_ROWS = 0
+    shutil.rmtree(work / "serve-labels", ignore_errors=True)
+    for stale in (work / "cache").glob("*/ann-serve.npz"):
+        stale.unlink()
+    port = _free_port()
+    argv = ["serve", "--csv", corpus, "--cache", str(work / "cache"), "--port", str(port)]
+    argv += ["--label-cache", str(work / "serve-labels")]
+    argv += ["--k-max", str(config.k_max), "--seed", str(config.seed)]
+    sys.argv = ["cluster_prompts.py", *argv]  # parse_cli reads sys.argv
+    thread = threading.Thread(target=cp._run, args=(cp.parse_cli(),), daemon=True)
+    start = time.perf_counter()
+    thread.start()
+    url = f"http://127.0.0.1:{port}"
+    while True:
+        if not thread.is_alive():
+            raise SystemExit("'serve' stopped before it answered (see the traceback above).")
+        if time.perf_counter() - start > SERVE_READY_TIMEOUT_S:
+            raise SystemExit(f"'serve' did not answer within {SERVE_READY_TIMEOUT_S} s.")
+        try:
+            with urllib.request.urlopen(url + "/health") as resp:
+                health = json.loads(resp.read())
+            break
+        except OSError:
+            time.sleep(0.05)
+    ready = time.perf_counter() - start
+
+    request = urllib.request.Request(
+        url + "/assign",
+        data=json.dumps({"prompts": prompts, "neighbors": 5}).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    start = time.perf_counter()
+    with urllib.request.urlopen(request) as resp:
+        results = json.loads(resp.read())["results"]
+    assign = time.perf_counter() - start
+    if not all(r["neighbors"] for r in results):
+        raise SystemExit("'serve' returned prompts without neighbours.")
+    # The daemon thread (and its server) end with the worker process.
+    return {
+        "clusters": health["clusters"],
+        "ready_s": round(ready, 4),
+        "assign_s": round(assign, 4),
+        "assign_prompts": len(results),
+    }
+
+
+def _adjusted_rand(truth: Any, labels: Any) -> float:
+    from sklearn.metrics import adjusted_rand_score
+
+    return round(float(adjusted_rand_score(truth, labels)), 4)
+
+
+def _run_stage(stage: str, rows_dir: str, corpus: str, config: Config) -> dict[str, Any]:
+    """Worker‑process entry point: load inputs, time *stage*, save its outputs."""
+
+    import numpy as np
+    import pandas as pd
+
+    import cluster_prompts as cp
+    from embedding_client import ClientOptions
+    from tracing import peak_rss_mib
+
+    work = Path(rows_dir)
+    needs = {
+        "kmeans": ["matrix.npy"],
+        "dbscan": ["matrix.npy"],
+        "label": ["kmeans.npz"],
+        "plots": ["matrix.npy", "kmeans.npz"],
+    }
+    missing = [name for name in needs.get(stage, []) if not (work / name).exists()]
+    if missing:
+        raise SystemExit(f"Stage {stage!r} needs {missing}: include the stage producing it.")
+
+    df = pd.read_csv(corpus)
+    matrix = np.load(work / "matrix.npy") if "matrix.npy" in needs.get(stage, []) else None
+    result = None
+    if stage in ("label", "plots"):
+        with np.load(work / "kmeans.npz") as data:
+            result = cp.ClusterResult.from_arrays({name: data[name] for name in data.files})
+    options = ClientOptions(concurrency=config.concurrency)
+    extra: dict[str, Any] = {}
+
+    rss_before = peak_rss_mib()
+    api_before = _standin_stats()
+    start, cpu = time.perf_counter(), time.process_time()
+
+    if stage in ("embed", "embed-warm"):
+        if stage == "embed":
+            shutil.rmtree(work / "cache", ignore_errors=True)
+        out = cp.load_or_create_embeddings(
+            df["prompt"], cache_path=work / "cache", model=EMBEDDING_MODEL, client_options=options
+        )
+    elif stage == "kmeans":
+        out = cp.cluster_kmeans(matrix, k_max=config.k_max, seed=config.seed)
+    elif stage == "dbscan":
+        out = cp.cluster_dbscan(
+            matrix,
+            min_samples=3,
+            metric="cosine",
+            neighbors="ann" if len(matrix) > DBSCAN_ANN_ROWS else "exact",
+            seed=config.seed,
+        )
+    elif stage == "label":
+        out = cp.label_clusters(df, result, chat_model="gpt-4o-mini", options=options)
+    elif stage == "plots":
+        out = cp.create_plots(
+            matrix, result, df["for_devs"], work / "plots", engine=config.projection
+        )
+    else:
+        out = _serve(cp, corpus, work, df["prompt"][:SERVE_ASSIGN_PROMPTS].tolist(), config)
+
+    wall, cpu = time.perf_counter() - start, time.process_time() - cpu
+    api_after = _standin_stats()
+
+    if stage == "embed":
+        np.save(work / "matrix.npy", np.asarray(out, dtype=np.float32))
+    elif stage in ("kmeans", "dbscan"):
+        extra["clusters"] = len(out.centroids)
+        extra["adjusted_rand"] = _adjusted_rand(df["topic"], out.labels)
+        if stage == "kmeans":
+            extra.update(k=out.k, score=out.score)
+            with open(work / "kmeans.npz", "wb") as fh:
+                np.savez(fh, **out.to_arrays())
+        else:
+            extra["noise_share"] = round(float((out.labels == -1).mean()), 4)
+    elif stage == "serve":
+        extra.update(out)
+
+    return {
+        "stage": stage,
+        "rows": len(df),
+        "wall_s": round(wall, 4),
+        "cpu_s": round(cpu, 4),
+        "peak_rss_mib": round(peak_rss_mib() or 0.0, 1),
+        "rss_before_mib": round(rss_before or 0.0, 1),
+        "api": {
+            name: api_after.get(name, 0) - api_before.get(name, 0)
+            for name in sorted(set(api_before) | set(api_after))
+        },
+        **extra,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Driver
+# ---------------------------------------------------------------------------
+
+
+def _git_state() -> dict[str, Any]:
+    def git(*argv: str) -> str:
+        return subprocess.run(
+            ["git", *argv], cwd=HERE, capture_output=True, text=True, check=True
+        ).stdout.strip()
+
+    try:
+        # Only changes to the analyzer count as dirty.
+        dirty = bool(git("status", "--porcelain", "--", str(HERE.parent)))
+        return {"commit": git("rev-parse", "HEAD"), "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+
+def check_startup(budget_ms: float) -> dict[str, Any]:
+    """Best of ``STARTUP_RUNS`` probes of the ``cluster_prompts.py`` startup."""
+
+    probes = [
+        json.loads(
+            subprocess.run(
+                [sys.executable, "-c", _STARTUP_PROBE],
+                cwd=HERE.parent,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+        )
+        for _ in range(STARTUP_RUNS)
+    ]
+    help_ms = min(p["help_ms"] for p in probes)
+    heavy = sorted({m for p in probes for m in p["heavy"]})
+    return {
+        "import_ms": round(min(p["import_ms"] for p in probes), 1),
+        "help_ms": round(help_ms, 1),
+        "budget_ms": budget_ms,
+        "heavy_modules": heavy,
+        "ok": help_ms <= budget_ms and not heavy,
+    }
+
+
+def _corpus(work_dir: Path, rows: int, config: Config) -> Path:
+    path = work_dir / f"corpus-{rows}-c{config.clusters}-o{config.overlap}-s{config.seed}.csv"
+    if not path.exists():
+        print(f"Generating {rows} prompts…", flush=True)
+        df = generate_corpus(
+            rows, clusters=config.clusters, overlap=config.overlap, seed=config.seed
+        )
+        write_corpus(df, path)
+    return path
+
+
+def _print_table(results: list[dict[str, Any]], baseline: list[dict[str, Any]] | None) -> None:
+    before = {(r["stage"], r["rows"]): r for r in baseline or []}
+    print(f"\n{'stage':<11} {'rows':>9} {'wall s':>9} {'cpu s':>9} {'RSS MiB':>9}", end="")
+    print(f" {'baseline s':>11} {'speed-up':>9}" if baseline is not None else "")
+    for r in results:
+        line = (
+            f"{r['stage']:<11} {r['rows']:>9} {r['wall_s']:>9.3f} {r['cpu_s']:>9.3f} "
+            f"{r['peak_rss_mib']:>9.0f}"
+        )
+        old = before.get((r["stage"], r["rows"]))
+        if baseline is not None:
+            line += (
+                f" {old['wall_s']:>11.3f} {old['wall_s'] / max(r['wall_s'], 1e-9):>8.2f}×"
+                if old
+                else f" {'–':>11} {'–':>9}"
+            )
+        print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Per-stage benchmarks of cluster_prompts.py on synthetic corpora.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--sizes", default="1k,10k", help="Corpus sizes, e.g. 1k,10k,100k,1m.")
+    parser.add_argument(
+        "--stages", default=",".join(STAGES), help=f"Subset of {', '.join(STAGES)}."
+    )
+    parser.add_argument("--out", type=Path, default=Path("benchmark.json"), help="Results file.")
+    parser.add_argument(
+        "--baseline", type=Path, default=None, help="Earlier results file to compare with."
+    )
+    parser.add_argument(
+        "--work-dir", type=Path, default=Path(".bench"), help="Corpora, caches and outputs."
+    )
+    defaults = Config()
+    parser.add_argument(
+        "--clusters",
+        type=int,
+        default=defaults.clusters,
+        help="Number of true topics in the corpus.",
+    )
+    parser.add_argument(
+        "--overlap",
+        type=float,
+        default=defaults.overlap,
+        help="Share of corpus words from the vocabulary all topics share.",
+    )
+    parser.add_argument("--dim", type=int, default=defaults.dim, help="Embedding dimension.")
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=defaults.latency_ms,
+        help="Delay of every request to the stand-in embedding server.",
+    )
+    parser.add_argument(
+        "--fail-rate",
+        type=float,
+        default=defaults.fail_rate,
+        help="Share of stand-in requests answered with 429.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=defaults.concurrency,
+        help="Embedding requests kept in flight.",
+    )
+    parser.add_argument(
+        "--k-max", type=int, default=defaults.k_max, help="Largest k tried by the clustering sweep."
+    )
+    parser.add_argument(
+        "--projection",
+        default=defaults.projection,
+        help="2-D projection of the plots stage: pca, tsne or graph.",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=defaults.seed,
+        help="Seed of the corpus, the 429 injection and the clustering.",
+    )
+    parser.add_argument(
+        "--startup-budget-ms",
+        type=float,
+        default=250.0,
+        help="Most time importing cluster_prompts.py and handling --help may take.",
+    )
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Unknown stage(s): {', '.join(sorted(unknown))}.")
+    stages = [s for s in STAGES if s in stages]
+    sizes = [parse_size(s) for s in args.sizes.split(",")]
+    config = Config(
+        **{name: getattr(args, name) for name in Config.__dataclass_fields__}  # type: ignore
+    )
+    baseline = None
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))["results"]
+
+    startup = check_startup(args.startup_budget_ms)
+    heavy = ", ".join(startup["heavy_modules"])
+    print(
+        f"Startup: import {startup['import_ms']:.0f} ms, --help {startup['help_ms']:.0f} ms "
+        f"(budget {args.startup_budget_ms:.0f} ms){'; imports ' + heavy if heavy else ''}.",
+        flush=True,
+    )
+
+    server = StandinServer(
+        dim=config.dim,
+        latency_ms=config.latency_ms,
+        fail_rate=config.fail_rate,
+        seed=config.seed,
+    )
+    server.serve_in_thread()
+    # Inherited by the spawned workers; the openai client reads both.
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ["OPENAI_API_KEY"] = "standin"
+
+    results: list[dict[str, Any]] = []
+    try:
+        for rows in sizes:
+            corpus = _corpus(args.work_dir, rows, config)
+            rows_dir = args.work_dir / f"run-{rows}"
+            rows_dir.mkdir(parents=True, exist_ok=True)
+            for stage in stages:
+                print(f"[{rows} rows] {stage}…", flush=True)
+                with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+                    result = pool.submit(_run_stage, stage, str(rows_dir), str(corpus), config)
+                    results.append(result.result())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    report = {
+        "version": RESULTS_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git": _git_state(),
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "config": asdict(config),
+        "startup": startup,
+        "results": results,
+    }
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    args.out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    _print_table(results, baseline)
+    print(f"\nResults written to {args.out}.")
+    if not startup["ok"]:
+        raise SystemExit("⚠️  cluster_prompts.py startup exceeds its budget (see 'startup').")
+
+
+if __name__ == "__main__":
+    main()
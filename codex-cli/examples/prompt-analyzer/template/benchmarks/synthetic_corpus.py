@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""Synthetic prompt corpora with a known cluster structure.
+
+The bundled ``prompts.csv`` has 213 rows – too few to tell whether a change
+to the pipeline makes it faster at the sizes it is meant for.  This script
+writes corpora of any size whose cluster structure is controlled:
+
+* Every *topic* (true cluster) owns a vocabulary of ``--topic-words``
+  made‑up words; a prompt draws each word from its topic's vocabulary, or,
+  with probability ``--overlap``, from a vocabulary shared by all topics.
+  ``--overlap 0`` gives well separated clusters, values towards 1 make them
+  blur into each other.
+* Topic sizes follow a Zipf law with exponent ``--imbalance`` (0 = equal
+  sizes).
+* A share ``--duplicates`` of the rows repeats an earlier prompt, with one
+  word changed in half of the cases (near‑duplicates).
+
+Besides ``prompt``, ``act`` (the topic name) and ``for_devs``, the output
+has the true topic id in ``topic`` so clusterings can be scored against it.
+Output is CSV, or JSONL / Parquet by suffix, like ``--csv`` accepts::
+
+    python benchmarks/synthetic_corpus.py --rows 100k --clusters 40 --out corpus-100k.csv
+
+Sizes accept ``k`` / ``m`` suffixes.  The same arguments and ``--seed``
+always produce the same file.
+"""
+
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+SYLLABLES = [c + v for c in "bdfgklmnprstvz" for v in "aeiou"]
+SHARED_WORDS = 400
+
+
+def parse_size(text: str) -> int:
+    """``"10k"`` → 10000, ``"1m"`` → 1000000."""
+
+    text = text.strip().lower().replace("_", "")
+    scale = {"k": 1_000, "m": 1_000_000}.get(text[-1:], 1)
+    return int(float(text.rstrip("km")) * scale)
+
+
+def _vocabulary(rng: np.random.Generator, size: int) -> np.ndarray:
+    words: set[str] = set()
+    while len(words) < size:
+        n = rng.integers(2, 5)
+        words.add("".join(rng.choice(SYLLABLES, size=n)))
+    return np.array(sorted(words), dtype=object)
+
+
+def generate_corpus(
+    rows: int,
+    *,
+    clusters: int = 20,
+    topic_words: int = 60,
+    overlap: float = 0.3,
+    imbalance: float = 1.0,
+    duplicates: float = 0.05,
+    mean_words: int = 18,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """Return a DataFrame with ``prompt``, ``act``, ``for_devs`` and ``topic``."""
+
+    rng = np.random.default_rng(seed)
+    vocab = _vocabulary(rng, clusters * topic_words + SHARED_WORDS)
+    shared = vocab[: SHARED_WORDS]
+    topics = vocab[SHARED_WORDS:].reshape(clusters, topic_words)
+
+    weights = 1.0 / np.arange(1, clusters + 1) ** imbalance
+    topic = rng.choice(clusters, size=rows, p=weights / weights.sum())
+    lengths = np.maximum(3, rng.poisson(mean_words, size=rows))
+
+    # All words at once: a topic word or, with probability `overlap`, a shared one.
+    total = int(lengths.sum())
+    owner = np.repeat(topic, lengths)
+    from_shared = rng.random(total) < overlap
+    words = np.where(
+        from_shared,
+        shared[rng.integers(0, SHARED_WORDS, size=total)],
+        topics[owner, rng.integers(0, topic_words, size=total)],
+    )
+    bounds = np.concatenate([[0], np.cumsum(lengths)])
+    prompts = [" ".join(words[bounds[i] : bounds[i + 1]]) for i in range(rows)]
+
+    # Repeat earlier rows (of the same topic, since the copy keeps its label).
+    n_dups = int(rows * duplicates)
+    if n_dups and rows > 1:
+        targets = rng.choice(np.arange(1, rows), size=min(n_dups, rows - 1), replace=False)
+        for i in targets:
+            source = int(rng.integers(0, i))
+            text = prompts[source]
+            if rng.random() < 0.5:
+                parts = text.split()
+                parts[int(rng.integers(0, len(parts)))] = str(shared[rng.integers(0, SHARED_WORDS)])
+                text = " ".join(parts)
+            prompts[i] = text
+            topic[i] = topic[source]
+
+    names = np.array([f"topic {t:03d} ({topics[t][0]})" for t in range(clusters)], dtype=object)
+    return pd.DataFrame(
+        {
+            "act": names[topic],
+            "prompt": prompts,
+            "for_devs": rng.random(rows) < 0.2,
+            "topic": topic,
+        }
+    )
+
+
+def write_corpus(df: pd.DataFrame, path: Path) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    suffix = path.suffix.lower()
+    if suffix in {".jsonl", ".ndjson"}:
+        df.to_json(path, orient="records", lines=True, force_ascii=False)
+    elif suffix in {".parquet", ".pq"}:
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Write a synthetic prompt corpus with a known cluster structure.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--rows", type=parse_size, default=parse_size("10k"), help="e.g. 1k, 1m")
+    parser.add_argument("--clusters", type=int, default=20, help="Number of true topics.")
+    parser.add_argument("--topic-words", type=int, default=60, help="Vocabulary per topic.")
+    parser.add_argument(
+        "--overlap", type=float, default=0.3, help="Share of words from the shared vocabulary."
+    )
+    parser.add_argument(
+        "--imbalance", type=float, default=1.0, help="Zipf exponent of the topic sizes."
+    )
+    parser.add_argument(
+        "--duplicates", type=float, default=0.05, help="Share of rows repeating an earlier one."
+    )
+    parser.add_argument("--mean-words", type=int, default=18, help="Mean words per prompt.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=Path, required=True, help="CSV, .jsonl or .parquet file.")
+    args = parser.parse_args()
+
+    df = generate_corpus(
+        args.rows,
+        clusters=args.clusters,
+        topic_words=args.topic_words,
+        overlap=args.overlap,
+        imbalance=args.imbalance,
+        duplicates=args.duplicates,
+        mean_words=args.mean_words,
+        seed=args.seed,
+    )
+    write_corpus(df, args.out)
+    print(f"Wrote {len(df)} prompts in {args.clusters} topics to {args.out}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""Persisted cluster model for incremental assignment.
+
+A full run of ``cluster_prompts.py`` embeds, clusters and labels the whole
+corpus.  When only a few hundred prompts are added per day that is wasteful,
+so ``--model-dir`` saves what is needed to classify new prompts later:
+
+* ``model.json`` – embedding model, clustering method and space, and the
+  cluster names / descriptions from ``label_clusters``.
+* ``model.npz`` – centroids (in the clustering space), the feature scaling,
+  the 95th‑percentile member distance ("radius") of every cluster, the PCA
+  basis when clustering ran on a reduced matrix, and for
+  every prompt seen so far its text hash, label, nearest centroid and
+  distance to it.
+
+``cluster_prompts.py assign`` then embeds only prompts whose hash is unknown
+and assigns them to the nearest centroid in one vectorised pass.  Rows that
+lie beyond their cluster's radius are what drift is measured on: during
+training about 5 % of the prompts lie outside (by construction of the
+percentile); when clearly more of the newly assigned prompts do, the clusters
+no longer describe the corpus and a full re‑cluster is warranted.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterable
+
+from embedding_store import KEY_DTYPE, text_key
+from lazy_imports import np
+
+MODEL_VERSION = 1
+RADIUS_PERCENTILE = 95
+# Fewer assigned prompts than this never trigger a re‑cluster recommendation:
+# a handful of outliers would swing the rate by tens of percent.
+DRIFT_MIN_ASSIGNED = 30
+
+
+def text_keys(texts: Iterable[str]) -> np.ndarray:
+    """Content hashes of *texts* as a ``V16`` array."""
+
+    return np.array([text_key(t) for t in texts], dtype=KEY_DTYPE)
+
+
+def nearest_centroids(
+    matrix: np.ndarray, centroids: np.ndarray, chunk_rows: int = 8192
+) -> tuple[np.ndarray, np.ndarray]:
+    """Index of and Euclidean distance to the closest centroid of every row."""
+
+    nearest = np.empty(len(matrix), dtype=np.int64)
+    distance = np.empty(len(matrix), dtype=np.float32)
+    center_sq = np.einsum("ij,ij->i", centroids, centroids)
+    for start in range(0, len(matrix), chunk_rows):
+        block = np.asarray(matrix[start : start + chunk_rows], dtype=np.float32)
+        sq = np.einsum("ij,ij->i", block, block)[:, None] - 2 * block @ centroids.T + center_sq
+        best = np.argmin(sq, axis=1)
+        nearest[start : start + len(block)] = best
+        distance[start : start + len(block)] = np.sqrt(
+            np.maximum(np.take_along_axis(sq, best[:, None], axis=1)[:, 0], 0)
+        )
+    return nearest, distance
+
+
+def _generation(directory: Path) -> int:
+    """Generation of the model currently saved in *directory* (0 if none)."""
+
+    try:
+        meta = json.loads((directory / "model.json").read_text(encoding="utf-8"))
+        return int(meta.get("generation", 0))
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+@dataclass
+class Drift:
+    """Share of prompts beyond their cluster radius, new vs. training."""
+
+    assigned: int
+    trained: int
+    outside_rate: float
+    baseline_rate: float
+    distance_ratio: float
+    threshold: float
+
+    @property
+    def score(self) -> float:
+        return self.outside_rate - self.baseline_rate
+
+    @property
+    def conclusive(self) -> bool:
+        return self.assigned >= DRIFT_MIN_ASSIGNED
+
+    @property
+    def recluster(self) -> bool:
+        return self.conclusive and self.score > self.threshold
+
+
+@dataclass
+class ClusterModel:
+    embedding_model: str
+    method: str
+    space: str
+    centroids: np.ndarray
+    centroid_labels: np.ndarray
+    radii: np.ndarray
+    keys: np.ndarray
+    labels: np.ndarray
+    nearest: np.ndarray
+    distance: np.ndarray
+    trained_rows: int
+    meta: dict[int, dict[str, str]]
+    info: dict[str, Any] = field(default_factory=dict)
+    shift: np.ndarray | None = None
+    scale: np.ndarray | None = None
+    reduce_mean: np.ndarray | None = None
+    reduce_components: np.ndarray | None = None
+
+    @classmethod
+    def from_result(
+        cls,
+        result: Any,
+        meta: dict[int, dict[str, str]],
+        *,
+        embedding_model: str,
+        keys: np.ndarray,
+        reducer: Any = None,
+        options: dict[str, Any] | None = None,
+    ) -> "ClusterModel":
+        """Build a model from a ``ClusterResult`` and the cluster labels.
+
+        *options* (e.g. compaction and near‑duplicate settings) are kept in
+        ``info`` so a re‑cluster can be made the same way.
+        """
+
+        if not len(result.centroids):
+            raise ValueError("The clustering produced no clusters to assign to.")
+        nearest = np.argmin(result.distances, axis=1)
+        distance = result.distances[np.arange(len(nearest)), nearest].astype(np.float32)
+
+        # Radius of every cluster over its own members (noise excluded).
+        radii = np.zeros(len(result.centroids), dtype=np.float32)
+        for j, lbl in enumerate(result.centroid_labels):
+            rows = result.members.get(int(lbl))
+            if rows is not None and len(rows):
+                radii[j] = np.percentile(result.distances[rows, j], RADIUS_PERCENTILE)
+
+        return cls(
+            embedding_model=embedding_model,
+            method=result.method,
+            space=result.space,
+            centroids=np.asarray(result.centroids, dtype=np.float32),
+            centroid_labels=np.asarray(result.centroid_labels, dtype=np.int64),
+            radii=radii,
+            keys=keys,
+            labels=np.asarray(result.labels, dtype=np.int64),
+            nearest=nearest.astype(np.int32),
+            distance=distance,
+            trained_rows=len(keys),
+            meta={int(k): v for k, v in meta.items()},
+            info={
+                "k": result.k,
+                "score": result.score,
+                "score_kind": result.score_kind,
+                **({"options": options} if options is not None else {}),
+            },
+            shift=result.shift,
+            scale=result.scale,
+            reduce_mean=reducer.mean if reducer is not None else None,
+            reduce_components=reducer.components if reducer is not None else None,
+        )
+
+    # ------------------------------------------------------------------
+    # Assignment
+    # ------------------------------------------------------------------
+
+    def transform(self, matrix: np.ndarray) -> np.ndarray:
+        """Map raw embeddings into the space the clusters were fitted in."""
+
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if self.reduce_components is not None:
+            matrix = (matrix - self.reduce_mean) @ self.reduce_components
+        if self.space == "l2":
+            return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        if self.space == "standard":
+            return (matrix - self.shift) / self.scale
+        return matrix
+
+    def unknown(self, keys: np.ndarray) -> np.ndarray:
+        """Boolean mask of *keys* that have not been clustered or assigned."""
+
+        return ~np.isin(keys.view("S16"), self.keys.view("S16"))
+
+    def predict(self, matrix: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Labels, nearest centroid and distance to it for raw embeddings.
+
+        DBSCAN models label rows beyond the radius of their nearest cluster as
+        noise (``-1``), like DBSCAN itself would; K‑Means always assigns.
+        """
+
+        nearest, distance = nearest_centroids(self.transform(matrix), self.centroids)
+        labels = self.centroid_labels[nearest]
+        if self.method == "dbscan":
+            labels = np.where(distance > self.radii[nearest], -1, labels)
+        return labels, nearest, distance
+
+    def assign(self, keys: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+        """Assign new rows like :meth:`predict` and remember them; returns the labels."""
+
+        labels, nearest, distance = self.predict(matrix)
+        self.keys = np.concatenate([self.keys, keys])
+        self.labels = np.concatenate([self.labels, labels])
+        self.nearest = np.concatenate([self.nearest, nearest.astype(np.int32)])
+        self.distance = np.concatenate([self.distance, distance])
+        return labels
+
+    def drift(self, threshold: float) -> Drift:
+        """Compare all rows assigned since training with the training rows."""
+
+        outside = self.distance > self.radii[self.nearest]
+        trained = slice(0, self.trained_rows)
+        assigned = slice(self.trained_rows, None)
+        n_assigned = len(self.keys) - self.trained_rows
+        train_mean = float(self.distance[trained].mean()) if self.trained_rows else 0.0
+        return Drift(
+            assigned=n_assigned,
+            trained=self.trained_rows,
+            outside_rate=float(outside[assigned].mean()) if n_assigned else 0.0,
+            baseline_rate=float(outside[trained].mean()) if self.trained_rows else 0.0,
+            distance_ratio=(
+                float(self.distance[assigned].mean()) / train_mean
+                if n_assigned and train_mean > 0
+                else 1.0
+            ),
+            threshold=threshold,
+        )
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def save(self, directory: Path) -> None:
+        """Write the model to *directory*.
+
+        The arrays go to a new ``model.<generation>.npz``; replacing
+        ``model.json``, which names that file, is the single commit point, so
+        a crash leaves either the old or the new model – never the arrays of
+        one with the metadata of the other.  Older array files are removed
+        afterwards.
+        """
+
+        directory.mkdir(parents=True, exist_ok=True)
+        generation = _generation(directory) + 1
+        arrays_name = f"model.{generation}.npz"
+        arrays = dict(
+            centroids=self.centroids,
+            centroid_labels=self.centroid_labels,
+            radii=self.radii,
+            keys=self.keys,
+            labels=self.labels,
+            nearest=self.nearest,
+            distance=self.distance,
+        )
+        if self.shift is not None:
+            arrays.update(shift=self.shift, scale=self.scale)
+        if self.reduce_components is not None:
+            arrays.update(reduce_mean=self.reduce_mean, reduce_components=self.reduce_components)
+        tmp = directory / f"{arrays_name}.tmp"
+        with open(tmp, "wb") as fh:
+            np.savez(fh, **arrays)
+        os.replace(tmp, directory / arrays_name)
+
+        meta = {
+            "version": MODEL_VERSION,
+            "generation": generation,
+            "arrays": arrays_name,
+            "embedding_model": self.embedding_model,
+            "method": self.method,
+            "space": self.space,
+            "trained_rows": self.trained_rows,
+            "info": self.info,
+            "clusters": {str(k): v for k, v in sorted(self.meta.items())},
+        }
+        tmp = directory / "model.json.tmp"
+        tmp.write_text(json.dumps(meta, indent=2, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, directory / "model.json")
+
+        for stale in directory.glob("model*.npz"):
+            if stale.name != arrays_name:
+                stale.unlink(missing_ok=True)
+
+    @classmethod
+    def load(cls, directory: Path) -> "ClusterModel":
+        try:
+            meta = json.loads((directory / "model.json").read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            raise SystemExit(f"No cluster model in {directory} – run without 'assign' first.")
+        if meta.get("version") != MODEL_VERSION:
+            raise SystemExit(f"Unsupported cluster model version in {directory}.")
+
+        # Models saved before generations were introduced use a fixed name.
+        with np.load(directory / meta.get("arrays", "model.npz")) as data:
+            arrays = {name: data[name] for name in data.files}
+        return cls(
+            embedding_model=meta["embedding_model"],
+            method=meta["method"],
+            space=meta["space"],
+            trained_rows=int(meta["trained_rows"]),
+            info=meta.get("info", {}),
+            meta={int(k): v for k, v in meta["clusters"].items()},
+            centroids=arrays["centroids"],
+            centroid_labels=arrays["centroid_labels"],
+            radii=arrays["radii"],
+            keys=arrays["keys"].astype(KEY_DTYPE),
+            labels=arrays["labels"],
+            nearest=arrays["nearest"],
+            distance=arrays["distance"],
+            shift=arrays.get("shift"),
+            scale=arrays.get("scale"),
+            reduce_mean=arrays.get("reduce_mean"),
+            reduce_components=arrays.get("reduce_components"),
+        )
@@ -6,16 +6,18 @@ The script performs the following steps:
 1.  Read a CSV file that must contain a column named ``prompt``. If an
     ``act`` column is present it is used purely for reporting purposes.
 2.  Create embeddings via the OpenAI API (``text-embedding-3-small`` by
-    default).  The user can optionally provide a JSON cache path so the
-    expensive embedding step is only executed for new / unseen texts.
+    default).  The user can optionally provide a cache directory (see
+    ``embedding_store.py``) so the expensive embedding step is only executed
+    for new / unseen texts.
 3.  Cluster the resulting vectors either with K‑Means (automatically picking
     *k* through the silhouette score) or with DBSCAN.  Outliers are flagged
     as cluster ``-1`` when DBSCAN is selected.
 4.  Ask a Chat Completion model (``gpt-4o-mini`` by default) to come up with a
     short name and description for every cluster.
 5.  Write a human‑readable Markdown report (default: ``analysis.md``).
-6.  Generate a couple of diagnostic plots (cluster sizes and a t‑SNE scatter
-    plot) and store them in ``plots/``.
+6.  Generate a couple of diagnostic plots (cluster sizes and a 2‑D scatter
+    plot of a per‑cluster sample, see ``projection.py``) and store them in
+    ``plots/``.
 
 The script is intentionally opinionated yet configurable via a handful of CLI
 options – run ``python cluster_prompts.py --help`` for details.
@@ -24,16 +26,85 @@ options – run ``python cluster_prompts.py --help`` for details.
 from __future__ import annotations
 
 import argparse
+import atexit
+import functools
+import hashlib
 import json
+import os
+import shutil
 import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
 from pathlib import Path
-from typing import Any, Sequence
-
-import numpy as np
-import pandas as pd
-
-# External, heavy‑weight libraries are imported lazily so that users running the
-# ``--help`` command do not pay the startup cost.
+from typing import Any, Callable, Iterable, Iterator, Sequence
+
+from embedding_client import (
+    BatchLimits,
+    ClientOptions,
+    PlanAssembler,
+    embed_batches,
+    estimate_tokens,
+    plan_batches,
+    run_concurrently,
+)
+from ann_index import RPForestIndex
+from artifact_cache import ArtifactCache, artifact_key
+from columnar_export import export_prompts
+from embedding_backends import is_backend_model, resolve_backend
+from near_duplicates import DuplicateGroups, group_near_duplicates
+from cluster_model import DRIFT_MIN_ASSIGNED, ClusterModel, Drift, text_keys
+from codex_logs import CODEX_SOURCES, CodexLogReader
+from compact_matrix import COMPACT_DTYPES, PCAReducer, QuantizedMatrix
+from projection import ENGINES as PROJECTION_ENGINES, project
+from prompt_service import PromptService, ServiceServer, Snapshot
+from spherical_kmeans import fit_spherical_kmeans
+from stage_graph import Stage, run_stages
+from embedding_store import (
+    SUPPORTED_DTYPES,
+    EmbeddingStore,
+    matrix_fingerprint,
+    store_directory,
+    text_key,
+)
+from lazy_imports import (
+    format_profile,
+    load,
+    np,
+    openai,
+    pd,
+    plt,
+    pq,
+    scipy_sparse,
+    sklearn_cluster,
+    sklearn_metrics,
+    sklearn_neighbors,
+    sklearn_preprocessing,
+    threadpoolctl,
+)
+import tracing
+
+# Stages whose outputs are cached and can be recomputed with --force-stage,
+# and the flags each cached clustering depends on.
+FORCEABLE_STAGES = ("cluster", "label", "plots")
+CLUSTER_PARAMS = {
+    "kmeans": ("k_max", "k_score", "silhouette_sample", "minibatch", "seed"),
+    "spherical": ("k_max", "k_score", "silhouette_sample", "seed"),
+    "dbscan": (
+        "dbscan_min_samples",
+        "dbscan_metric",
+        "neighbors",
+        "eps_sample",
+        "ann_trees",
+        "seed",
+    ),
+}
+
+# External, heavy‑weight libraries come from the ``lazy_imports`` registry and
+# are only imported on first use, so ``--help``, argument errors and runs with
+# nothing to do start without paying for them.
 
 
 def parse_cli() -> argparse.Namespace:  # noqa: D401
@@ -45,36 +116,229 @@ def parse_cli() -> argparse.Namespace:  # noqa: D401
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
     )
 
-    parser.add_argument("--csv", type=Path, default=Path("prompts.csv"), help="Input CSV file.")
+    parser.add_argument(
+        "command",
+        nargs="?",
+        choices=["run", "assign", "serve"],
+        default="run",
+        help="'run' clusters the whole input; 'assign' classifies only prompts unknown to "
+        "the model in --model-dir and appends them to the report; 'serve' keeps the model "
+        "resident and classifies prompts over a local HTTP/JSON API.",
+    )
+    parser.add_argument(
+        "--csv",
+        type=Path,
+        default=Path("prompts.csv"),
+        help="Input file: CSV, or JSONL / Parquet (chosen by file suffix).",
+    )
+    parser.add_argument(
+        "--codex-home",
+        type=Path,
+        default=None,
+        help="Read the user prompts from the logs in this Codex home directory (e.g. "
+        "~/.codex) instead of --csv.",
+    )
+    parser.add_argument(
+        "--codex-source",
+        choices=CODEX_SOURCES,
+        default="history",
+        help="Codex log to read: history.jsonl, or the session rollouts in sessions/.",
+    )
+    parser.add_argument(
+        "--codex-offsets",
+        type=Path,
+        default=None,
+        help="File with the byte offset read so far per Codex log; only prompts appended "
+        "since the last successful run are processed, and the offsets are updated after it.",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Read the input in chunks and spool embeddings to a memory-mapped matrix.",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=50_000,
+        help="Rows per chunk in --stream mode.",
+    )
     parser.add_argument(
         "--cache",
         type=Path,
         default=None,
-        help="Optional JSON cache for embeddings (will be created if it does not exist).",
+        help=(
+            "Optional embedding cache directory (will be created if it does not exist). "
+            "A legacy JSON cache file is imported into '<name>/' next to it."
+        ),
+    )
+    parser.add_argument(
+        "--cache-dtype",
+        choices=SUPPORTED_DTYPES,
+        default="float32",
+        help="Storage precision of newly created embedding caches.",
+    )
+    parser.add_argument(
+        "--cache-max-rows",
+        type=int,
+        default=None,
+        help="Evict least-recently-used cache rows beyond this many embeddings.",
     )
     parser.add_argument(
         "--embedding-model",
         default="text-embedding-3-small",
-        help="OpenAI embedding model to use.",
+        help="OpenAI embedding model to use, or 'local:tfidf-svd[-<dim>]' for the offline "
+        "TF-IDF + SVD backend.",
+    )
+    parser.add_argument(
+        "--embedding-concurrency",
+        type=int,
+        default=4,
+        help="Number of embedding requests kept in flight.",
+    )
+    parser.add_argument(
+        "--embedding-rpm",
+        type=float,
+        default=3000,
+        help="Requests-per-minute budget for the embedding endpoint (0 = unlimited).",
+    )
+    parser.add_argument(
+        "--embedding-tpm",
+        type=float,
+        default=1_000_000,
+        help="Tokens-per-minute budget for the embedding endpoint (0 = unlimited).",
+    )
+    parser.add_argument(
+        "--embedding-batch-tokens",
+        type=int,
+        default=50_000,
+        help="Estimated token ceiling per embedding request (inputs are packed up to it).",
+    )
+    parser.add_argument(
+        "--embedding-max-input-tokens",
+        type=int,
+        default=8191,
+        help="Token limit of the embedding model for a single input.",
+    )
+    parser.add_argument(
+        "--embedding-overlong",
+        choices=["split", "truncate"],
+        default="split",
+        help="How to handle prompts above the input limit: average the vectors of "
+        "their chunks or keep only the first chunk.",
     )
     parser.add_argument(
         "--chat-model",
         default="gpt-4o-mini",
-        help="OpenAI chat model for cluster descriptions.",
+        help="OpenAI chat model for cluster descriptions ('none': skip labelling, e.g. "
+        "offline).",
+    )
+    parser.add_argument(
+        "--label-concurrency",
+        type=int,
+        default=8,
+        help="Number of cluster labelling requests kept in flight.",
+    )
+    parser.add_argument(
+        "--label-cache",
+        type=Path,
+        default=None,
+        help="Directory for cached cluster labels (default: 'labels/' inside --cache; "
+        "no label cache without either).",
     )
 
     # Clustering parameters
+    parser.add_argument(
+        "--near-duplicates",
+        action="store_true",
+        help="Collapse near-duplicate prompts (normalisation + MinHash LSH) before embedding; "
+        "one representative per group is embedded and clustered with its group size as "
+        "weight.",
+    )
+    parser.add_argument(
+        "--dedup-threshold",
+        type=float,
+        default=0.8,
+        help="Estimated Jaccard similarity of word 1-2-grams above which prompts are "
+        "near-duplicates (1.0: only identical after normalisation).",
+    )
+    parser.add_argument(
+        "--reduce-dims",
+        type=int,
+        default=0,
+        help="Project embeddings onto this many principal components before clustering "
+        "(0 = off). The PCA basis is saved in the embedding cache and reused.",
+    )
+    parser.add_argument(
+        "--matrix-dtype",
+        choices=COMPACT_DTYPES,
+        default="float32",
+        help="In-memory precision of the (reduced) matrix used for clustering and plots; "
+        "float16/int8 are dequantised chunk-wise on the fly.",
+    )
     parser.add_argument(
         "--cluster-method",
-        choices=["kmeans", "dbscan"],
+        choices=["kmeans", "spherical", "dbscan"],
         default="kmeans",
-        help="Clustering algorithm to use.",
+        help="Clustering algorithm to use; 'spherical' is K-Means on the cosine similarity of "
+        "L2-normalised rows.",
     )
     parser.add_argument(
         "--k-max",
         type=int,
         default=10,
-        help="Upper bound for k when the kmeans method is selected.",
+        help="Upper bound for k when the kmeans or spherical method is selected.",
+    )
+    parser.add_argument(
+        "--k-score",
+        choices=["auto", "silhouette", "sampled", "simplified"],
+        default="auto",
+        help="How candidate k values are scored: exact silhouette (O(n²)), silhouette on a "
+        "random sample, or the centroid-based simplified silhouette (O(n·k)). 'auto' uses "
+        "the exact score up to --silhouette-sample rows and the sampled one beyond.",
+    )
+    parser.add_argument(
+        "--silhouette-sample",
+        type=int,
+        default=10_000,
+        help="Sample size for the sampled silhouette score.",
+    )
+    parser.add_argument(
+        "--minibatch",
+        choices=["auto", "on", "off"],
+        default="auto",
+        help="Use MiniBatchKMeans for the k sweep ('auto': above 50,000 prompts).",
+    )
+    parser.add_argument(
+        "--hierarchical",
+        action="store_true",
+        help="Two-level taxonomy: coarse clusters (k up to --k-max), each clustered again "
+        "(k up to --fine-k-max) in a process pool. kmeans and spherical only.",
+    )
+    parser.add_argument(
+        "--fine-k-max",
+        type=int,
+        default=10,
+        help="Upper bound for k within every coarse cluster of --hierarchical.",
+    )
+    parser.add_argument(
+        "--fine-jobs",
+        type=int,
+        default=0,
+        help="Worker processes clustering the coarse clusters of --hierarchical "
+        "(0 = all CPUs).",
+    )
+    parser.add_argument(
+        "--k-jobs",
+        type=int,
+        default=0,
+        help="Worker processes for the k sweep (0 = all CPUs from 20,000 prompts on, "
+        "otherwise serial).",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=42,
+        help="Random seed for clustering and sampling (results are reproducible per seed).",
     )
     parser.add_argument(
         "--dbscan-min-samples",
@@ -82,6 +346,32 @@ def parse_cli() -> argparse.Namespace:  # noqa: D401
         default=3,
         help="min_samples parameter for DBSCAN (only relevant when dbscan is selected).",
     )
+    parser.add_argument(
+        "--dbscan-metric",
+        choices=["euclidean", "cosine"],
+        default="euclidean",
+        help="DBSCAN distance: euclidean on standardised features, or cosine on "
+        "L2-normalised vectors (normalised in place, no scaled copy).",
+    )
+    parser.add_argument(
+        "--neighbors",
+        choices=["exact", "ann"],
+        default="exact",
+        help="Neighbour search for DBSCAN: brute force, or an approximate random-projection "
+        "forest that is saved next to the embedding cache.",
+    )
+    parser.add_argument(
+        "--eps-sample",
+        type=int,
+        default=10_000,
+        help="Number of rows used to estimate DBSCAN's eps.",
+    )
+    parser.add_argument(
+        "--ann-trees",
+        type=int,
+        default=8,
+        help="Number of random-projection trees in the ANN index.",
+    )
 
     # Output paths
     parser.add_argument(
@@ -90,8 +380,92 @@ def parse_cli() -> argparse.Namespace:  # noqa: D401
     parser.add_argument(
         "--plots-dir", type=Path, default=Path("plots"), help="Directory that will hold PNG plots."
     )
+    parser.add_argument(
+        "--model-dir",
+        type=Path,
+        default=None,
+        help="Save the cluster model here ('run'), or load it from here ('assign'; the "
+        "stored embedding model is used).",
+    )
+    parser.add_argument(
+        "--max-drift",
+        type=float,
+        default=0.10,
+        help="'assign' recommends a full re-cluster when the share of new prompts outside "
+        "their cluster's radius exceeds the training share by more than this.",
+    )
+    parser.add_argument(
+        "--projection",
+        choices=PROJECTION_ENGINES,
+        default="tsne",
+        help="2-D projection for the scatter plot: PCA, PCA + t-SNE, or a fast "
+        "neighbour-graph layout. Cached in the embedding cache directory.",
+    )
+    parser.add_argument(
+        "--plot-max-per-cluster",
+        type=int,
+        default=500,
+        help="Prompts per cluster drawn in the scatter plot (0 = all).",
+    )
+    parser.add_argument(
+        "--export",
+        type=Path,
+        default=None,
+        help="Also write one row per prompt (cluster, centroid distance, ambiguity, 2-D "
+        "coordinates, embedding) to this file: Parquet, or Arrow IPC for .arrow/.feather.",
+    )
+    parser.add_argument(
+        "--force-stage",
+        action="append",
+        choices=FORCEABLE_STAGES + ("all",),
+        default=[],
+        help="Recompute this stage even if its output is cached (repeatable). Cached stage "
+        "outputs live in 'stages/' inside --cache.",
+    )
+    parser.add_argument(
+        "--host", default="127.0.0.1", help="Address the 'serve' HTTP API listens on."
+    )
+    parser.add_argument("--port", type=int, default=8765, help="Port of the 'serve' HTTP API.")
+    parser.add_argument(
+        "--serve-max-batch",
+        type=int,
+        default=256,
+        help="'serve': most prompts of concurrent requests embedded and assigned together.",
+    )
+    parser.add_argument(
+        "--serve-wait-ms",
+        type=float,
+        default=10,
+        help="'serve': how long the first prompt of a batch waits for further requests.",
+    )
+    parser.add_argument(
+        "--trace",
+        type=Path,
+        default=None,
+        help="Write per-stage timings, CPU time, peak RSS, API calls/tokens and cache hits "
+        "to this file in Chrome trace-event format (chrome://tracing, Perfetto).",
+    )
+    parser.add_argument(
+        "--profile-imports",
+        action="store_true",
+        help="On exit, print how long each heavy module (numpy, pandas, scikit-learn, ...) "
+        "took to import on first use in this process.",
+    )
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.command == "assign" and args.model_dir is None:
+        parser.error("'assign' requires --model-dir.")
+    if args.codex_offsets is not None and args.codex_home is None:
+        parser.error("--codex-offsets requires --codex-home.")
+    if args.command == "serve" and args.codex_offsets is not None:
+        parser.error("'serve' always reads the whole Codex logs; drop --codex-offsets.")
+    if args.hierarchical and args.cluster_method == "dbscan":
+        parser.error("--hierarchical needs --cluster-method kmeans or spherical.")
+    if args.fine_k_max < 2:
+        parser.error("--fine-k-max must be at least 2.")
+    if "all" in args.force_stage:
+        args.force_stage = list(FORCEABLE_STAGES)
+    return args
 
 
 # ---------------------------------------------------------------------------
@@ -103,9 +477,7 @@ def _lazy_import_openai():  # noqa: D401
     """Import *openai* only when needed to keep startup lightweight."""
 
     try:
-        import openai  # type: ignore
-
-        return openai
+        return load(openai)
     except ImportError as exc:  # pragma: no cover – we do not test missing deps.
         raise SystemExit(
             "The 'openai' package is required but not installed.\n"
@@ -113,65 +485,434 @@ def _lazy_import_openai():  # noqa: D401
         ) from exc
 
 
-def embed_texts(texts: Sequence[str], model: str, batch_size: int = 100) -> list[list[float]]:
-    """Embed *texts* with OpenAI and return a list of vectors.
-
-    Uses batching for efficiency but remains on the safe side regarding current
-    OpenAI rate limits (can be adjusted by changing *batch_size*).
+def embed_texts(
+    texts: Sequence[str],
+    model: str,
+    *,
+    options: ClientOptions | None = None,
+    limits: BatchLimits | None = None,
+    on_embedded: Callable[[list[str], np.ndarray], None] | None = None,
+    state_dir: Path | None = None,
+) -> np.ndarray:
+    """Embed *texts* with OpenAI and return a float32 matrix (one row per text).
+
+    Requests are packed by estimated token count (see
+    :func:`embedding_client.plan_batches`) and sent concurrently within the
+    rate limits given by *options*; the output order matches *texts*.
+    *on_embedded* is called with ``(texts, vectors)`` whenever a request
+    completes, so callers can checkpoint partial progress.
+
+    Model names like ``local:tfidf-svd-256`` select a backend from
+    ``embedding_backends.py`` instead; it keeps fitted state in *state_dir*.
     """
 
+    backend = resolve_backend(model, state_dir)
+    if backend is not None:
+        return backend.embed(texts, on_embedded=on_embedded)
+
     openai = _lazy_import_openai()
-    client = openai.OpenAI()
+    # Retries are handled by the engine so it can honour Retry-After globally.
+    client = openai.OpenAI(max_retries=0)
+
+    plan = plan_batches(texts, limits or BatchLimits())
+    assembler = PlanAssembler(plan, on_texts=on_embedded)
+    embed_batches(
+        client,
+        plan.batches,
+        model=model,
+        options=options or ClientOptions(),
+        tokens=plan.batch_tokens,
+        on_batch=assembler.add,
+    )
+    unique_vectors = assembler.result()
+
+    if len(plan.texts) == len(texts):
+        return unique_vectors
+    position = {text: i for i, text in enumerate(plan.texts)}
+    return unique_vectors[[position[t] for t in texts]]
+
+
+def _is_legacy_cache(cache_path: Path) -> bool:
+    return cache_path.suffix == ".json" and cache_path.is_file()
+
+
+def _store_root(cache_path: Path) -> Path:
+    """Directory the embedding store lives in for a given ``--cache`` value."""
+
+    return cache_path.with_suffix("") if _is_legacy_cache(cache_path) else cache_path
+
+
+def _open_store(
+    cache_path: Path, model: str, *, dtype: str, max_rows: int | None
+) -> EmbeddingStore:
+    """Open the embedding store, importing a legacy JSON cache on first use."""
+
+    legacy_json: Path | None = None
+    if _is_legacy_cache(cache_path):
+        legacy_json, cache_path = cache_path, _store_root(cache_path)
+
+    store = EmbeddingStore.open(cache_path, model, dtype=dtype, max_rows=max_rows)
+    if legacy_json is not None and not len(store):
+        imported = store.import_json(legacy_json)
+        print(f"Imported {imported} embedding(s) from {legacy_json}.", flush=True)
+    return store
+
+
+def _embed_missing(
+    store: EmbeddingStore,
+    texts: list[str],
+    *,
+    model: str,
+    client_options: ClientOptions | None,
+    batch_limits: BatchLimits | None,
+    seen: set[int] | None = None,
+) -> tuple[np.ndarray, int, int]:
+    """Embed the *texts* not yet in *store*.
+
+    Returns ``(rows, cached, fresh)``: the store row of every text plus the
+    number of unique texts that were cache hits and freshly embedded.  Store
+    rows in *seen* (updated in place) were already counted by an earlier call
+    of the same run and are not counted as cache hits again.
+    """
 
-    embeddings: list[list[float]] = []
+    rows = store.lookup(texts)
+    missing = rows < 0
+    hits = np.unique(rows[~missing])
+    if seen is not None:
+        hits = [row for row in hits.tolist() if row not in seen]
+    cached = len(hits)
+    texts_to_embed = list(dict.fromkeys(t for t, m in zip(texts, missing) if m))
+    tracing.count("embedding_cache_hits", cached)
+    tracing.count("embedding_cache_misses", len(texts_to_embed))
+
+    if texts_to_embed:
+        print(f"Embedding {len(texts_to_embed)} new prompt(s)…", flush=True)
+        store.begin_run()
+        embed_texts(
+            texts_to_embed,
+            model=model,
+            options=client_options,
+            limits=batch_limits,
+            on_embedded=store.append,
+            state_dir=store.directory,
+        )
+        rows = store.lookup(texts)
 
-    for batch_start in range(0, len(texts), batch_size):
-        batch = texts[batch_start : batch_start + batch_size]
+    if seen is not None:
+        seen.update(np.unique(rows[rows >= 0]).tolist())
+    return rows, cached, len(texts_to_embed)
 
-        response = client.embeddings.create(input=batch, model=model)
-        # The API returns the vectors in the same order as the input list.
-        embeddings.extend(data.embedding for data in response.data)
 
-    return embeddings
+def _finish_embedding(store: EmbeddingStore, cached: int, fresh: int) -> bool:
+    """Close the embedding run, report where vectors came from and compact.
+
+    Returns ``True`` when compaction renumbered the store rows.
+    """
+
+    store.finish_run()
+    resumed = ""
+    if store.resumed_rows:
+        resumed = f" ({store.resumed_rows} checkpointed by an interrupted run)"
+    print(f"Embeddings: {cached} from cache{resumed}, {fresh} freshly embedded.", flush=True)
+    return store.compact() > 0
 
 
 def load_or_create_embeddings(
-    prompts: pd.Series, *, cache_path: Path | None, model: str
-) -> pd.DataFrame:
-    """Return a *DataFrame* with one row per prompt and the embedding columns.
-
-    * If *cache_path* is provided and exists, known embeddings are loaded from
-      the JSON cache so they don't have to be re‑generated.
-    * Missing embeddings are requested from the OpenAI API and subsequently
-      appended to the cache.
-    * The returned DataFrame has the same index as *prompts*.
+    prompts: pd.Series,
+    *,
+    cache_path: Path | None,
+    model: str,
+    cache_dtype: str = "float32",
+    cache_max_rows: int | None = None,
+    client_options: ClientOptions | None = None,
+    batch_limits: BatchLimits | None = None,
+) -> np.ndarray:
+    """Return a float32 matrix with one embedding row per prompt.
+
+    * If *cache_path* is provided, known embeddings are looked up in the
+      :class:`~embedding_store.EmbeddingStore` underneath it so they don't have
+      to be re‑generated.  A legacy JSON cache file is imported on first use.
+    * Missing embeddings are requested from the OpenAI API.  Every completed
+      request is appended (and ``fsync``'ed) to the store straight away, so an
+      interrupted run resumes where it stopped – the texts it already paid for
+      are simply cache hits next time.
+    * Row *i* of the returned matrix belongs to ``prompts.iloc[i]``.  When the
+      cached rows happen to be laid out in prompt order the matrix is a
+      copy‑on‑write view of the store's memory map.
     """
 
-    cache: dict[str, list[float]] = {}
-    if cache_path and cache_path.exists():
-        try:
-            cache = json.loads(cache_path.read_text())
-        except json.JSONDecodeError:  # pragma: no cover – unlikely.
-            print("⚠️  Cache file exists but is not valid JSON – ignoring.", file=sys.stderr)
+    texts = prompts.tolist()
 
-    missing_mask = ~prompts.isin(cache)
+    if cache_path is None:
+        print(f"Embedding {len(set(texts))} new prompt(s)…", flush=True)
+        return embed_texts(texts, model=model, options=client_options, limits=batch_limits)
+
+    with _open_store(cache_path, model, dtype=cache_dtype, max_rows=cache_max_rows) as store:
+        rows, cached, fresh = _embed_missing(
+            store, texts, model=model, client_options=client_options, batch_limits=batch_limits
+        )
+        if _finish_embedding(store, cached, fresh):
+            rows = store.lookup(texts)
+        return store.matrix(rows)
+
+
+# ---------------------------------------------------------------------------
+# Input helpers
+# ---------------------------------------------------------------------------
+
+PROMPT_COLUMNS = ("act", "prompt", "for_devs")
 
-    if missing_mask.any():
-        texts_to_embed = prompts[missing_mask].tolist()
-        print(f"Embedding {len(texts_to_embed)} new prompt(s)…", flush=True)
-        new_embeddings = embed_texts(texts_to_embed, model=model)
 
-        # Update cache (regardless of whether we persist it to disk later on).
-        cache.update(dict(zip(texts_to_embed, new_embeddings)))
+def _lazy_import_parquet():  # noqa: D401
+    """Import *pyarrow.parquet* only when a Parquet file is read."""
 
-        if cache_path:
-            cache_path.parent.mkdir(parents=True, exist_ok=True)
-            cache_path.write_text(json.dumps(cache))
+    try:
+        return load(pq)
+    except ImportError as exc:  # pragma: no cover – we do not test missing deps.
+        raise SystemExit(
+            "Reading Parquet input requires the 'pyarrow' package.\n"
+            "Run 'pip install pyarrow' and try again."
+        ) from exc
+
+
+def _input_format(path: Path) -> str:
+    suffix = path.suffix.lower()
+    if suffix in {".jsonl", ".ndjson"}:
+        return "jsonl"
+    if suffix in {".parquet", ".pq"}:
+        return "parquet"
+    return "csv"
+
+
+def _select_prompt_columns(df: pd.DataFrame) -> pd.DataFrame:
+    if "prompt" not in df.columns:
+        raise SystemExit("Input file must contain a 'prompt' column.")
+    # Keep relevant columns only for clarity.
+    return df[[c for c in df.columns if c in PROMPT_COLUMNS]]
+
+
+def read_prompts(path: Path) -> pd.DataFrame:
+    """Read a CSV, JSONL or Parquet file (chosen by suffix) in one go."""
+
+    fmt = _input_format(path)
+    if fmt == "jsonl":
+        df = pd.read_json(path, lines=True)
+    elif fmt == "parquet":
+        df = _lazy_import_parquet().read_table(path).to_pandas()
+    else:
+        df = pd.read_csv(path)
+    return _select_prompt_columns(df)
 
-    # Build a consistent embeddings matrix
-    vectors = prompts.map(cache.__getitem__).tolist()  # type: ignore[arg-type]
-    mat = np.array(vectors, dtype=np.float32)
-    return pd.DataFrame(mat, index=prompts.index)
+
+def iter_prompt_chunks(path: Path, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """Yield the input file as DataFrames of at most *chunk_size* rows.
+
+    Only the columns the pipeline uses are materialised.
+    """
+
+    fmt = _input_format(path)
+    if fmt == "parquet":
+        parquet = _lazy_import_parquet().ParquetFile(path)
+        columns = [c for c in parquet.schema_arrow.names if c in PROMPT_COLUMNS]
+        for batch in parquet.iter_batches(batch_size=chunk_size, columns=columns):
+            yield _select_prompt_columns(batch.to_pandas())
+        return
+
+    if fmt == "jsonl":
+        reader = pd.read_json(path, lines=True, chunksize=chunk_size)
+    else:
+        reader = pd.read_csv(path, chunksize=chunk_size, usecols=lambda c: c in PROMPT_COLUMNS)
+    with reader:
+        for chunk in reader:
+            yield _select_prompt_columns(chunk)
+
+
+def codex_reader(args: argparse.Namespace) -> CodexLogReader | None:
+    """The reader for ``--codex-home``, or ``None`` when reading ``--csv``."""
+
+    if args.codex_home is None:
+        return None
+    reader = CodexLogReader(args.codex_home, args.codex_source, args.codex_offsets)
+    if not reader.files():
+        raise SystemExit(f"No Codex {args.codex_source} logs found in {args.codex_home}.")
+    return reader
+
+
+def stream_prompts_and_embeddings(
+    chunks: Iterable[pd.DataFrame],
+    *,
+    cache_path: Path | None,
+    model: str,
+    cache_dtype: str = "float32",
+    cache_max_rows: int | None = None,
+    client_options: ClientOptions | None = None,
+    batch_limits: BatchLimits | None = None,
+) -> tuple[pd.DataFrame, np.ndarray]:
+    """Streaming counterpart of :func:`read_prompts` + :func:`load_or_create_embeddings`.
+
+    *chunks* comes from :func:`iter_prompt_chunks` or
+    :meth:`CodexLogReader.chunks`.  Each chunk is deduplicated, looked up in
+    the embedding store, embedded where necessary and its vectors are
+    appended to a spool file.  Once the input is exhausted the spool is
+    memory‑mapped as the final float32 matrix, so peak memory is one chunk
+    plus the prompt columns – never several in‑memory copies of the matrix.
+    Without *cache_path* a temporary store is used so duplicates across
+    chunks are still embedded only once.  Empty input yields an empty frame.
+    """
+
+    spool_dir = Path(tempfile.mkdtemp(prefix="cluster_prompts-"))
+    atexit.register(shutil.rmtree, spool_dir, ignore_errors=True)
+    spool_path = spool_dir / "matrix.f32"
+
+    frames: list[pd.DataFrame] = []
+    n_rows = cached = fresh = 0
+    dim = 0
+    seen: set[int] = set()  # store rows counted so far, for duplicates across chunks
+
+    with _open_store(
+        cache_path or spool_dir / "store", model, dtype=cache_dtype, max_rows=cache_max_rows
+    ) as store, open(spool_path, "wb") as spool:
+        for chunk in chunks:
+            texts = chunk["prompt"].tolist()
+            rows, chunk_cached, chunk_fresh = _embed_missing(
+                store,
+                texts,
+                model=model,
+                client_options=client_options,
+                batch_limits=batch_limits,
+                seen=seen,
+            )
+            block = store.matrix(rows)
+            spool.write(np.ascontiguousarray(block, dtype=np.float32).tobytes())
+
+            dim = block.shape[1]
+            n_rows += len(texts)
+            cached += chunk_cached
+            fresh += chunk_fresh
+            frames.append(chunk)
+            print(f"Streamed {n_rows} prompt(s)…", flush=True)
+
+        _finish_embedding(store, cached, fresh)
+
+    if not n_rows:
+        return pd.DataFrame(columns=["prompt"]), np.empty((0, dim), dtype=np.float32)
+
+    df = pd.concat(frames, ignore_index=True)
+    mat = np.memmap(spool_path, dtype=np.float32, mode="r+", shape=(n_rows, dim))
+    return df, mat
+
+
+# ---------------------------------------------------------------------------
+# Near‑duplicate collapsing
+# ---------------------------------------------------------------------------
+
+
+def find_near_duplicates(df: pd.DataFrame, threshold: float) -> DuplicateGroups:
+    """Group near‑duplicate prompts so only one per group is embedded/clustered."""
+
+    groups = group_near_duplicates(df["prompt"].tolist(), threshold=threshold)
+    print(
+        f"Near‑duplicates: {len(df)} prompts collapsed into {len(groups)} groups "
+        f"(largest: {groups.sizes.max() if len(groups) else 0}).",
+        flush=True,
+    )
+    return groups
+
+
+# ---------------------------------------------------------------------------
+# Compact representation
+# ---------------------------------------------------------------------------
+
+
+def compact_embeddings(
+    matrix: np.ndarray,
+    *,
+    dims: int,
+    dtype: str,
+    pca_path: Path | None,
+    seed: int = 42,
+    normalize: bool = False,
+) -> tuple[np.ndarray, PCAReducer | None, dict[str, Any]]:
+    """Optionally PCA‑reduce and quantise *matrix* for clustering.
+
+    Returns ``(compact, reducer, info)``; *info* describes the reduction for
+    the report.  The PCA basis is loaded from / saved to *pca_path* so that
+    every run (and ``assign``) projects rows the same way.  With *normalize*
+    the (reduced) rows are L2‑normalised before they are quantised.
+    """
+
+    n, dim = matrix.shape
+    before = n * dim * 4
+    reducer: PCAReducer | None = None
+    info: dict[str, Any] = {}
+
+    if dims:
+        reducer = PCAReducer.load(pca_path) if pca_path is not None else None
+        if reducer is None or reducer.mean.shape[0] != dim:
+            print(f"Fitting PCA basis ({dims} components)…", flush=True)
+            reducer = PCAReducer.fit(matrix, dims, seed=seed)
+            if pca_path is not None:
+                reducer.save(pca_path)
+        info["variance"] = reducer.explained_variance(matrix)
+        matrix = reducer.transform(matrix)
+    if normalize:
+        matrix = normalize_rows(matrix)
+    if dtype != "float32":
+        matrix = QuantizedMatrix.quantize(matrix, dtype)
+
+    info["layout"] = f"{matrix.shape[1]} × {dtype}"
+    info["ratio"] = before / max(matrix.nbytes, 1)
+    kept = f", PCA keeps {info['variance']:.1%} of the variance" if dims else ""
+    print(
+        f"Compact matrix: {dim} × float32 ({before / 2**20:.1f} MiB) → {info['layout']} "
+        f"({matrix.nbytes / 2**20:.1f} MiB), {info['ratio']:.1f}× smaller{kept}.",
+        flush=True,
+    )
+    return matrix, reducer, info
+
+
+def compact_for_clustering(
+    matrix: np.ndarray, args: argparse.Namespace
+) -> tuple[np.ndarray, PCAReducer | None, dict[str, Any]]:
+    """:func:`compact_embeddings` with the ``--reduce-dims`` / ``--matrix-dtype`` options."""
+
+    return compact_embeddings(
+        matrix,
+        dims=args.reduce_dims,
+        dtype=args.matrix_dtype,
+        pca_path=(
+            store_directory(_store_root(args.cache), args.embedding_model)
+            / f"pca-{args.reduce_dims}.npz"
+            if args.cache is not None and args.reduce_dims
+            else None
+        ),
+        seed=args.seed,
+        normalize=args.cluster_method == "spherical",
+    )
+
+
+def silhouette_delta(
+    original: np.ndarray,
+    compact: np.ndarray,
+    labels: np.ndarray,
+    *,
+    sample_size: int,
+    seed: int,
+) -> tuple[float, float] | None:
+    """Silhouette of *labels* on the original vs. the compact matrix (same sample)."""
+
+    rows = np.random.RandomState(seed).permutation(len(labels))[:sample_size]
+    try:
+        return (
+            float(
+                sklearn_metrics.silhouette_score(
+                    np.asarray(original[rows], dtype=np.float32), labels[rows]
+                )
+            ),
+            float(sklearn_metrics.silhouette_score(np.asarray(compact[rows]), labels[rows])),
+        )
+    except ValueError:  # a single cluster in the sample
+        return None
 
 
 # ---------------------------------------------------------------------------
@@ -179,90 +920,929 @@ def load_or_create_embeddings(
 # ---------------------------------------------------------------------------
 
 
-def _lazy_import_sklearn_cluster():
-    """Lazy import helper for scikit‑learn *cluster* sub‑module."""
+@dataclass
+class ClusterResult:
+    """Everything later stages need from a clustering run.
+
+    ``distances[i, j]`` is the distance of row *i* to ``centroids[j]``, the
+    centroid of cluster ``centroid_labels[j]`` (DBSCAN centroids are the mean
+    of each cluster's members; noise has none).  ``members`` maps every label
+    – including ``-1`` for noise – to the ascending row indices of its
+    members, so no stage has to scan the label array per cluster.
+
+    ``space`` records how rows were transformed before clustering so that new
+    rows can be mapped into the same space: ``"raw"``, ``"l2"`` (unit rows)
+    or ``"standard"`` (``(x - shift) / scale``).
+
+    A two‑level (``--hierarchical``) result describes the fine clusters;
+    ``parents[j]`` is the coarse cluster of fine cluster *j* and
+    ``parent_centroids`` holds the coarse centroids (see :meth:`coarse`).
+    """
+
+    method: str
+    labels: np.ndarray
+    model: Any
+    centroids: np.ndarray
+    centroid_labels: np.ndarray
+    distances: np.ndarray
+    members: dict[int, np.ndarray]
+    score: float | None = None
+    score_kind: str | None = None
+    k: int | None = None
+    space: str = "raw"
+    shift: np.ndarray | None = None
+    scale: np.ndarray | None = None
+    parents: np.ndarray | None = None
+    parent_centroids: np.ndarray | None = None
+
+    @property
+    def cluster_ids(self) -> list[int]:
+        return sorted(self.members)
+
+    @property
+    def counts(self) -> dict[int, int]:
+        return {lbl: len(rows) for lbl, rows in self.members.items()}
+
+    def nearest_two(self) -> np.ndarray:
+        """Distances to the closest and second closest centroid, shape (n, 2)."""
+
+        if self.distances.shape[1] < 2:
+            raise ValueError("Need at least two centroids.")
+        return np.sort(np.partition(self.distances, 1, axis=1)[:, :2], axis=1)
+
+    def expand(self, rows: np.ndarray) -> "ClusterResult":
+        """Result for a matrix whose row *i* is row ``rows[i]`` of the clustered one.
+
+        Used to propagate the clustering of near‑duplicate representatives to
+        all members of their groups.
+        """
+
+        labels = self.labels[rows]
+        return replace(
+            self, labels=labels, distances=self.distances[rows], members=index_members(labels)
+        )
+
+    def coarse(self) -> "ClusterResult":
+        """The top level of a two‑level result, every fine cluster merged into its parent.
+
+        A row's distance to a coarse cluster is its distance to the nearest
+        of that cluster's fine centroids.
+        """
+
+        if self.parents is None or self.parent_centroids is None:
+            raise ValueError("Not a two-level clustering.")
+        labels = self.parents[self.labels]
+        parent_ids = np.arange(len(self.parent_centroids))
+        distances = np.stack(
+            [self.distances[:, self.parents == p].min(axis=1) for p in parent_ids], axis=1
+        )
+        return replace(
+            self,
+            labels=labels,
+            centroids=self.parent_centroids,
+            centroid_labels=parent_ids,
+            distances=distances,
+            members=index_members(labels),
+            k=len(parent_ids),
+            parents=None,
+            parent_centroids=None,
+        )
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        """Everything but the fitted estimator, for the stage cache."""
+
+        arrays = dict(
+            method=np.array(self.method),
+            space=np.array(self.space),
+            labels=self.labels,
+            centroids=self.centroids,
+            centroid_labels=np.asarray(self.centroid_labels),
+            distances=self.distances,
+        )
+        for name in ("score", "score_kind", "k", "shift", "scale", "parents", "parent_centroids"):
+            if getattr(self, name) is not None:
+                arrays[name] = np.asarray(getattr(self, name))
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, np.ndarray]) -> "ClusterResult":
+        labels = arrays["labels"]
+        return cls(
+            method=str(arrays["method"]),
+            labels=labels,
+            model=None,
+            centroids=arrays["centroids"],
+            centroid_labels=arrays["centroid_labels"],
+            distances=arrays["distances"],
+            members=index_members(labels),
+            score=float(arrays["score"]) if "score" in arrays else None,
+            score_kind=str(arrays["score_kind"]) if "score_kind" in arrays else None,
+            k=int(arrays["k"]) if "k" in arrays else None,
+            space=str(arrays["space"]),
+            shift=arrays.get("shift"),
+            scale=arrays.get("scale"),
+            parents=arrays.get("parents"),
+            parent_centroids=arrays.get("parent_centroids"),
+        )
+
+
+def index_members(labels: np.ndarray) -> dict[int, np.ndarray]:
+    """Group row indices by label with a single stable sort."""
+
+    order = np.argsort(labels, kind="stable")
+    uniq, starts = np.unique(labels[order], return_index=True)
+    return {int(lbl): rows for lbl, rows in zip(uniq, np.split(order, starts[1:]))}
+
+
+def _centroid_distances(
+    matrix: np.ndarray, centroids: np.ndarray, chunk_rows: int = 8192
+) -> np.ndarray:
+    """Euclidean distances of every row to every centroid, as float32."""
+
+    out = np.empty((len(matrix), len(centroids)), dtype=np.float32)
+    center_sq = np.einsum("ij,ij->i", centroids, centroids)
+    for start in range(0, len(matrix), chunk_rows):
+        block = np.asarray(matrix[start : start + chunk_rows], dtype=np.float32)
+        sq = np.einsum("ij,ij->i", block, block)[:, None] - 2 * block @ centroids.T + center_sq
+        out[start : start + len(block)] = np.sqrt(np.maximum(sq, 0))
+    return out
+
+
+def find_ambiguous(result: ClusterResult, threshold: float = 0.9) -> np.ndarray:
+    """Rows that lie almost equally close to their two nearest centroids.
+
+    A row is ambiguous when ``d1 / d2 > threshold``; returns its row indices.
+    """
+
+    if result.distances.shape[1] < 2:
+        return np.empty(0, dtype=np.int64)
+    nearest = result.nearest_two()
+    ratio = nearest[:, 0] / (nearest[:, 1] + 1e-9)
+    return np.flatnonzero(ratio > threshold)
+
+
+# Thresholds for the "auto" settings of the k sweep.
+MINIBATCH_MIN_ROWS = 50_000
+PARALLEL_SWEEP_MIN_ROWS = 20_000
+
+
+def simplified_silhouette(
+    matrix: np.ndarray, labels: np.ndarray, centers: np.ndarray, chunk_rows: int = 8192
+) -> float:
+    """Centroid‑based silhouette approximation in O(n·k).
+
+    For every point *a* is the distance to its own centroid and *b* the
+    distance to the nearest other centroid; the score is the mean of
+    ``(b - a) / max(a, b)``.  Distances are computed chunk‑wise so the memory
+    footprint stays at ``chunk_rows × k``.
+    """
+
+    if len(centers) < 2:
+        raise ValueError("The simplified silhouette needs at least two clusters.")
+
+    total = 0.0
+    for start in range(0, len(matrix), chunk_rows):
+        block_labels = labels[start : start + chunk_rows]
+        dist = _centroid_distances(matrix[start : start + chunk_rows], centers, chunk_rows)
+
+        rows = np.arange(len(block_labels))
+        a = dist[rows, block_labels].copy()
+        dist[rows, block_labels] = np.inf
+        b = dist.min(axis=1)
+        denom = np.maximum(np.maximum(a, b), 1e-12)
+        total += float(((b - a) / denom).sum())
+
+    return total / len(matrix)
+
+
+def _fit_kmeans(
+    matrix: np.ndarray,
+    k: int,
+    *,
+    seed: int,
+    minibatch: bool,
+    sample_weight: np.ndarray | None = None,
+    spherical: bool = False,
+):
+    """Fit (MiniBatch)KMeans with *k* clusters and return the fitted model.
+
+    *spherical* fits :func:`~spherical_kmeans.fit_spherical_kmeans` instead,
+    which handles quantised matrices block by block itself.
+    """
+
+    if spherical:
+        return fit_spherical_kmeans(matrix, k, seed=seed, sample_weight=sample_weight)
+    if isinstance(matrix, QuantizedMatrix):
+        if len(matrix) > QUANTIZED_CHUNK_ROWS:
+            return _fit_kmeans_chunked(matrix, k, seed=seed, sample_weight=sample_weight)
+        matrix = np.asarray(matrix)
+    if minibatch:
+        model = sklearn_cluster.MiniBatchKMeans(
+            n_clusters=k, random_state=seed, n_init="auto", batch_size=4096
+        )
+    else:
+        model = sklearn_cluster.KMeans(n_clusters=k, random_state=seed, n_init="auto")
+    return model.fit(matrix, sample_weight=sample_weight)
+
+
+# Rows dequantised at a time when K‑Means runs on a QuantizedMatrix.
+QUANTIZED_CHUNK_ROWS = 8192
+
+
+def _fit_kmeans_chunked(
+    matrix: QuantizedMatrix,
+    k: int,
+    *,
+    seed: int,
+    sample_weight: np.ndarray | None = None,
+    epochs: int = 3,
+):
+    """MiniBatchKMeans fed with dequantised row chunks of *matrix*.
+
+    Only one chunk is ever held as float32.  ``labels_`` is filled in with a
+    final chunked prediction pass, like a regular fit would.
+    """
+
+    chunk = QUANTIZED_CHUNK_ROWS
+    model = sklearn_cluster.MiniBatchKMeans(
+        n_clusters=k, random_state=seed, n_init="auto", batch_size=chunk
+    )
+    rng = np.random.default_rng(seed)
+    starts = np.arange(0, len(matrix), chunk)
+    for _ in range(epochs):
+        # The first chunk is full, so the k‑means++ initialisation sees ≥ k rows.
+        for start in np.concatenate([starts[:1], rng.permutation(starts[1:])]):
+            weight = None if sample_weight is None else sample_weight[start : start + chunk]
+            model.partial_fit(np.asarray(matrix[start : start + chunk]), sample_weight=weight)
+    model.labels_ = np.concatenate(
+        [model.predict(np.asarray(matrix[start : start + chunk])) for start in starts]
+    )
+    return model
+
 
-    # Importing scikit‑learn is slow; defer until needed.
-    from sklearn.cluster import DBSCAN, KMeans  # type: ignore
-    from sklearn.metrics import silhouette_score  # type: ignore
-    from sklearn.preprocessing import StandardScaler  # type: ignore
+def _score_labels(
+    matrix: np.ndarray,
+    labels: np.ndarray,
+    centers: np.ndarray,
+    *,
+    score: str,
+    sample_size: int,
+    seed: int,
+) -> float:
+    if score == "simplified":
+        return simplified_silhouette(matrix, labels, centers)
+
+    if score == "sampled" and sample_size < len(matrix):
+        # Same random_state for every k, so all candidates are scored on the
+        # same subset and the comparison stays fair and reproducible.  The
+        # subset is drawn like sklearn's ``sample_size`` does, but gathered
+        # first so a compact matrix is only dequantised for the sample.
+        rows = np.random.RandomState(seed).permutation(len(matrix))[:sample_size]
+        return float(sklearn_metrics.silhouette_score(np.asarray(matrix[rows]), labels[rows]))
+    return float(sklearn_metrics.silhouette_score(np.asarray(matrix), labels))
+
+
+# Per‑process state of the k‑sweep workers (set once by the pool initializer
+# instead of pickling the matrix for every task).
+_SWEEP_MATRIX: np.ndarray | None = None
+_SWEEP_WEIGHT: np.ndarray | None = None
+_SWEEP_THREAD_LIMIT: Any = None
+
+
+def _init_sweep_worker(
+    matrix: np.ndarray, blas_threads: int, sample_weight: np.ndarray | None = None
+) -> None:
+    global _SWEEP_MATRIX, _SWEEP_WEIGHT
+    _SWEEP_MATRIX = matrix
+    _SWEEP_WEIGHT = sample_weight
+    _limit_blas_threads(blas_threads)
+
+
+def _limit_blas_threads(blas_threads: int) -> None:
+    global _SWEEP_THREAD_LIMIT
+    try:
+        # Avoid oversubscription: each worker gets its share of the cores.
+        _SWEEP_THREAD_LIMIT = threadpoolctl.threadpool_limits(limits=blas_threads)
+    except ImportError:  # pragma: no cover
+        pass
+
+
+def _sweep_one(
+    k: int,
+    *,
+    score: str,
+    sample_size: int,
+    seed: int,
+    minibatch: bool,
+    spherical: bool = False,
+    matrix: np.ndarray | None = None,
+    sample_weight: np.ndarray | None = None,
+) -> tuple[int, float | None, Any, dict[str, Any]]:
+    """Fit and score one candidate *k*; ``score`` is ``None`` if invalid.
+
+    Returns the fitted model so the winner never has to be refitted, and the
+    timing of the fit for the trace (taken in the worker process).
+    """
 
-    return KMeans, DBSCAN, silhouette_score, StandardScaler
+    timing: dict[str, Any] = dict(
+        start=time.perf_counter(), cpu=time.process_time(), pid=os.getpid()
+    )
+    if matrix is None:
+        matrix, sample_weight = _SWEEP_MATRIX, _SWEEP_WEIGHT
+    model = _fit_kmeans(
+        matrix, k, seed=seed, minibatch=minibatch, sample_weight=sample_weight, spherical=spherical
+    )
+    try:
+        value: float | None = _score_labels(
+            matrix,
+            model.labels_,
+            model.cluster_centers_,
+            score=score,
+            sample_size=sample_size,
+            seed=seed,
+        )
+    except ValueError:
+        # Occurs when a cluster ended up with 1 sample – skip.
+        value = None
+    timing.update(end=time.perf_counter(), cpu=time.process_time() - timing["cpu"])
+    return k, value, model, timing
 
 
-def cluster_kmeans(matrix: np.ndarray, k_max: int) -> np.ndarray:
-    """Auto‑select *k* (in ``[2, k_max]``) via Silhouette score and cluster."""
+def cluster_kmeans(
+    matrix: np.ndarray,
+    k_max: int,
+    *,
+    score: str = "auto",
+    sample_size: int = 10_000,
+    minibatch: str = "auto",
+    n_jobs: int = 0,
+    seed: int = 42,
+    sample_weight: np.ndarray | None = None,
+    spherical: bool = False,
+    verbose: bool = True,
+) -> ClusterResult:
+    """Auto‑select *k* (in ``[2, k_max]``) via Silhouette score and cluster.
+
+    ``score`` picks the model‑selection criterion (see ``--k-score``),
+    ``minibatch`` switches to MiniBatchKMeans and ``n_jobs`` spreads the sweep
+    over a process pool.  *sample_weight* (e.g. near‑duplicate group sizes)
+    weights the K‑Means fits; the silhouette is computed on the rows as
+    given.  Every candidate is fitted with the same *seed* and ties go to the
+    smaller *k*, so the outcome does not depend on the number of workers or
+    the order in which they finish.
+
+    *spherical* runs spherical k‑means (cosine, see ``spherical_kmeans.py``)
+    instead; the rows are L2‑normalised in place first (a quantised matrix
+    is normalised block by block as it is read) and ``minibatch`` is ignored.
+    On unit rows the Euclidean silhouette ranks *k* like a cosine one.
+    """
 
-    KMeans, _, silhouette_score, _ = _lazy_import_sklearn_cluster()
+    n = len(matrix)
+    if score == "auto":
+        score = "silhouette" if n <= sample_size else "sampled"
+    use_minibatch = not spherical and (
+        minibatch == "on" or (minibatch == "auto" and n > MINIBATCH_MIN_ROWS)
+    )
+    if spherical and not isinstance(matrix, QuantizedMatrix):
+        matrix = normalize_rows(matrix)
+
+    ks = list(range(2, k_max + 1))
+    cpus = os.cpu_count() or 1
+    if n_jobs == 0:
+        n_jobs = cpus if n >= PARALLEL_SWEEP_MIN_ROWS else 1
+    n_jobs = max(1, min(n_jobs, len(ks)))
+
+    task = functools.partial(
+        _sweep_one,
+        score=score,
+        sample_size=sample_size,
+        seed=seed,
+        minibatch=use_minibatch,
+        spherical=spherical,
+    )
+    if n_jobs == 1:
+        results = [task(k, matrix=matrix, sample_weight=sample_weight) for k in ks]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=n_jobs,
+            initializer=_init_sweep_worker,
+            initargs=(
+                matrix if isinstance(matrix, QuantizedMatrix) else np.asarray(matrix),
+                max(1, cpus // n_jobs),
+                sample_weight,
+            ),
+        ) as pool:
+            results = list(pool.map(task, ks))
 
     best_k = None
     best_score = -1.0
-    best_labels: np.ndarray | None = None
-
-    for k in range(2, k_max + 1):
-        model = KMeans(n_clusters=k, random_state=42, n_init="auto")
-        labels = model.fit_predict(matrix)
-        try:
-            score = silhouette_score(matrix, labels)
-        except ValueError:
-            # Occurs when a cluster ended up with 1 sample – skip.
-            continue
+    best_model: Any = None
 
-        if score > best_score:
+    for k, value, model, timing in results:
+        tracing.add_span(f"k={k}", cat="k-sweep", score=value, **timing)
+        if value is not None and value > best_score:
             best_k = k
-            best_score = score
-            best_labels = labels
+            best_score = value
+            best_model = model
 
-    if best_labels is None:  # pragma: no cover – highly unlikely.
+    if best_model is None:  # pragma: no cover – highly unlikely.
         raise RuntimeError("Unable to find a suitable number of clusters.")
 
-    print(f"K‑Means selected k={best_k} (silhouette={best_score:.3f}).", flush=True)
-    return best_labels
+    kind = "silhouette" if score == "silhouette" else f"{score} silhouette"
+    if verbose:
+        print(
+            f"{'Spherical K‑Means' if spherical else 'K‑Means'} selected k={best_k} "
+            f"({kind}={best_score:.3f}"
+            f"{', mini-batch' if use_minibatch else ''}).",
+            flush=True,
+        )
+
+    labels = best_model.labels_.astype(np.int64)
+    centroids = best_model.cluster_centers_.astype(np.float32)
+    return ClusterResult(
+        method="spherical" if spherical else "kmeans",
+        labels=labels,
+        model=best_model,
+        centroids=centroids,
+        centroid_labels=np.arange(len(centroids)),
+        distances=_centroid_distances(matrix, centroids),
+        members=index_members(labels),
+        score=best_score,
+        score_kind=score,
+        k=best_k,
+        space="l2" if spherical else "raw",
+    )
+
 
+def normalize_rows(matrix: np.ndarray, chunk_rows: int = 65_536) -> np.ndarray:
+    """L2‑normalise *matrix* in place (chunk‑wise) and return it."""
 
-def cluster_dbscan(matrix: np.ndarray, min_samples: int) -> np.ndarray:
-    """Cluster with DBSCAN; *eps* is estimated via the k‑distance method."""
+    for start in range(0, len(matrix), chunk_rows):
+        block = matrix[start : start + chunk_rows]
+        norms = np.linalg.norm(block, axis=1, keepdims=True)
+        block /= np.maximum(norms, 1e-12)
+    return matrix
 
-    _, DBSCAN, _, StandardScaler = _lazy_import_sklearn_cluster()
 
-    # Scale features – DBSCAN is sensitive to feature scale.
-    scaler = StandardScaler()
-    matrix_scaled = scaler.fit_transform(matrix)
+# Neighbours per row in the ANN graph used by DBSCAN (at least min_samples).
+ANN_NEIGHBORS = 15
+
+
+def _load_or_build_index(
+    matrix: np.ndarray,
+    n_neighbors: int,
+    *,
+    path: Path | None,
+    fingerprint: str,
+    n_trees: int,
+    seed: int,
+) -> RPForestIndex:
+    """Reuse the persisted ANN index when it was built on the same matrix."""
+
+    if path is not None:
+        index = RPForestIndex.load(path)
+        if (
+            index is not None
+            and index.fingerprint == fingerprint
+            and index.n_neighbors >= n_neighbors
+            and index.directions.shape[0] == n_trees
+        ):
+            print(f"Loaded ANN index from {path}.", flush=True)
+            return index
+
+    print(f"Building ANN index ({n_trees} trees, k={n_neighbors})…", flush=True)
+    index = RPForestIndex.build(
+        matrix, n_neighbors, n_trees=n_trees, seed=seed, fingerprint=fingerprint
+    )
+    if path is not None:
+        index.save(path)
+    return index
+
+
+def cluster_dbscan(
+    matrix: np.ndarray,
+    min_samples: int,
+    *,
+    metric: str = "euclidean",
+    neighbors: str = "exact",
+    eps_sample: int = 10_000,
+    ann_trees: int = 8,
+    index_path: Path | None = None,
+    seed: int = 42,
+    sample_weight: np.ndarray | None = None,
+) -> ClusterResult:
+    """Cluster with DBSCAN; *eps* is estimated via the k‑distance method.
+
+    * ``metric="euclidean"`` standardises the features first (original
+      behaviour); ``"cosine"`` L2‑normalises *matrix* **in place** instead, so
+      no scaled copy is made and Euclidean distances become monotone in cosine
+      distance.
+    * The k‑distance percentile is estimated on at most *eps_sample* rows.
+    * ``neighbors="ann"`` replaces the brute‑force neighbour search with a
+      random‑projection forest (see ``ann_index.py``) and runs DBSCAN on the
+      resulting sparse neighbour graph.  The index is persisted to
+      *index_path* and reused while the matrix is unchanged.
+
+    Centroids (and the distances to them) are computed in the clustering
+    space from each cluster's members; noise gets no centroid.
+    *sample_weight* counts a row that many times towards ``min_samples`` and
+    the centroids.
+    """
+
+    if isinstance(matrix, QuantizedMatrix):
+        # Scaling and neighbour search need float rows; the matrix is already
+        # reduced, so dequantising it is comparatively cheap.
+        matrix = np.asarray(matrix)
+
+    if metric == "cosine":
+        fingerprint = matrix_fingerprint(matrix) + "|cosine" if neighbors == "ann" else ""
+        matrix_scaled = normalize_rows(matrix)
+    else:
+        fingerprint = matrix_fingerprint(matrix) + "|scaled" if neighbors == "ann" else ""
+        # Scale features – DBSCAN is sensitive to feature scale.
+        scaler = sklearn_preprocessing.StandardScaler()
+        matrix_scaled = scaler.fit_transform(matrix)
+
+    n = len(matrix_scaled)
+    rng = np.random.default_rng(seed)
+    sample = (
+        np.sort(rng.choice(n, size=eps_sample, replace=False)) if n > eps_sample else np.arange(n)
+    )
 
     # Heuristic: use the median of the distances to the ``min_samples``‑th
     # nearest neighbour as eps. This is a commonly used rule of thumb.
-    from sklearn.neighbors import NearestNeighbors  # type: ignore  # lazy import
-
-    neigh = NearestNeighbors(n_neighbors=min_samples)
-    neigh.fit(matrix_scaled)
-    distances, _ = neigh.kneighbors(matrix_scaled)
-    kth_distances = distances[:, -1]
+    # (Like sklearn's kneighbors on training data, the point itself counts.)
+    if neighbors == "ann":
+        index = _load_or_build_index(
+            matrix_scaled,
+            max(min_samples, ANN_NEIGHBORS),
+            path=index_path,
+            fingerprint=fingerprint,
+            n_trees=ann_trees,
+            seed=seed,
+        )
+        kth_distances = (
+            index.knn_distances[sample, min_samples - 2]
+            if min_samples >= 2
+            else np.zeros(len(sample))
+        )
+    else:
+        neigh = sklearn_neighbors.NearestNeighbors(n_neighbors=min_samples)
+        neigh.fit(matrix_scaled)
+        distances, _ = neigh.kneighbors(matrix_scaled[sample])
+        kth_distances = distances[:, -1]
     eps = float(np.percentile(kth_distances, 90))  # choose a high‑ish value.
 
-    print(f"DBSCAN min_samples={min_samples}, eps={eps:.3f}", flush=True)
-    model = DBSCAN(eps=eps, min_samples=min_samples)
-    return model.fit_predict(matrix_scaled)
+    shown = f"{eps:.3f}" if metric != "cosine" else f"{eps:.3f} (cosine {eps * eps / 2:.3f})"
+    print(f"DBSCAN min_samples={min_samples}, eps={shown}", flush=True)
+
+    if neighbors == "ann":
+        keep = index.knn_distances <= eps
+        rows = np.repeat(np.arange(n), keep.sum(axis=1))
+        # Sparse maths drops explicit zeros, so exact duplicates get a tiny
+        # positive distance to stay neighbours.
+        graph = scipy_sparse.csr_matrix(
+            (np.maximum(index.knn_distances[keep], 1e-12), (rows, index.knn_indices[keep])),
+            shape=(n, n),
+        )
+        # k‑NN relations are not symmetric, ε‑neighbourhoods are: without this
+        # dense regions fall apart into many small components.
+        graph = graph.maximum(graph.T).tocsr()
+        model = sklearn_cluster.DBSCAN(eps=eps, min_samples=min_samples, metric="precomputed")
+        labels = model.fit_predict(graph, sample_weight=sample_weight).astype(np.int64)
+    else:
+        model = sklearn_cluster.DBSCAN(eps=eps, min_samples=min_samples)
+        labels = model.fit_predict(matrix_scaled, sample_weight=sample_weight).astype(np.int64)
+
+    members = index_members(labels)
+    centroid_labels = np.array([lbl for lbl in sorted(members) if lbl != -1], dtype=np.int64)
+    dim = matrix_scaled.shape[1]
+    centroids = np.empty((len(centroid_labels), dim), dtype=np.float32)
+    for j, lbl in enumerate(centroid_labels):
+        rows = members[int(lbl)]
+        centroids[j] = np.average(
+            np.asarray(matrix_scaled[rows], dtype=np.float32),
+            axis=0,
+            weights=None if sample_weight is None else sample_weight[rows],
+        )
+
+    return ClusterResult(
+        method="dbscan",
+        labels=labels,
+        model=model,
+        centroids=centroids,
+        centroid_labels=centroid_labels,
+        distances=_centroid_distances(matrix_scaled, centroids),
+        members=members,
+        space="l2" if metric == "cosine" else "standard",
+        shift=None if metric == "cosine" else scaler.mean_.astype(np.float32),
+        scale=None if metric == "cosine" else scaler.scale_.astype(np.float32),
+    )
+
+
+# Coarse clusters with fewer rows than this are not split further.
+FINE_MIN_ROWS = 20
+
+
+def _cluster_fine(
+    matrix: np.ndarray, sample_weight: np.ndarray | None, **kwargs: Any
+) -> tuple[np.ndarray, np.ndarray | None, dict[str, Any]]:
+    """Cluster the rows of one coarse cluster; returns labels, centroids and timing.
+
+    Centroids are ``None`` when no *k* of the sweep gets a valid score (e.g.
+    all rows are the same repeated prompt): the rows stay one fine cluster.
+    """
+
+    timing: dict[str, Any] = dict(
+        start=time.perf_counter(), cpu=time.process_time(), pid=os.getpid()
+    )
+    try:
+        fine = cluster_kmeans(
+            matrix, sample_weight=sample_weight, n_jobs=1, verbose=False, **kwargs
+        )
+        labels, centroids = fine.labels, fine.centroids
+    except RuntimeError:
+        labels, centroids = np.zeros(len(matrix), dtype=np.int64), None
+    timing.update(end=time.perf_counter(), cpu=time.process_time() - timing["cpu"])
+    return labels, centroids, timing
+
+
+def cluster_hierarchical(
+    matrix: np.ndarray,
+    k_max: int,
+    fine_k_max: int,
+    *,
+    score: str = "auto",
+    sample_size: int = 10_000,
+    minibatch: str = "auto",
+    n_jobs: int = 0,
+    fine_jobs: int = 0,
+    seed: int = 42,
+    sample_weight: np.ndarray | None = None,
+    spherical: bool = False,
+) -> ClusterResult:
+    """Two‑level clustering: coarse clusters, then every coarse cluster on its own.
+
+    The coarse level is a regular :func:`cluster_kmeans` sweep up to *k_max*.
+    Every coarse cluster of at least ``FINE_MIN_ROWS`` rows is then clustered
+    again with a sweep up to *fine_k_max*, in a pool of *fine_jobs* processes
+    (largest first), so the second level costs about as much as sweeping the
+    largest coarse cluster instead of all rows up to ``k_max × fine_k_max``.
+
+    Returns a result of the fine clusters (numbered coarse cluster by coarse
+    cluster) whose ``parents`` map them to the coarse clusters.
+    """
+
+    coarse = cluster_kmeans(
+        matrix,
+        k_max,
+        score=score,
+        sample_size=sample_size,
+        minibatch=minibatch,
+        n_jobs=n_jobs,
+        seed=seed,
+        sample_weight=sample_weight,
+        spherical=spherical,
+    )
+    coarse_ids = [lbl for lbl in sorted(coarse.members) if lbl != -1]
+    groups = [coarse.members[lbl] for lbl in coarse_ids]
+    split = sorted(
+        (i for i, rows in enumerate(groups) if len(rows) >= FINE_MIN_ROWS),
+        key=lambda i: -len(groups[i]),
+    )
+    kwargs = dict(
+        score=score, sample_size=sample_size, minibatch=minibatch, seed=seed, spherical=spherical
+    )
+
+    def task(i: int) -> tuple[Callable[..., Any], np.ndarray, np.ndarray | None]:
+        rows = groups[i]
+        run = functools.partial(_cluster_fine, k_max=min(fine_k_max, len(rows) - 1), **kwargs)
+        return run, matrix[rows], None if sample_weight is None else sample_weight[rows]
+
+    cpus = os.cpu_count() or 1
+    if fine_jobs == 0:
+        fine_jobs = cpus
+    fine_jobs = max(1, min(fine_jobs, len(split)))
+    fine: dict[int, tuple[np.ndarray, np.ndarray | None, dict[str, Any]]] = {}
+    if fine_jobs == 1:
+        for i in split:
+            run, *task_args = task(i)
+            fine[i] = run(*task_args)
+    else:
+        with ProcessPoolExecutor(
+            max_workers=fine_jobs,
+            initializer=_limit_blas_threads,
+            initargs=(max(1, cpus // fine_jobs),),
+        ) as pool:
+            futures = {i: pool.submit(*task(i)) for i in split}
+            fine = {i: future.result() for i, future in futures.items()}
+
+    labels = np.empty(len(matrix), dtype=np.int64)
+    centroids: list[np.ndarray] = []
+    parents: list[int] = []
+    for parent, rows in enumerate(groups):
+        fine_labels = np.zeros(len(rows), dtype=np.int64)
+        fine_centroids = None
+        if parent in fine:
+            fine_labels, fine_centroids, timing = fine[parent]
+            tracing.add_span(
+                f"coarse cluster {parent}",
+                cat="fine clustering",
+                rows=len(rows),
+                k=1 if fine_centroids is None else len(fine_centroids),
+                **timing,
+            )
+        if fine_centroids is None:
+            # Too small (or too uniform) to split: one fine cluster, centred on
+            # the coarse one.
+            fine_centroids = coarse.centroids[[coarse_ids[parent]]]
+        labels[rows] = fine_labels + len(centroids)
+        centroids.extend(fine_centroids)
+        parents.extend([parent] * len(fine_centroids))
+
+    centroids_arr = np.asarray(centroids, dtype=np.float32)
+    print(
+        f"Hierarchical: {len(groups)} coarse clusters → {len(centroids_arr)} fine clusters "
+        f"({len(split)} split, {fine_jobs} worker{'s' if fine_jobs > 1 else ''}).",
+        flush=True,
+    )
+    return ClusterResult(
+        method=coarse.method,
+        labels=labels,
+        model=None,
+        centroids=centroids_arr,
+        centroid_labels=np.arange(len(centroids_arr)),
+        distances=_centroid_distances(matrix, centroids_arr),
+        members=index_members(labels),
+        score=coarse.score,
+        score_kind=coarse.score_kind,
+        k=len(centroids_arr),
+        space=coarse.space,
+        parents=np.asarray(parents, dtype=np.int64),
+        parent_centroids=coarse.centroids[coarse_ids],
+    )
+
+
+def _normalizes_in_place(args: argparse.Namespace) -> bool:
+    """Whether the selected method L2‑normalises the float matrix it is given in place."""
+
+    return args.cluster_method == "spherical" or (
+        args.cluster_method == "dbscan" and args.dbscan_metric == "cosine"
+    )
+
+
+def cluster_matrix(
+    matrix: np.ndarray, args: argparse.Namespace, sample_weight: np.ndarray | None = None
+) -> ClusterResult:
+    """Cluster *matrix* with the method and parameters selected on the command line."""
+
+    if args.hierarchical:
+        return cluster_hierarchical(
+            matrix,
+            k_max=args.k_max,
+            fine_k_max=args.fine_k_max,
+            score=args.k_score,
+            sample_size=args.silhouette_sample,
+            minibatch=args.minibatch,
+            n_jobs=args.k_jobs,
+            fine_jobs=args.fine_jobs,
+            seed=args.seed,
+            sample_weight=sample_weight,
+            spherical=args.cluster_method == "spherical",
+        )
+    if args.cluster_method in ("kmeans", "spherical"):
+        return cluster_kmeans(
+            matrix,
+            k_max=args.k_max,
+            score=args.k_score,
+            sample_size=args.silhouette_sample,
+            minibatch=args.minibatch,
+            n_jobs=args.k_jobs,
+            seed=args.seed,
+            sample_weight=sample_weight,
+            spherical=args.cluster_method == "spherical",
+        )
+    return cluster_dbscan(
+        matrix,
+        min_samples=args.dbscan_min_samples,
+        metric=args.dbscan_metric,
+        neighbors=args.neighbors,
+        eps_sample=args.eps_sample,
+        ann_trees=args.ann_trees,
+        index_path=(
+            store_directory(_store_root(args.cache), args.embedding_model)
+            / f"ann-{args.dbscan_metric}.npz"
+            if args.cache is not None and args.neighbors == "ann"
+            else None
+        ),
+        seed=args.seed,
+        sample_weight=sample_weight,
+    )
 
 
 # ---------------------------------------------------------------------------
 # Cluster labelling helpers (LLM)
 # ---------------------------------------------------------------------------
 
+LABEL_SYSTEM_PROMPT = (
+    "You are an expert analyst, competent in summarising text clusters succinctly."
+)
+LABEL_USER_TEMPLATE = (
+    "The following text snippets are all part of the same semantic cluster.\n"
+    "Please propose \n"
+    "1. A very short *title* for the cluster (≤ 4 words).\n"
+    "2. A concise 2–3 sentence *description* that explains the common theme.\n\n"
+    "Answer **strictly** as valid JSON with the keys 'name' and 'description'.\n\n"
+    "Snippets:\n"
+    "{snippets}"
+)
+
+
+def _label_cache_key(chat_model: str, examples: Sequence[str]) -> str:
+    """Cache key of one labelling request.
+
+    The examples are hashed and sorted, so the key only changes when the chat
+    model, the prompt template or the set of example prompts changes.
+    """
+
+    payload = json.dumps(
+        [
+            chat_model,
+            LABEL_SYSTEM_PROMPT,
+            LABEL_USER_TEMPLATE,
+            sorted(text_key(t).hex() for t in examples),
+        ]
+    )
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _read_cached_label(cache_dir: Path | None, key: str) -> dict[str, str] | None:
+    if cache_dir is None:
+        return None
+    try:
+        data = json.loads((cache_dir / f"{key}.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    return {"name": str(data["name"]), "description": str(data["description"])}
+
+
+def _write_cached_label(cache_dir: Path | None, key: str, label: dict[str, str]) -> None:
+    if cache_dir is None:
+        return
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    path = cache_dir / f"{key}.json"
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(label, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _parse_label_reply(reply: str) -> dict[str, str]:
+    """Extract ``{"name", "description"}`` from a chat completion reply."""
+
+    # Extract the JSON object even if the assistant wrapped it in markdown
+    # code fences or added other text: take the substring between the first
+    # "{" and the last "}".
+    reply_clean = reply.strip()
+    m_start = reply_clean.find("{")
+    m_end = reply_clean.rfind("}")
+    if m_start == -1 or m_end == -1:
+        raise ValueError("No JSON object found in model reply.")
+
+    data = json.loads(reply_clean[m_start : m_end + 1])
+    return {
+        "name": str(data.get("name", "Unnamed"))[:60],
+        "description": str(data.get("description", "")).strip(),
+    }
+
 
 def label_clusters(
-    df: pd.DataFrame, labels: np.ndarray, chat_model: str, max_examples: int = 12
+    df: pd.DataFrame,
+    result: ClusterResult,
+    chat_model: str,
+    max_examples: int = 12,
+    *,
+    options: ClientOptions | None = None,
+    cache_dir: Path | None = None,
+    refresh: bool = False,
 ) -> dict[int, dict[str, str]]:
     """Generate a name & description for each cluster label via ChatGPT.
 
+    Requests for all clusters are issued concurrently (bounded by
+    ``options.concurrency``) with retry/backoff.  Replies are cached as one
+    small JSON file per request in *cache_dir*, so rerunning on unchanged
+    clusters makes no API calls; *refresh* requests every label anew (and
+    overwrites the cached replies).
+
     Returns a mapping ``label -> {"name": str, "description": str}``.
     """
 
-    openai = _lazy_import_openai()
-    client = openai.OpenAI()
-
+    options = options or ClientOptions(concurrency=8)
     out: dict[int, dict[str, str]] = {}
+    prompts = df["prompt"]
 
-    for lbl in sorted(set(labels)):
+    pending: list[tuple[int, str, list[dict[str, str]]]] = []
+    n_cached = 0
+    for lbl in result.cluster_ids:
         if lbl == -1:
             # Noise (DBSCAN) – skip LLM call.
             out[lbl] = {
@@ -271,57 +1851,81 @@ def label_clusters(
             }
             continue
 
+        if chat_model == "none":
+            out[lbl] = {"name": f"Cluster {lbl}", "description": ""}
+            continue
+
         # Pick a handful of example prompts to send to the model.
-        examples_series = df.loc[labels == lbl, "prompt"].sample(
-            min(max_examples, (labels == lbl).sum()), random_state=42
-        )
+        rows = result.members[lbl]
+        examples_series = prompts.iloc[rows].sample(min(max_examples, len(rows)), random_state=42)
         examples = examples_series.tolist()
 
-        user_content = (
-            "The following text snippets are all part of the same semantic cluster.\n"
-            "Please propose \n"
-            "1. A very short *title* for the cluster (≤ 4 words).\n"
-            "2. A concise 2–3 sentence *description* that explains the common theme.\n\n"
-            "Answer **strictly** as valid JSON with the keys 'name' and 'description'.\n\n"
-            "Snippets:\n"
-        )
-        user_content += "\n".join(f"- {t}" for t in examples)
+        key = _label_cache_key(chat_model, examples)
+        cached = None if refresh else _read_cached_label(cache_dir, key)
+        if cached is not None:
+            out[lbl] = cached
+            n_cached += 1
+            continue
 
+        user_content = LABEL_USER_TEMPLATE.format(
+            snippets="\n".join(f"- {t}" for t in examples)
+        )
         messages = [
-            {
-                "role": "system",
-                "content": "You are an expert analyst, competent in summarising text clusters succinctly.",
-            },
+            {"role": "system", "content": LABEL_SYSTEM_PROMPT},
             {"role": "user", "content": user_content},
         ]
+        pending.append((lbl, key, messages))
+
+    latencies: dict[int, float] = {}
+
+    if pending:
+        openai = _lazy_import_openai()
+        # Retries are handled by run_concurrently so that 429s back off
+        # across all workers instead of per request.
+        client = openai.OpenAI(max_retries=0)
+        started: dict[int, float] = {}
+
+        def make_job(lbl: int, messages: list[dict[str, str]]) -> Callable[[], dict[str, str]]:
+            def job() -> dict[str, str]:
+                # Latency is measured from the first attempt, retries included.
+                started.setdefault(lbl, time.perf_counter())
+                resp = client.chat.completions.create(model=chat_model, messages=messages)
+                label = _parse_label_reply(resp.choices[0].message.content)
+                latencies[lbl] = time.perf_counter() - started[lbl]
+                return label
+
+            return job
+
+        def on_result(i: int, label: Any) -> None:
+            lbl, key, _ = pending[i]
+            if isinstance(label, Exception):
+                print(f"⚠️  Failed to label cluster {lbl}: {label}", file=sys.stderr)
+                out[lbl] = {"name": f"Cluster {lbl}", "description": "<LLM call failed>"}
+            else:
+                out[lbl] = label
+                _write_cached_label(cache_dir, key, label)
+
+        run_concurrently(
+            [make_job(lbl, messages) for lbl, _, messages in pending],
+            tokens=[sum(estimate_tokens(m["content"]) for m in msgs) for _, _, msgs in pending],
+            options=options,
+            what="labelling request",
+            on_result=on_result,
+            return_exceptions=True,
+        )
 
-        try:
-            resp = client.chat.completions.create(model=chat_model, messages=messages)
-            reply = resp.choices[0].message.content.strip()
-
-            # Extract the JSON object even if the assistant wrapped it in markdown
-            # code fences or added other text.
-
-            # Remove common markdown fences.
-            reply_clean = reply.strip()
-            # Take the substring between the first "{" and the last "}".
-            m_start = reply_clean.find("{")
-            m_end = reply_clean.rfind("}")
-            if m_start == -1 or m_end == -1:
-                raise ValueError("No JSON object found in model reply.")
-
-            json_str = reply_clean[m_start : m_end + 1]
-            data = json.loads(json_str)  # type: ignore[arg-type]
-
-            out[lbl] = {
-                "name": str(data.get("name", "Unnamed"))[:60],
-                "description": str(data.get("description", "")).strip(),
-            }
-        except Exception as exc:  # pragma: no cover – network / runtime errors.
-            print(f"⚠️  Failed to label cluster {lbl}: {exc}", file=sys.stderr)
-            out[lbl] = {"name": f"Cluster {lbl}", "description": "<LLM call failed>"}
+    if cache_dir is not None:
+        tracing.count("label_cache_hits", n_cached)
+        tracing.count("label_cache_misses", len(pending))
+    print(
+        f"Labels: {n_cached} from cache, {len(pending)} requested "
+        f"({len(latencies)} succeeded).",
+        flush=True,
+    )
+    for lbl in sorted(latencies):
+        print(f"  cluster {lbl}: {latencies[lbl]:.2f}s", flush=True)
 
-    return out
+    return {lbl: out[lbl] for lbl in result.cluster_ids}
 
 
 # ---------------------------------------------------------------------------
@@ -331,17 +1935,23 @@ def label_clusters(
 
 def generate_markdown_report(
     df: pd.DataFrame,
-    labels: np.ndarray,
+    result: ClusterResult,
     meta: dict[int, dict[str, str]],
     outputs: dict[str, Any],
     path_md: Path,
 ):
-    """Write a self‑contained Markdown analysis to *path_md*."""
+    """Write a self‑contained Markdown analysis to *path_md*.
+
+    A two‑level result (``result.parents``) with the coarse labels in
+    ``outputs["coarse_meta"]`` is reported as a taxonomy: every coarse
+    cluster with its fine clusters nested below it.
+    """
 
     path_md.parent.mkdir(parents=True, exist_ok=True)
 
-    cluster_ids = sorted(set(labels))
-    counts = {lbl: int((labels == lbl).sum()) for lbl in cluster_ids}
+    cluster_ids = result.cluster_ids
+    counts = result.counts
+    prompts = df["prompt"]
 
     lines: list[str] = []
 
@@ -349,83 +1959,236 @@ def generate_markdown_report(
     lines.append(f"Generated by `cluster_prompts.py` – {pd.Timestamp.now()}\n")
 
     # High‑level stats
-    total = len(labels)
+    total = len(result.labels)
     num_clusters = len(cluster_ids) - (1 if -1 in cluster_ids else 0)
     lines.append("\n## Overview\n")
     lines.append(f"* Total prompts: **{total}**")
-    lines.append(f"* Clustering method: **{outputs['method']}**")
-    if outputs.get("k"):
-        lines.append(f"* k (K‑Means): **{outputs['k']}**")
-        lines.append(f"* Silhouette score: **{outputs['silhouette']:.3f}**")
+    lines.append(f"* Clustering method: **{result.method}**")
+    if result.k:
+        lines.append(f"* k (K‑Means): **{result.k}**")
+    coarse_meta = outputs.get("coarse_meta")
+    if result.parents is not None:
+        lines.append(
+            f"* Hierarchy: **{len(result.parent_centroids)}** coarse clusters → "
+            f"**{len(result.centroids)}** fine clusters"
+        )
+    if result.score is not None:
+        kind = "" if result.score_kind == "silhouette" else f" ({result.score_kind})"
+        level = " of the coarse level" if result.parents is not None else ""
+        lines.append(f"* Silhouette score{kind}{level}: **{result.score:.3f}**")
+    compact = outputs.get("compact")
+    if compact is not None:
+        kept = ""
+        if "variance" in compact:
+            kept = f", PCA keeps {compact['variance']:.1%} of the variance"
+        line = f"* Compact matrix: **{compact['layout']}**, {compact['ratio']:.1f}× smaller{kept}"
+        if compact.get("silhouette") is not None:
+            before, after = compact["silhouette"]
+            line += f"; silhouette {before:.3f} → {after:.3f} (Δ {after - before:+.3f})"
+        lines.append(line)
+    if outputs.get("exported") is not None:
+        lines.append(f"* Per‑prompt data: `{outputs['exported']}`")
+    groups: DuplicateGroups | None = outputs.get("duplicate_groups")
+    if groups is not None:
+        lines.append(
+            f"* Near‑duplicate groups: **{len(groups)}** (largest: {groups.sizes.max()} prompts)"
+        )
     lines.append(f"* Final clusters (excluding noise): **{num_clusters}**\n")
 
-    # Summary table
-    lines.append("\n| label | name | #prompts | description |")
-    lines.append("|-------|------|---------:|-------------|")
-    for lbl in cluster_ids:
-        meta_lbl = meta[lbl]
-        lines.append(f"| {lbl} | {meta_lbl['name']} | {counts[lbl]} | {meta_lbl['description']} |")
-
-    # Detailed section per cluster
-    for lbl in cluster_ids:
-        lines.append("\n---\n")
+    def cluster_section(lbl: int) -> None:
         meta_lbl = meta[lbl]
         lines.append(f"### Cluster {lbl}: {meta_lbl['name']} ({counts[lbl]} prompts)\n")
         lines.append(f"{meta_lbl['description']}\n")
 
         # Show a handful of illustrative prompts.
         sample_n = min(5, counts[lbl])
-        examples = df.loc[labels == lbl, "prompt"].sample(sample_n, random_state=42).tolist()
+        examples = prompts.iloc[result.members[lbl]].sample(sample_n, random_state=42).tolist()
         lines.append("\nExamples:\n")
         lines.extend([f"* {t}" for t in examples])
 
+    if result.parents is not None and coarse_meta is not None:
+        # Taxonomy: coarse table, then every coarse cluster with its fine ones.
+        children = index_members(result.parents)
+        lines.append("\n| coarse | name | #prompts | fine clusters | description |")
+        lines.append("|-------:|------|---------:|--------------:|-------------|")
+        for parent in sorted(children):
+            size = sum(counts.get(int(lbl), 0) for lbl in children[parent])
+            lines.append(
+                f"| {parent} | {coarse_meta[parent]['name']} | {size} | "
+                f"{len(children[parent])} | {coarse_meta[parent]['description']} |"
+            )
+        for parent in sorted(children):
+            fine = [int(lbl) for lbl in children[parent] if int(lbl) in counts]
+            lines.append("\n---\n")
+            lines.append(
+                f"## {parent}. {coarse_meta[parent]['name']} "
+                f"({sum(counts[lbl] for lbl in fine)} prompts)\n"
+            )
+            lines.append(f"{coarse_meta[parent]['description']}\n")
+            lines.append("\n| label | name | #prompts | description |")
+            lines.append("|-------|------|---------:|-------------|")
+            for lbl in fine:
+                meta_lbl = meta[lbl]
+                lines.append(
+                    f"| {lbl} | {meta_lbl['name']} | {counts[lbl]} | {meta_lbl['description']} |"
+                )
+            for lbl in fine:
+                lines.append("")
+                cluster_section(lbl)
+    else:
+        # Summary table
+        lines.append("\n| label | name | #prompts | description |")
+        lines.append("|-------|------|---------:|-------------|")
+        for lbl in cluster_ids:
+            meta_lbl = meta[lbl]
+            lines.append(
+                f"| {lbl} | {meta_lbl['name']} | {counts[lbl]} | {meta_lbl['description']} |"
+            )
+
+        # Detailed section per cluster
+        for lbl in cluster_ids:
+            lines.append("\n---\n")
+            cluster_section(lbl)
+
     # Outliers / ambiguous prompts, if any.
     if -1 in cluster_ids:
         lines.append("\n---\n")
         lines.append(f"### Noise / outliers ({counts[-1]} prompts)\n")
         examples = (
-            df.loc[labels == -1, "prompt"].sample(min(10, counts[-1]), random_state=42).tolist()
+            prompts.iloc[result.members[-1]].sample(min(10, counts[-1]), random_state=42).tolist()
         )
         lines.extend([f"* {t}" for t in examples])
 
-    # Optional ambiguous set (for kmeans)
+    # Optional ambiguous set (for kmeans and spherical)
     ambiguous = outputs.get("ambiguous", [])
     if ambiguous:
         lines.append("\n---\n")
         lines.append(f"### Potentially ambiguous prompts ({len(ambiguous)})\n")
         lines.extend([f"* {t}" for t in ambiguous])
 
+    # Largest near‑duplicate groups
+    if groups is not None and len(groups) < total:
+        sizes = groups.sizes
+        top = np.argsort(-sizes, kind="stable")[:10]
+        top = top[sizes[top] > 1]
+        lines.append("\n---\n")
+        lines.append(f"### Largest near‑duplicate groups ({int((sizes > 1).sum())} in total)\n")
+        lines.append("| size | cluster | representative |")
+        lines.append("|-----:|--------:|----------------|")
+        for g in top:
+            row = groups.representatives[g]
+            text = " ".join(str(prompts.iloc[row]).split())
+            text = (text if len(text) <= 100 else text[:99] + "…").replace("|", "\\|")
+            lines.append(f"| {sizes[g]} | {result.labels[row]} | {text} |")
+
     # Plot references
     lines.append("\n---\n")
     lines.append("## Plots\n")
     lines.append(
-        "The directory `plots/` contains a bar chart of the cluster sizes and a t‑SNE scatter plot coloured by cluster.\n"
+        "The directory `plots/` contains a bar chart of the cluster sizes and a "
+        f"{outputs.get('projection', 't‑SNE')} scatter plot coloured by cluster.\n"
     )
 
     path_md.write_text("\n".join(lines))
 
 
+def append_assignment_report(
+    new: pd.DataFrame,
+    labels: np.ndarray,
+    model: ClusterModel,
+    drift: Drift,
+    *,
+    known: int,
+    path_md: Path,
+):
+    """Append the prompts classified by ``assign`` to the report at *path_md*."""
+
+    lines: list[str] = []
+    lines.append("\n---\n")
+    lines.append(f"## Incremental assignment – {pd.Timestamp.now()}\n")
+    lines.append(f"* New prompts: **{len(new)}** ({known} already known, skipped)")
+    lines.append(
+        f"* Outside their cluster's radius: **{drift.outside_rate:.1%}** of "
+        f"{drift.assigned} prompts assigned since the last full run "
+        f"(training: {drift.baseline_rate:.1%}); mean distance ratio "
+        f"{drift.distance_ratio:.2f}"
+    )
+    if not drift.conclusive:
+        verdict = f"too few assigned prompts to judge (fewer than {DRIFT_MIN_ASSIGNED})"
+    elif drift.recluster:
+        verdict = "**re‑cluster recommended**"
+    else:
+        verdict = "clusters still fit"
+    lines.append(f"* Drift: {drift.score:+.1%} (threshold {drift.threshold:.0%}) – {verdict}\n")
+
+    members = index_members(labels)
+    lines.append("\n| label | name | #new |")
+    lines.append("|-------|------|-----:|")
+    for lbl in sorted(members):
+        name = model.meta.get(lbl, {}).get("name", "Noise / Outlier" if lbl == -1 else "")
+        lines.append(f"| {lbl} | {name} | {len(members[lbl])} |")
+
+    prompts = new["prompt"]
+    for lbl in sorted(members):
+        sample_n = min(5, len(members[lbl]))
+        examples = prompts.iloc[members[lbl]].sample(sample_n, random_state=42).tolist()
+        lines.append(f"\n#### Cluster {lbl}\n")
+        lines.extend([f"* {t}" for t in examples])
+
+    path_md.parent.mkdir(parents=True, exist_ok=True)
+    prefix = "" if path_md.exists() else "# Prompt Clustering Report\n"
+    with open(path_md, "a", encoding="utf-8") as fh:
+        fh.write(prefix + "\n".join(lines) + "\n")
+
+
 # ---------------------------------------------------------------------------
 # Plotting helpers
 # ---------------------------------------------------------------------------
 
 
+PROJECTION_TITLES = {"pca": "PCA", "tsne": "t‑SNE", "graph": "Neighbour‑graph"}
+
+
 def create_plots(
     matrix: np.ndarray,
-    labels: np.ndarray,
+    result: ClusterResult,
     for_devs: pd.Series | None,
     plots_dir: Path,
-):
-    """Generate cluster size and t‑SNE plots."""
+    *,
+    engine: str = "tsne",
+    max_per_cluster: int = 500,
+    seed: int = 42,
+    cache_path: Path | None = None,
+    fingerprint: str = "",
+    artifacts: ArtifactCache | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Generate cluster size and projection plots.
+
+    Returns the projected sample ``(rows, xy)``.  *cache_path* caches the
+    projection (see :func:`projection.project`); *artifacts* caches the
+    finished PNGs together with it, keyed by *fingerprint* (of *matrix*), the
+    labels and the plot parameters.
+    """
 
-    import matplotlib.pyplot as plt  # type: ignore – heavy, lazy import.
-    from sklearn.manifold import TSNE  # type: ignore – heavy, lazy import.
+    names = ["cluster_sizes.png", f"{engine}.png"]
+    key = ""
+    if artifacts is not None:
+        for_devs_key = None if for_devs is None else for_devs.astype(bool).to_numpy()
+        key = artifact_key(
+            "plots", fingerprint, result.labels, for_devs_key, engine, max_per_cluster, seed
+        )
+        cached = artifacts.load_arrays("plots", key)
+        if cached is not None and artifacts.load_files("plots", key, names, plots_dir):
+            print(f"Restored plots from the stage cache ({key[:12]}).", flush=True)
+            tracing.count("stage_cache_hits")
+            return cached["rows"], cached["xy"]
 
     plots_dir.mkdir(parents=True, exist_ok=True)
 
     # Bar chart with cluster sizes
-    unique, counts = np.unique(labels, return_counts=True)
-    order = np.argsort(-counts)  # descending
+    unique = np.array(result.cluster_ids)
+    counts = np.array([len(result.members[lbl]) for lbl in unique])
+    order = np.argsort(-counts, kind="stable")  # descending
     unique, counts = unique[order], counts[order]
 
     plt.figure(figsize=(8, 4))
@@ -434,25 +2197,34 @@ def create_plots(
     plt.ylabel("# prompts")
     plt.title("Cluster sizes")
     plt.tight_layout()
-    bar_path = plots_dir / "cluster_sizes.png"
+    bar_path = plots_dir / names[0]
     plt.savefig(bar_path, dpi=150)
     plt.close()
 
-    # t‑SNE scatter
-    tsne = TSNE(
-        n_components=2, perplexity=min(30, len(matrix) // 3), random_state=42, init="random"
+    # Projection scatter on a per‑cluster capped sample
+    rows, xy = project(
+        matrix,
+        result.labels,
+        engine=engine,
+        max_per_cluster=max_per_cluster,
+        seed=seed,
+        cache_path=cache_path,
+        fingerprint=fingerprint or (matrix_fingerprint(matrix) if cache_path is not None else ""),
+        refresh=artifacts is not None and "plots" in artifacts.force,
     )
-    xy = tsne.fit_transform(matrix)
 
     plt.figure(figsize=(7, 6))
-    scatter = plt.scatter(xy[:, 0], xy[:, 1], c=labels, cmap="tab20", s=20, alpha=0.8)
-    plt.title("t‑SNE projection")
+    plt.scatter(xy[:, 0], xy[:, 1], c=result.labels[rows], cmap="tab20", s=20, alpha=0.8)
+    title = f"{PROJECTION_TITLES[engine]} projection"
+    if len(rows) < len(matrix):
+        title += f" ({len(rows):,} of {len(matrix):,} prompts)"
+    plt.title(title)
     plt.xticks([])
     plt.yticks([])
 
     if for_devs is not None:
         # Overlay dev prompts as black edge markers
-        dev_mask = for_devs.astype(bool).values
+        dev_mask = for_devs.astype(bool).values[rows]
         plt.scatter(
             xy[dev_mask, 0],
             xy[dev_mask, 1],
@@ -464,80 +2236,525 @@ def create_plots(
         )
         plt.legend(loc="best")
 
-    tsne_path = plots_dir / "tsne.png"
+    scatter_path = plots_dir / names[1]
     plt.tight_layout()
-    plt.savefig(tsne_path, dpi=150)
+    plt.savefig(scatter_path, dpi=150)
     plt.close()
+    if artifacts is not None:
+        artifacts.save("plots", key, arrays=dict(rows=rows, xy=xy), files=[bar_path, scatter_path])
+    return rows, xy
 
 
 # ---------------------------------------------------------------------------
-# Main entry point
+# Incremental assignment
 # ---------------------------------------------------------------------------
 
 
-def main() -> None:  # noqa: D401
-    args = parse_cli()
+def assign_new_prompts(
+    args: argparse.Namespace,
+    embedding_kwargs: dict[str, Any],
+    reader: CodexLogReader | None = None,
+) -> None:
+    """Classify prompts unknown to the saved model without re‑clustering."""
+
+    with tracing.span("load") as stage:
+        model = ClusterModel.load(args.model_dir)
+        if is_backend_model(model.embedding_model) and args.cache is None:
+            # The local basis lives in the cache; refitting it would change the space.
+            raise SystemExit(
+                f"Model {model.embedding_model!r} needs the --cache it was built with."
+            )
+        df = reader.read() if reader is not None else read_prompts(args.csv)
+        stage.update(rows=len(df))
+    if df.empty:
+        print("No new prompts – nothing to assign.", flush=True)
+        return
+    keys = text_keys(df["prompt"])
+
+    # Only the first occurrence of every unknown prompt is new.
+    _, first = np.unique(keys.view("S16"), return_index=True)
+    is_new = np.zeros(len(df), dtype=bool)
+    is_new[first] = True
+    is_new &= model.unknown(keys)
+    new = df[is_new].reset_index(drop=True)
+    print(f"{len(new)} new prompt(s), {len(df) - len(new)} already known.", flush=True)
+
+    labels = np.empty(0, dtype=np.int64)
+    if len(new):
+        embedding_kwargs = dict(embedding_kwargs, model=model.embedding_model)
+        with tracing.span("embed") as stage:
+            mat = load_or_create_embeddings(new["prompt"], **embedding_kwargs)
+            stage.update(matrix_shape=list(mat.shape), dtype=str(mat.dtype))
+        with tracing.span("assign"):
+            labels = model.assign(keys[is_new], mat)
+            model.save(args.model_dir)
+
+    drift = model.drift(args.max_drift)
+    print(
+        f"Drift: {drift.outside_rate:.1%} of {drift.assigned} assigned prompts outside their "
+        f"cluster radius (training: {drift.baseline_rate:.1%}).",
+        flush=True,
+    )
+    if drift.recluster:
+        print("⚠️  Clusters no longer fit the new prompts – run a full re‑cluster.", file=sys.stderr)
 
-    # Read CSV – require a 'prompt' column.
-    df = pd.read_csv(args.csv)
-    if "prompt" not in df.columns:
-        raise SystemExit("Input CSV must contain a 'prompt' column.")
+    if len(new):
+        with tracing.span("report"):
+            append_assignment_report(
+                new, labels, model, drift, known=len(df) - len(new), path_md=args.output_md
+            )
+        print(f"✅ Done. Assignments appended to {args.output_md}", flush=True)
 
-    # Keep relevant columns only for clarity.
-    df = df[[c for c in df.columns if c in {"act", "prompt", "for_devs"}]]
 
-    # ---------------------------------------------------------------------
-    # 1. Embeddings (may be cached)
-    # ---------------------------------------------------------------------
-    embeddings_df = load_or_create_embeddings(
-        df["prompt"], cache_path=args.cache, model=args.embedding_model
-    )
+# ---------------------------------------------------------------------------
+# Service mode
+# ---------------------------------------------------------------------------
 
-    # ---------------------------------------------------------------------
-    # 2. Clustering
-    # ---------------------------------------------------------------------
-    mat = embeddings_df.values.astype(np.float32)
+# Above this many indexed prompts, 'serve' finds neighbours with an ANN index.
+SERVE_EXACT_NEIGHBOR_ROWS = 20_000
+
+# Options a saved model was built with; 'serve' re‑clusters with the same ones.
+MODEL_OPTIONS = ("reduce_dims", "matrix_dtype", "near_duplicates", "dedup_threshold")
+
+
+def model_options(args: argparse.Namespace) -> dict[str, Any]:
+    return {name: getattr(args, name) for name in MODEL_OPTIONS}
 
-    if args.cluster_method == "kmeans":
-        labels = cluster_kmeans(mat, k_max=args.k_max)
-    else:
-        labels = cluster_dbscan(mat, min_samples=args.dbscan_min_samples)
 
-    # Identify potentially ambiguous prompts (only meaningful for kmeans).
-    outputs: dict[str, Any] = {"method": args.cluster_method}
-    if args.cluster_method == "kmeans":
-        from sklearn.cluster import KMeans  # type: ignore – lazy
+def _adopt_model_options(args: argparse.Namespace, model: ClusterModel) -> None:
+    """Set the compaction and near‑duplicate options to those *model* was built with."""
+
+    options = model.info.get("options")
+    if options is None:
+        # Saved before the options were recorded: only the PCA size is known.
+        dims = model.reduce_components.shape[1] if model.reduce_components is not None else 0
+        options = {"reduce_dims": dims}
+    changed: list[str] = []
+    for name, value in options.items():
+        if name not in MODEL_OPTIONS or getattr(args, name) == value:
+            continue
+        flag = f"--{name.replace('_', '-')}"
+        if isinstance(value, bool):
+            changed.append(flag if value else f"no {flag}")
+        else:
+            changed.append(f"{flag} {value}")
+        setattr(args, name, value)
+    if changed:
+        print(f"Re‑clusters use the model's options: {', '.join(changed)}.", flush=True)
 
-        best_k = len(set(labels))
-        # Re‑fit KMeans with the chosen k to get distances.
-        kmeans = KMeans(n_clusters=best_k, random_state=42, n_init="auto").fit(mat)
-        outputs["k"] = best_k
-        # Silhouette score (again) – not super efficient but okay.
-        from sklearn.metrics import silhouette_score  # type: ignore
 
-        outputs["silhouette"] = silhouette_score(mat, labels)
+def _label_cache_dir(args: argparse.Namespace) -> Path | None:
+    if args.label_cache is None and args.cache is not None:
+        return _store_root(args.cache) / "labels"
+    return args.label_cache
 
-        distances = kmeans.transform(mat)
-        # Ambiguous if the ratio between 1st and 2nd closest centroid < 1.1
-        sorted_dist = np.sort(distances, axis=1)
-        ratio = sorted_dist[:, 0] / (sorted_dist[:, 1] + 1e-9)
-        ambiguous_mask = ratio > 0.9  # tunes threshold – close centroids.
-        outputs["ambiguous"] = df.loc[ambiguous_mask, "prompt"].tolist()
 
+def serve(args: argparse.Namespace, embedding_kwargs: dict[str, Any]) -> None:
+    """Keep store, model and neighbour index resident and answer HTTP requests.
+
+    The model in ``--model-dir`` is used when there is one (with its
+    embedding model, as in ``assign``); otherwise the input is clustered on
+    start‑up.  Re‑clusters save the new model there.  See
+    ``prompt_service.py`` for the API.
+    """
+
+    model: ClusterModel | None = None
+    if args.model_dir is not None and (args.model_dir / "model.json").exists():
+        model = ClusterModel.load(args.model_dir)
+        args.embedding_model = model.embedding_model
+        _adopt_model_options(args, model)
+
+    cache_path = args.cache
+    if cache_path is None:
+        spool_dir = Path(tempfile.mkdtemp(prefix="cluster_prompts-"))
+        atexit.register(shutil.rmtree, spool_dir, ignore_errors=True)
+        cache_path = spool_dir / "store"
+    store = _open_store(
+        cache_path,
+        args.embedding_model,
+        dtype=embedding_kwargs["cache_dtype"],
+        max_rows=embedding_kwargs["cache_max_rows"],
+    )
+    store_lock = threading.Lock()  # the batcher and a re-cluster embed concurrently
+
+    def embed(texts: list[str]) -> np.ndarray:
+        with store_lock:
+            rows, _, fresh = _embed_missing(
+                store,
+                texts,
+                model=args.embedding_model,
+                client_options=embedding_kwargs["client_options"],
+                batch_limits=embedding_kwargs["batch_limits"],
+            )
+            if fresh:
+                store.finish_run()
+            return np.array(store.matrix(rows), dtype=np.float32)
+
+    def corpus() -> list[str]:
+        reader = codex_reader(args)
+        df = reader.read() if reader is not None else read_prompts(args.csv)
+        return df["prompt"].tolist()
+
+    def snapshot(
+        model: ClusterModel, texts: list[str], raw: np.ndarray, labels: np.ndarray
+    ) -> Snapshot:
+        matrix = model.transform(raw)
+        index = None
+        if len(texts) > SERVE_EXACT_NEIGHBOR_ROWS:
+            index = _load_or_build_index(
+                matrix,
+                ANN_NEIGHBORS,
+                path=(
+                    store_directory(_store_root(args.cache), args.embedding_model)
+                    / "ann-serve.npz"
+                    if args.cache is not None
+                    else None
+                ),
+                fingerprint=matrix_fingerprint(matrix),
+                n_trees=args.ann_trees,
+                seed=args.seed,
+            )
+        return Snapshot(model, texts, labels, matrix, index)
+
+    def build(extra: list[str]) -> Snapshot:
+        texts = list(dict.fromkeys(corpus() + extra))
+        raw = embed(texts)
+        # Compacted and deduplicated like a full run, so the saved model (and
+        # its PCA basis) matches what 'assign' and later starts expect.
+        groups: DuplicateGroups | None = None
+        if args.near_duplicates:
+            groups = find_near_duplicates(pd.DataFrame({"prompt": texts}), args.dedup_threshold)
+            # Fancy indexing copies, which the in‑place normalisation needs.
+            mat = raw[groups.representatives]
+        else:
+            mat = raw.copy()
+        reducer: PCAReducer | None = None
+        if args.reduce_dims or args.matrix_dtype != "float32":
+            mat, reducer, _ = compact_for_clustering(mat, args)
+        result = cluster_matrix(mat, args, groups.sizes if groups is not None else None)
+        if groups is not None:
+            result = result.expand(groups.group)
+        meta = label_clusters(
+            pd.DataFrame({"prompt": texts}),
+            result,
+            chat_model=args.chat_model,
+            options=ClientOptions(concurrency=args.label_concurrency),
+            cache_dir=_label_cache_dir(args),
+        )
+        model = ClusterModel.from_result(
+            result,
+            meta,
+            embedding_model=args.embedding_model,
+            keys=text_keys(texts),
+            reducer=reducer,
+            options=model_options(args),
+        )
+        if args.model_dir is not None:
+            model.save(args.model_dir)
+        return snapshot(model, texts, raw, model.labels)
+
+    if model is None:
+        initial = build([])
+    else:
+        texts = list(dict.fromkeys(corpus()))
+        raw = embed(texts)
+        initial = snapshot(model, texts, raw, model.predict(raw)[0])
+        print(f"Loaded cluster model from {args.model_dir}/.", flush=True)
+
+    service = PromptService(
+        initial,
+        embed=embed,
+        build=build,
+        max_batch=args.serve_max_batch,
+        max_wait=args.serve_wait_ms / 1000,
+    )
+    server = ServiceServer((args.host, args.port), service)
+    print(
+        f"Serving {len(initial.texts)} prompts in {len(initial.model.centroids)} clusters on "
+        f"http://{args.host}:{server.server_address[1]}/ – Ctrl+C to stop.",
+        flush=True,
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping…", flush=True)
+    finally:
+        server.server_close()
+        service.close()
+        store.close()
+
+
+# ---------------------------------------------------------------------------
+# Main entry point
+# ---------------------------------------------------------------------------
+
+
+def main() -> None:  # noqa: D401
+    args = parse_cli()
+    try:
+        with tracing.span(args.command, cat="run"):
+            reader = codex_reader(args)
+            if reader is not None and args.command != "serve" and not reader.pending_bytes():
+                print("No new entries in the Codex logs – nothing to do.", flush=True)
+                return
+            _run(args, reader)
+            if reader is not None:
+                # Only now: a failed run leaves the offsets, so it is retried.
+                reader.commit()
+    finally:
+        if args.profile_imports:
+            print(format_profile(), file=sys.stderr, flush=True)
+        if args.trace is not None:
+            tracing.write(args.trace, command=args.command, argv=sys.argv[1:])
+            print(f"Trace written to {args.trace}.", flush=True)
+
+
+def _no_prompts(reader: CodexLogReader | None) -> None:
+    if reader is None:
+        raise SystemExit("Input file contains no prompts.")
+    # The new log entries hold no user prompts; committing skips them next time.
+    print("No new prompts in the Codex logs – nothing to cluster.", flush=True)
+
+
+def _run(args: argparse.Namespace, reader: CodexLogReader | None = None) -> None:
     # ---------------------------------------------------------------------
-    # 3. LLM naming / description
+    # 1. Input + embeddings (may be cached)
     # ---------------------------------------------------------------------
-    meta = label_clusters(df, labels, chat_model=args.chat_model)
+    embedding_kwargs: dict[str, Any] = dict(
+        cache_path=args.cache,
+        model=args.embedding_model,
+        cache_dtype=args.cache_dtype,
+        cache_max_rows=args.cache_max_rows,
+        client_options=ClientOptions(
+            concurrency=args.embedding_concurrency,
+            rpm=args.embedding_rpm or None,
+            tpm=args.embedding_tpm or None,
+        ),
+        batch_limits=BatchLimits(
+            max_tokens=args.embedding_batch_tokens,
+            max_input_tokens=args.embedding_max_input_tokens,
+            overlong=args.embedding_overlong,
+        ),
+    )
+
+    if args.command == "assign":
+        assign_new_prompts(args, embedding_kwargs, reader)
+        return
+    if args.command == "serve":
+        serve(args, embedding_kwargs)
+        return
+
+    groups: DuplicateGroups | None = None
+    if args.stream:
+        with tracing.span("load + embed (stream)") as stage:
+            df, mat = stream_prompts_and_embeddings(
+                reader.chunks(args.chunk_size)
+                if reader is not None
+                else iter_prompt_chunks(args.csv, args.chunk_size),
+                **embedding_kwargs,
+            )
+            stage.update(rows=len(df), matrix_shape=list(mat.shape))
+        if df.empty:
+            _no_prompts(reader)
+            return
+        if args.near_duplicates:
+            # Embeddings are already paid for; collapsing still shrinks clustering.
+            with tracing.span("near-duplicates") as stage:
+                groups = find_near_duplicates(df, args.dedup_threshold)
+                mat = np.asarray(mat[groups.representatives])
+                stage.update(groups=len(groups))
+    else:
+        # Input must contain a 'prompt' column.
+        with tracing.span("load") as stage:
+            df = reader.read() if reader is not None else read_prompts(args.csv)
+            stage.update(rows=len(df))
+        if df.empty:
+            _no_prompts(reader)
+            return
+        prompts = df["prompt"]
+        if args.near_duplicates:
+            with tracing.span("near-duplicates") as stage:
+                groups = find_near_duplicates(df, args.dedup_threshold)
+                prompts = prompts.iloc[groups.representatives]
+                stage.update(groups=len(groups))
+        with tracing.span("embed") as stage:
+            mat = load_or_create_embeddings(prompts, **embedding_kwargs)
+            stage.update(matrix_shape=list(mat.shape), dtype=str(mat.dtype))
+    weights = groups.sizes if groups is not None else None
+
+    original = mat
+    if args.export is not None and not args.reduce_dims and _normalizes_in_place(args):
+        # Clustering (or compaction) L2‑normalises the rows in place; the export
+        # keeps the embeddings as they came from the API.
+        original = np.array(mat, dtype=np.float32)
+    reducer: PCAReducer | None = None
+    compact_info: dict[str, Any] | None = None
+    if args.reduce_dims or args.matrix_dtype != "float32":
+        with tracing.span("compact") as stage:
+            mat, reducer, compact_info = compact_for_clustering(mat, args)
+            stage.update(matrix_shape=list(mat.shape), dtype=str(mat.dtype))
 
     # ---------------------------------------------------------------------
-    # 4. Plots
+    # 2. Clustering
     # ---------------------------------------------------------------------
-    create_plots(mat, labels, df.get("for_devs"), args.plots_dir)
+
+    # Stage outputs are cached under a key of their inputs and parameters, so
+    # an unchanged rerun skips the sweep, the projection and the PNGs.
+    artifacts: ArtifactCache | None = None
+    fingerprint = ""
+    if args.cache is not None:
+        artifacts = ArtifactCache(_store_root(args.cache) / "stages", force=args.force_stage)
+        fingerprint = matrix_fingerprint(mat)
+
+    with tracing.span(f"cluster ({args.cluster_method})") as stage:
+        stage.update(matrix_shape=list(mat.shape))
+        params = {name: getattr(args, name) for name in CLUSTER_PARAMS[args.cluster_method]}
+        if args.hierarchical:
+            params["fine_k_max"] = args.fine_k_max
+        cluster_key = artifact_key(
+            "cluster", fingerprint, weights, args.cluster_method, sorted(params.items())
+        )
+        cached = artifacts.load_arrays("cluster", cluster_key) if artifacts is not None else None
+        if cached is not None:
+            result = ClusterResult.from_arrays(cached)
+            print(
+                f"Loaded clustering ({result.method}, {len(result.centroids)} clusters) "
+                f"from the stage cache ({cluster_key[:12]}).",
+                flush=True,
+            )
+            tracing.count("stage_cache_hits")
+        else:
+            result = cluster_matrix(mat, args, weights)
+        if cached is None and artifacts is not None:
+            artifacts.save("cluster", cluster_key, arrays=result.to_arrays())
+        stage.update(k=result.k, score=result.score)
+
+    outputs: dict[str, Any] = {}
+    if compact_info is not None:
+        with tracing.span("silhouette delta"):
+            compact_info["silhouette"] = silhouette_delta(
+                original, mat, result.labels, sample_size=args.silhouette_sample, seed=args.seed
+            )
+        if compact_info["silhouette"] is not None:
+            before, after = compact_info["silhouette"]
+            print(
+                f"Silhouette original {before:.3f} → compact {after:.3f} "
+                f"(Δ {after - before:+.3f}).",
+                flush=True,
+            )
+        outputs["compact"] = compact_info
+    if groups is not None:
+        # Every member inherits the vector and cluster of its representative.
+        result = result.expand(groups.group)
+        mat = mat[groups.group]
+        fingerprint = fingerprint and artifact_key("expanded", fingerprint, groups.group)
+        outputs["duplicate_groups"] = groups
 
     # ---------------------------------------------------------------------
-    # 5. Markdown report
+    # 3. Labelling, ambiguity, plots and report
     # ---------------------------------------------------------------------
-    generate_markdown_report(df, labels, meta, outputs, path_md=args.output_md)
+    # These only need the clustering, so they run as a stage graph: the
+    # labelling requests, the projection (in a worker process) and the
+    # ambiguity analysis overlap, and the report waits for all of them.
+    label_cache = _label_cache_dir(args)
+    outputs["projection"] = PROJECTION_TITLES[args.projection]
+
+    def ambiguous_prompts(df: pd.DataFrame, result: ClusterResult) -> list[str]:
+        # Only meaningful for (spherical) kmeans; uses the centroid distances the
+        # clustering step already computed.
+        return df["prompt"].iloc[find_ambiguous(result)].tolist()
+
+    def save_model(df: pd.DataFrame, result: ClusterResult, meta: dict) -> None:
+        ClusterModel.from_result(
+            result,
+            meta,
+            embedding_model=args.embedding_model,
+            keys=text_keys(df["prompt"]),
+            reducer=reducer,
+            options=model_options(args),
+        ).save(args.model_dir)
+        print(f"Cluster model saved to {args.model_dir}/.", flush=True)
+
+    def write_report(df: pd.DataFrame, result: ClusterResult, meta: dict, **produced: Any) -> None:
+        generate_markdown_report(df, result, meta, {**outputs, **produced}, path_md=args.output_md)
+
+    label = functools.partial(
+        label_clusters,
+        chat_model=args.chat_model,
+        options=ClientOptions(concurrency=args.label_concurrency),
+        cache_dir=label_cache,
+        refresh="label" in args.force_stage,
+    )
+    stages = [
+        Stage("label", label, inputs=("df", "result"), output="meta"),
+        Stage(
+            "plots",
+            functools.partial(
+                create_plots,
+                plots_dir=args.plots_dir,
+                engine=args.projection,
+                max_per_cluster=args.plot_max_per_cluster,
+                seed=args.seed,
+                cache_path=(
+                    store_directory(_store_root(args.cache), args.embedding_model)
+                    / f"projection-{args.projection}.npz"
+                    if args.cache is not None
+                    else None
+                ),
+                fingerprint=fingerprint,
+                artifacts=artifacts,
+            ),
+            inputs=("matrix", "result", "for_devs"),
+            output="coordinates",
+            executor="process",
+        ),
+    ]
+    report_inputs = ("df", "result", "meta", "coordinates")
+    if result.parents is not None:
+        # The coarse level of a two‑level taxonomy is labelled like the fine one.
+        def label_coarse(df: pd.DataFrame, coarse_result: ClusterResult) -> dict:
+            return label(df, coarse_result)
+
+        stages.append(
+            Stage(
+                "label coarse", label_coarse, inputs=("df", "coarse_result"), output="coarse_meta"
+            )
+        )
+        report_inputs += ("coarse_meta",)
+    if result.method in ("kmeans", "spherical"):
+        stages.append(
+            Stage("ambiguity", ambiguous_prompts, inputs=("df", "result"), output="ambiguous")
+        )
+        report_inputs += ("ambiguous",)
+    if args.model_dir is not None:
+        stages.append(Stage("save model", save_model, inputs=("df", "result", "meta")))
+    if args.export is not None:
+        stages.append(
+            Stage(
+                "export",
+                functools.partial(export_prompts, args.export),
+                inputs=("df", "result", "embeddings", "embedding_rows", "coordinates"),
+                output="exported",
+            )
+        )
+        report_inputs += ("exported",)
+    stages.append(Stage("report", write_report, inputs=report_inputs))
+
+    run_stages(
+        stages,
+        {
+            "df": df,
+            "result": result,
+            "coarse_result": result.coarse() if result.parents is not None else None,
+            "matrix": mat,
+            "for_devs": df.get("for_devs"),
+            # Uncompacted vectors, one per representative with --near-duplicates.
+            "embeddings": original,
+            "embedding_rows": groups.group if groups is not None else None,
+        },
+    )
+    if args.export is not None:
+        print(f"Exported {len(df)} prompt(s) to {args.export}.", flush=True)
 
     print(f"✅ Done. Report written to {args.output_md} – plots in {args.plots_dir}/", flush=True)
 
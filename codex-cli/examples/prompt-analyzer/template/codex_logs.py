@@ -0,0 +1,174 @@
+"""Incremental reader for the prompt logs Codex writes itself.
+
+Codex keeps two append‑only JSONL logs under ``~/.codex`` (see
+``codex-rs/core/src/message_history.rs`` and ``rollout.rs``):
+
+* ``history.jsonl`` – one ``{"session_id", "ts", "text"}`` object per user
+  message (``ts`` in Unix seconds);
+* ``sessions/rollout-<time>-<session id>.jsonl`` – one file per session whose
+  first line is the session meta ``{"id", "timestamp", ...}`` followed by the
+  response items; user prompts are ``{"type": "message", "role": "user",
+  "content": [{"type": "input_text", "text": ...}, ...]}``.
+
+:class:`CodexLogReader` turns either source into the ``prompt`` /
+``session_id`` / ``timestamp`` rows the pipeline consumes.  With an offsets
+file it remembers, per log file, the byte offset up to which it has read (and
+the file's inode, to notice rotation or truncation), so a nightly job only
+parses what was appended since the last run instead of months of history.
+Only complete lines are consumed – a line Codex is still writing is picked up
+next time – and offsets are saved by :meth:`CodexLogReader.commit` once the
+caller has processed the prompts successfully.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterator
+
+from lazy_imports import pd
+
+CODEX_SOURCES = ("history", "sessions")
+OFFSETS_VERSION = 1
+
+
+def _parse_time(text: str) -> float | None:
+    try:
+        return datetime.fromisoformat(text.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+def _user_text(item: dict[str, Any]) -> str | None:
+    if item.get("type") != "message" or item.get("role") != "user":
+        return None
+    parts = [c.get("text", "") for c in item.get("content", []) if c.get("type") == "input_text"]
+    return "\n".join(p for p in parts if p) or None
+
+
+class CodexLogReader:
+    """Read new user prompts from a Codex home directory (see module docstring)."""
+
+    def __init__(
+        self, home: Path, source: str = "history", offsets_path: Path | None = None
+    ) -> None:
+        if source not in CODEX_SOURCES:
+            raise ValueError(f"Unknown Codex log source: {source}")
+        self.home = home.expanduser()
+        self.source = source
+        self.offsets_path = offsets_path
+        self.state: dict[str, dict[str, Any]] = {}
+        if offsets_path is not None and offsets_path.exists():
+            data = json.loads(offsets_path.read_text(encoding="utf-8"))
+            if data.get("version") == OFFSETS_VERSION and data.get("source") == source:
+                self.state = data["files"]
+        self.skipped = 0
+
+    def files(self) -> list[Path]:
+        if self.source == "history":
+            path = self.home / "history.jsonl"
+            return [path] if path.exists() else []
+        # Older versions keep rollouts flat, newer ones in YYYY/MM/DD folders.
+        return sorted((self.home / "sessions").rglob("rollout-*.jsonl"))
+
+    def _start(self, path: Path, warn: bool = False) -> dict[str, Any]:
+        """Saved state of *path*, reset when the file was replaced or truncated."""
+
+        stat = path.stat()
+        state = self.state.get(str(path))
+        if state is None or state["inode"] != stat.st_ino or state["offset"] > stat.st_size:
+            if state is not None and warn:
+                print(
+                    f"⚠️  {path} was rotated or truncated – reading it again.", file=sys.stderr
+                )
+            state = {"offset": 0, "inode": stat.st_ino}
+        return dict(state)
+
+    def pending_bytes(self) -> int:
+        """Bytes appended to the logs since the saved offsets."""
+
+        return sum(p.stat().st_size - self._start(p)["offset"] for p in self.files())
+
+    def _records(self, path: Path) -> Iterator[tuple[str, str, float | None]]:
+        state = self.state[str(path)] = self._start(path, warn=True)
+        with open(path, "rb") as fh:
+            fh.seek(state["offset"])
+            while True:
+                line = fh.readline()
+                if not line.endswith(b"\n"):
+                    break  # EOF or a line that is still being written
+                state["offset"] += len(line)
+                try:
+                    obj = json.loads(line)
+                except ValueError:
+                    self.skipped += 1
+                    continue
+                if not isinstance(obj, dict):
+                    continue
+
+                if self.source == "history":
+                    text = obj.get("text")
+                    ts = obj.get("ts")
+                    if text:
+                        yield text, obj.get("session_id", ""), float(ts) if ts else None
+                elif "type" not in obj and "id" in obj:
+                    # Session meta (first line); rollout items carry no time
+                    # of their own, so prompts get the session start.
+                    state["session_id"] = obj["id"]
+                    state["timestamp"] = _parse_time(obj.get("timestamp", ""))
+                else:
+                    text = _user_text(obj)
+                    if text:
+                        yield text, state.get("session_id", ""), state.get("timestamp")
+
+    def chunks(self, chunk_size: int) -> Iterator[pd.DataFrame]:
+        """Yield the new prompts as DataFrames of at most *chunk_size* rows."""
+
+        batch: list[tuple[str, str, float | None]] = []
+        for path in self.files():
+            for record in self._records(path):
+                batch.append(record)
+                if len(batch) >= chunk_size:
+                    yield self._frame(batch)
+                    batch = []
+        if batch:
+            yield self._frame(batch)
+        if self.skipped:
+            print(f"⚠️  Skipped {self.skipped} malformed log line(s).", file=sys.stderr)
+            self.skipped = 0
+
+    def read(self) -> pd.DataFrame:
+        frames = list(self.chunks(100_000))
+        if not frames:
+            return self._frame([])
+        return pd.concat(frames, ignore_index=True)
+
+    @staticmethod
+    def _frame(records: list[tuple[str, str, float | None]]) -> pd.DataFrame:
+        prompts, sessions, times = zip(*records) if records else ((), (), ())
+        return pd.DataFrame(
+            {
+                "prompt": pd.Series(prompts, dtype=object),
+                "session_id": pd.Series(sessions, dtype=object),
+                "timestamp": pd.to_datetime(pd.Series(times, dtype=float), unit="s", utc=True),
+            }
+        )
+
+    def commit(self) -> None:
+        """Persist the offsets reached, so the next run starts from there."""
+
+        if self.offsets_path is None:
+            return
+        self.offsets_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.offsets_path.with_name(self.offsets_path.name + ".tmp")
+        tmp.write_text(
+            json.dumps(
+                {"version": OFFSETS_VERSION, "source": self.source, "files": self.state},
+                indent=2,
+            ),
+            encoding="utf-8",
+        )
+        os.replace(tmp, self.offsets_path)
@@ -0,0 +1,158 @@
+"""Columnar export of the per‑prompt results (``--export``).
+
+The Markdown report and the PNGs are for people; dashboards need the data
+behind them.  :func:`export_prompts` writes one row per prompt with
+
+===================== =========================================================
+``prompt``            the prompt text (``act`` / ``for_devs`` when present, and
+                      ``session_id`` / ``timestamp`` for Codex logs)
+``cluster``           cluster label (``-1`` = DBSCAN noise)
+``centroid_distance`` distance to the own cluster's centroid (null for noise)
+``ambiguity``         ``d1 / d2`` of the two nearest centroids (close to 1 =
+                      ambiguous; null with fewer than two clusters)
+``x``, ``y``          2‑D projection (null for prompts outside the plotted
+                      sample)
+``embedding``         the embedding as a ``fixed_size_list<float32>[dim]``
+===================== =========================================================
+
+The file is written in row groups of ``ROW_GROUP_ROWS`` prompts, each
+assembled straight from NumPy slices (the embedding rows are gathered per
+group), so neither another DataFrame nor the full float matrix is ever
+materialised.  The format follows the suffix:
+
+* ``.arrow`` / ``.feather`` / ``.ipc`` – an uncompressed Arrow IPC file, which
+  readers can memory‑map and use zero‑copy::
+
+      pa.ipc.open_file(pa.memory_map("prompts.arrow")).read_all()
+
+* anything else (typically ``.parquet``) – Parquet, smaller on disk;
+  ``pq.read_table(path, memory_map=True)``.
+"""
+
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Any
+
+import lazy_imports
+from lazy_imports import np, pd
+
+ROW_GROUP_ROWS = 65_536
+IPC_SUFFIXES = {".arrow", ".feather", ".ipc"}
+
+
+def _lazy_import_pyarrow():  # noqa: D401
+    """Import *pyarrow* only when an export is requested."""
+
+    try:
+        return lazy_imports.load(lazy_imports.pa)
+    except ImportError as exc:  # pragma: no cover – we do not test missing deps.
+        raise SystemExit(
+            "Exporting results requires the 'pyarrow' package.\n"
+            "Run 'pip install pyarrow' and try again."
+        ) from exc
+
+
+def _schema(pa: Any, df: pd.DataFrame, dim: int) -> Any:
+    fields = [pa.field("prompt", pa.string())]
+    if "act" in df.columns:
+        fields.append(pa.field("act", pa.string()))
+    if "for_devs" in df.columns:
+        fields.append(pa.field("for_devs", pa.bool_()))
+    if "session_id" in df.columns:
+        fields.append(pa.field("session_id", pa.string()))
+    if "timestamp" in df.columns:
+        fields.append(pa.field("timestamp", pa.timestamp("us", tz="UTC")))
+    fields += [
+        pa.field("cluster", pa.int64(), nullable=False),
+        pa.field("centroid_distance", pa.float32()),
+        pa.field("ambiguity", pa.float32()),
+        pa.field("x", pa.float32()),
+        pa.field("y", pa.float32()),
+        pa.field("embedding", pa.list_(pa.float32(), dim)),
+    ]
+    return pa.schema(fields)
+
+
+def export_prompts(
+    path: Path,
+    df: pd.DataFrame,
+    result: Any,
+    embeddings: np.ndarray,
+    coordinates: tuple[np.ndarray, np.ndarray],
+    *,
+    embedding_rows: np.ndarray | None = None,
+    row_group_rows: int = ROW_GROUP_ROWS,
+) -> Path:
+    """Write one row per prompt of *df* to *path* (see module docstring).
+
+    *result* is the ``ClusterResult`` for *df*; *coordinates* the
+    ``(rows, xy)`` pair of the projection.  Row *i* of *df* has embedding
+    ``embeddings[embedding_rows[i]]`` (``embeddings[i]`` without
+    *embedding_rows*, e.g. when near‑duplicates were not collapsed).
+    """
+
+    pa = _lazy_import_pyarrow()
+    n, dim = len(df), embeddings.shape[1]
+    schema = _schema(pa, df, dim)
+
+    # Column of every row's own centroid in result.distances (-1 for noise).
+    labels = np.asarray(result.labels)
+    column_of = np.full(labels.max() + 2, -1, dtype=np.int64)
+    column_of[np.asarray(result.centroid_labels)] = np.arange(len(result.centroid_labels))
+    own = column_of[labels]
+
+    xy = np.full((n, 2), np.nan, dtype=np.float32)
+    xy[coordinates[0]] = coordinates[1]
+
+    if Path(path).suffix.lower() in IPC_SUFFIXES:
+        writer = pa.ipc.new_file
+    else:
+        writer = lazy_imports.pq.ParquetWriter
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with writer(str(tmp), schema) as out:
+        for start in range(0, n, row_group_rows):
+            stop = min(start + row_group_rows, n)
+            rows = slice(start, stop)
+            distances = result.distances[rows]
+            block_own = own[rows]
+            columns: dict[str, Any] = {"prompt": df["prompt"].to_numpy()[rows]}
+            if "act" in df.columns:
+                columns["act"] = df["act"].to_numpy()[rows]
+            if "for_devs" in df.columns:
+                columns["for_devs"] = df["for_devs"].astype(bool).to_numpy()[rows]
+            if "session_id" in df.columns:
+                columns["session_id"] = df["session_id"].to_numpy()[rows]
+            if "timestamp" in df.columns:
+                columns["timestamp"] = pa.Array.from_pandas(df["timestamp"].iloc[rows])
+            columns["cluster"] = labels[rows]
+            columns["centroid_distance"] = pa.array(
+                np.take_along_axis(distances, np.maximum(block_own, 0)[:, None], axis=1)[:, 0],
+                type=pa.float32(),
+                mask=block_own < 0,
+            )
+            if distances.shape[1] >= 2:
+                nearest = np.sort(np.partition(distances, 1, axis=1)[:, :2], axis=1)
+                columns["ambiguity"] = nearest[:, 0] / (nearest[:, 1] + 1e-9)
+            else:
+                columns["ambiguity"] = pa.nulls(stop - start, pa.float32())
+            for axis, name in enumerate("xy"):
+                values = xy[rows, axis]
+                columns[name] = pa.array(values, mask=np.isnan(values))
+            vectors = embeddings[rows if embedding_rows is None else embedding_rows[rows]]
+            flat = np.ascontiguousarray(vectors, dtype=np.float32).ravel()
+            columns["embedding"] = pa.FixedSizeListArray.from_arrays(pa.array(flat), dim)
+
+            arrays = [
+                pa.array(columns[f.name], type=f.type)
+                if not isinstance(columns[f.name], pa.Array)
+                else columns[f.name].cast(f.type)
+                for f in schema
+            ]
+            out.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+    os.replace(tmp, path)
+    return path
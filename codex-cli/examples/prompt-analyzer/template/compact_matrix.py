@@ -0,0 +1,154 @@
+"""Compact embedding matrices: PCA reduction and scalar quantisation.
+
+OpenAI embeddings have 1 536 (or 3 072) float32 dimensions, most of which
+carry little of the variance that separates prompt clusters.  Between
+embedding and clustering ``cluster_prompts.py`` can therefore
+
+* project the rows onto the top principal components (:class:`PCAReducer`).
+  The basis is fitted once on a sample and saved next to the embedding
+  cache, so cached and new rows – including rows classified later with
+  ``assign`` – end up in the same space; and
+* store the result as ``float16`` or ``int8`` codes
+  (:class:`QuantizedMatrix`).  ``int8`` uses one symmetric scale per
+  dimension (``x ≈ code · scale``).
+
+A :class:`QuantizedMatrix` behaves like a read‑only 2‑D array where it
+matters: ``len``, ``shape``, row slicing and fancy indexing return another
+quantised view, ``matrix @ vector`` is computed chunk‑wise, and
+``np.asarray`` dequantises.  The distance kernels of the clustering code
+already work on row chunks, so they dequantise one chunk at a time and never
+materialise the float32 matrix.
+"""
+
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+from lazy_imports import np, sklearn_decomposition
+
+COMPACT_DTYPES = ("float32", "float16", "int8")
+PCA_VERSION = 1
+PCA_FIT_ROWS = 50_000
+
+
+class QuantizedMatrix:
+    """Row‑major ``float16`` / ``int8`` codes with per‑column scales."""
+
+    def __init__(self, codes: np.ndarray, scale: np.ndarray | None = None) -> None:
+        self.codes = codes
+        self.scale = scale  # (dim,) for int8, None for float16
+
+    @classmethod
+    def quantize(
+        cls, matrix: np.ndarray, dtype: str, chunk_rows: int = 65_536
+    ) -> "QuantizedMatrix":
+        n, dim = matrix.shape
+        codes = np.empty((n, dim), dtype=dtype)
+        scale = None
+        if dtype == "int8":
+            peak = np.zeros(dim, dtype=np.float32)
+            for start in range(0, n, chunk_rows):
+                block = np.asarray(matrix[start : start + chunk_rows], dtype=np.float32)
+                peak = np.maximum(peak, np.abs(block).max(axis=0))
+            scale = np.where(peak > 0, peak / 127, 1).astype(np.float32)
+        for start in range(0, n, chunk_rows):
+            block = np.asarray(matrix[start : start + chunk_rows], dtype=np.float32)
+            if scale is not None:
+                block = np.clip(np.rint(block / scale), -127, 127)
+            codes[start : start + len(block)] = block
+        return cls(codes, scale)
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.codes.shape
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.codes.dtype
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, rows) -> "QuantizedMatrix":
+        codes = self.codes[rows]
+        if codes.ndim != 2:
+            raise IndexError("QuantizedMatrix supports row selection only.")
+        return QuantizedMatrix(codes, self.scale)
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        out = self.codes.astype(np.float32)
+        if self.scale is not None:
+            out *= self.scale
+        return out if dtype is None else out.astype(dtype, copy=False)
+
+    def __matmul__(self, other: np.ndarray, chunk_rows: int = 65_536) -> np.ndarray:
+        other = np.asarray(other, dtype=np.float32)
+        out = np.empty((len(self),) + other.shape[1:], dtype=np.float32)
+        for start in range(0, len(self), chunk_rows):
+            out[start : start + chunk_rows] = np.asarray(self[start : start + chunk_rows]) @ other
+        return out
+
+
+class PCAReducer:
+    """Linear projection ``(x - mean) @ components`` onto the top components."""
+
+    def __init__(self, mean: np.ndarray, components: np.ndarray) -> None:
+        self.mean = mean  # (dim,)
+        self.components = components  # (dim, dims)
+
+    @property
+    def dims(self) -> int:
+        return self.components.shape[1]
+
+    @classmethod
+    def fit(cls, matrix: np.ndarray, dims: int, seed: int = 42) -> "PCAReducer":
+        """Fit on at most ``PCA_FIT_ROWS`` randomly sampled rows of *matrix*."""
+
+        n = len(matrix)
+        rows = np.arange(n)
+        if n > PCA_FIT_ROWS:
+            rows = np.sort(np.random.default_rng(seed).choice(n, PCA_FIT_ROWS, replace=False))
+        sample = np.asarray(matrix[rows], dtype=np.float32)
+        dims = min(dims, sample.shape[0], sample.shape[1])
+        pca = sklearn_decomposition.PCA(dims, svd_solver="randomized", random_state=seed)
+        pca.fit(sample)
+        return cls(
+            pca.mean_.astype(np.float32),
+            np.ascontiguousarray(pca.components_.T, dtype=np.float32),
+        )
+
+    def transform(self, matrix: np.ndarray, chunk_rows: int = 65_536) -> np.ndarray:
+        out = np.empty((len(matrix), self.dims), dtype=np.float32)
+        for start in range(0, len(matrix), chunk_rows):
+            block = np.asarray(matrix[start : start + chunk_rows], dtype=np.float32)
+            out[start : start + len(block)] = (block - self.mean) @ self.components
+        return out
+
+    def explained_variance(self, matrix: np.ndarray, sample: int = 10_000) -> float:
+        """Share of the total variance kept, estimated on a row sample."""
+
+        block = np.asarray(matrix[:sample], dtype=np.float32) - self.mean
+        total = float((block * block).sum())
+        kept = block @ self.components
+        return float((kept * kept).sum()) / total if total > 0 else 1.0
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as fh:
+            np.savez(fh, version=PCA_VERSION, mean=self.mean, components=self.components)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "PCAReducer | None":
+        if not path.exists():
+            return None
+        with np.load(path) as data:
+            if int(data["version"]) != PCA_VERSION:
+                return None
+            return cls(data["mean"], data["components"])
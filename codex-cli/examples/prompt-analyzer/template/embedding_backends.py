@@ -0,0 +1,178 @@
+"""Pluggable embedding backends other than the OpenAI API.
+
+``--embedding-model`` normally names an OpenAI model.  A name of the form
+``<backend>:<spec>`` selects a backend registered here instead, e.g.
+``local:tfidf-svd-256``.  Backends get the directory of the embedding store
+(if any) to keep fitted state in, and hand vectors back through the same
+``on_embedded`` callback as the API path, so caching, checkpointing and
+everything downstream work unchanged.
+
+The built‑in ``local`` backend needs no network at all:
+
+* Texts are tokenised into word uni‑ and bigrams and hashed into a fixed
+  number of buckets (scikit‑learn's ``HashingVectorizer``, sparse output).
+* Rows are weighted by a smoothed IDF and L2‑normalised (TF‑IDF).
+* A truncated SVD (randomised, on at most ``FIT_ROWS`` sampled texts)
+  projects them to ``dim`` dense dimensions; the output rows are
+  L2‑normalised float32, like OpenAI embeddings.
+
+IDF and SVD basis are fitted on the first texts the backend sees and saved
+as ``local-basis.npz`` in the store directory.  Later runs only transform, so
+a text always maps to the same vector and cached rows stay comparable with
+new ones.  Without a store the basis is fitted on every run.
+"""
+
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Callable, Protocol, Sequence
+
+from lazy_imports import np, sklearn_extmath, sklearn_preprocessing, sklearn_text
+
+BASIS_VERSION = 1
+FIT_ROWS = 100_000
+BATCH_ROWS = 10_000
+
+
+class EmbeddingBackend(Protocol):
+    def embed(
+        self,
+        texts: Sequence[str],
+        on_embedded: Callable[[list[str], np.ndarray], None] | None = None,
+    ) -> np.ndarray:
+        """Return one float32 row per text, reporting batches to *on_embedded*."""
+
+
+BackendFactory = Callable[[str, "Path | None"], EmbeddingBackend]
+BACKENDS: dict[str, BackendFactory] = {}
+
+
+def register_backend(name: str, factory: BackendFactory) -> None:
+    """Make ``<name>:<spec>`` usable as ``--embedding-model``."""
+
+    BACKENDS[name] = factory
+
+
+def resolve_backend(model: str, state_dir: Path | None) -> EmbeddingBackend | None:
+    """Backend for *model*, or ``None`` when it is an OpenAI model name.
+
+    Prefixes that are not registered (e.g. ``ft:`` of fine‑tuned models) are
+    left to the OpenAI API.
+    """
+
+    name, sep, spec = model.partition(":")
+    if not sep or name not in BACKENDS:
+        return None
+    return BACKENDS[name](spec, state_dir)
+
+
+def is_backend_model(model: str) -> bool:
+    """Whether *model* is served by a registered backend rather than OpenAI."""
+
+    name, sep, _ = model.partition(":")
+    return bool(sep) and name in BACKENDS
+
+
+# ---------------------------------------------------------------------------
+# Built‑in offline backend: hashed n‑gram TF‑IDF + truncated SVD
+# ---------------------------------------------------------------------------
+
+
+class LocalTfidfBackend:
+    """Offline embeddings from hashed word n‑grams (see module docstring)."""
+
+    def __init__(
+        self,
+        dim: int = 256,
+        n_features: int = 2**16,
+        state_dir: Path | None = None,
+        seed: int = 42,
+    ) -> None:
+        self.dim = dim
+        self.seed = seed
+        self.path = state_dir / "local-basis.npz" if state_dir is not None else None
+        self.vectorizer = sklearn_text.HashingVectorizer(
+            n_features=n_features,
+            ngram_range=(1, 2),
+            alternate_sign=False,
+            norm=None,
+            dtype=np.float32,
+        )
+        self.idf: np.ndarray | None = None
+        self.components: np.ndarray | None = None
+        self._load()
+
+    @classmethod
+    def from_spec(cls, spec: str, state_dir: Path | None) -> "LocalTfidfBackend":
+        """Parse ``tfidf-svd`` / ``tfidf-svd-<dim>``."""
+
+        kind, _, dim = spec.rpartition("-") if spec[-1:].isdigit() else (spec, "", "")
+        if kind not in ("", "tfidf-svd"):
+            raise SystemExit(f"Unknown local embedding model {spec!r} (try 'tfidf-svd-256').")
+        return cls(dim=int(dim) if dim else 256, state_dir=state_dir)
+
+    def _load(self) -> None:
+        if self.path is None or not self.path.exists():
+            return
+        with np.load(self.path) as data:
+            if int(data["version"]) != BASIS_VERSION or data["idf"].shape[0] != (
+                self.vectorizer.n_features
+            ):
+                raise SystemExit(f"{self.path} was written by an incompatible version.")
+            self.idf = data["idf"]
+            self.components = data["components"]
+
+    def _save(self) -> None:
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "wb") as fh:
+            np.savez(fh, version=BASIS_VERSION, idf=self.idf, components=self.components)
+        os.replace(tmp, self.path)
+
+    def _tfidf(self, texts: Sequence[str]):
+        counts = self.vectorizer.transform(texts)
+        counts.data = 1 + np.log(counts.data)  # sublinear term frequency
+        return sklearn_preprocessing.normalize(counts.multiply(self.idf).tocsr(), copy=False)
+
+    def fit(self, texts: Sequence[str]) -> None:
+        """Fit IDF and SVD basis on (a sample of) *texts* and persist them."""
+
+        if len(texts) > FIT_ROWS:
+            rng = np.random.default_rng(self.seed)
+            texts = [texts[i] for i in rng.choice(len(texts), FIT_ROWS, replace=False)]
+        print(f"Fitting local embedding basis on {len(texts)} prompt(s)…", flush=True)
+
+        counts = self.vectorizer.transform(texts)
+        df = np.bincount(counts.indices, minlength=counts.shape[1])
+        self.idf = (np.log((1 + len(texts)) / (1 + df)) + 1).astype(np.float32)
+
+        tfidf = self._tfidf(texts)
+        n_components = max(1, min(self.dim, tfidf.shape[0] - 1, tfidf.shape[1]))
+        _, _, vt = sklearn_extmath.randomized_svd(tfidf, n_components, random_state=self.seed)
+        self.components = np.ascontiguousarray(vt.T, dtype=np.float32)  # (features, dim)
+        self._save()
+
+    def embed(
+        self,
+        texts: Sequence[str],
+        on_embedded: Callable[[list[str], np.ndarray], None] | None = None,
+    ) -> np.ndarray:
+        texts = list(texts)
+        if self.components is None:
+            self.fit(texts)
+
+        out = np.empty((len(texts), self.components.shape[1]), dtype=np.float32)
+        for start in range(0, len(texts), BATCH_ROWS):
+            batch = texts[start : start + BATCH_ROWS]
+            vectors = np.asarray(self._tfidf(batch) @ self.components, dtype=np.float32)
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            out[start : start + len(batch)] = vectors
+            if on_embedded is not None:
+                on_embedded(batch, vectors)
+        return out
+
+
+register_backend("local", LocalTfidfBackend.from_spec)
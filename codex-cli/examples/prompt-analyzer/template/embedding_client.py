@@ -0,0 +1,487 @@
+"""Concurrent, rate‑limit‑aware OpenAI request engine.
+
+``cluster_prompts.py`` used to send one embedding batch at a time, so the
+throughput was bounded by the latency of a single request.  This module keeps
+up to ``concurrency`` requests in flight on a thread pool while respecting the
+account's requests‑per‑minute and tokens‑per‑minute budgets:
+
+* Every request first draws from two token buckets (one for requests, one for
+  tokens).  The buckets refill continuously at ``budget / 60`` per second.
+* ``429`` and ``5xx`` responses as well as connection errors are retried with
+  exponential backoff and jitter.  A ``Retry-After`` header pauses *all*
+  workers, not only the one that hit the limit, so the pool backs off as a
+  whole instead of hammering the endpoint with the remaining workers.
+* Results are returned in input order regardless of completion order.
+
+Batches are planned by :func:`plan_batches`: identical texts are sent once,
+texts are packed greedily up to a per‑request token ceiling, and texts longer
+than the model's input limit are split into chunks (whose vectors are averaged
+afterwards) or truncated, with a warning in both cases.
+"""
+
+from __future__ import annotations
+
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Any, Callable, Sequence, TypeVar
+
+import tracing
+from lazy_imports import np, tiktoken
+
+T = TypeVar("T")
+
+# Status codes worth retrying: timeouts, conflicts, rate limits, server errors.
+RETRYABLE_STATUS = {408, 409, 429}
+
+
+@dataclass
+class ClientOptions:
+    """Knobs shared by every API stage (exposed as CLI flags)."""
+
+    concurrency: int = 4
+    rpm: float | None = None
+    tpm: float | None = None
+    max_retries: int = 6
+    backoff_base: float = 1.0
+    backoff_cap: float = 60.0
+
+
+@dataclass
+class BatchLimits:
+    """Shape of individual embedding requests."""
+
+    max_tokens: int = 50_000  # per request, summed over all inputs
+    max_items: int = 2048  # API limit on inputs per request
+    max_input_tokens: int = 8191  # model limit for a single input
+    overlong: str = "split"  # or "truncate"
+
+
+# ---------------------------------------------------------------------------
+# Token counting – exact with *tiktoken* if installed, conservative otherwise.
+# ---------------------------------------------------------------------------
+
+_ENCODING: Any = None
+_ENCODING_LOADED = False
+
+# Without a tokenizer assume ~3 characters per token. That over‑counts typical
+# English (~4) so estimated batches stay below the real limits.
+_CHARS_PER_TOKEN = 3
+
+
+def _encoding() -> Any:
+    global _ENCODING, _ENCODING_LOADED
+    if not _ENCODING_LOADED:
+        _ENCODING_LOADED = True
+        try:
+            _ENCODING = tiktoken.get_encoding("cl100k_base")
+        except Exception:  # missing package or no network to fetch the BPE file
+            _ENCODING = None
+    return _ENCODING
+
+
+def estimate_tokens(text: str) -> int:
+    """Return the (estimated) number of tokens in *text*."""
+
+    enc = _encoding()
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return len(text) // _CHARS_PER_TOKEN + 1
+
+
+def split_tokens(text: str, max_tokens: int) -> list[str]:
+    """Split *text* into consecutive chunks of at most *max_tokens* tokens."""
+
+    enc = _encoding()
+    if enc is not None:
+        ids = enc.encode(text, disallowed_special=())
+        return [enc.decode(ids[i : i + max_tokens]) for i in range(0, len(ids), max_tokens)]
+    # Keep one token of slack for the ``+ 1`` in the estimate above.
+    width = max(1, (max_tokens - 1) * _CHARS_PER_TOKEN)
+    return [text[i : i + width] for i in range(0, len(text), width)]
+
+
+# ---------------------------------------------------------------------------
+# Batch planning
+# ---------------------------------------------------------------------------
+
+
+@dataclass
+class BatchPlan:
+    """Requests to send plus the information to map results back to texts.
+
+    ``pieces[j]`` is the text sent as the *j*‑th input overall (batches are
+    consecutive slices of it); ``owners[j]`` is the index of the unique input
+    text it belongs to and ``weights[j]`` its token count.
+    """
+
+    texts: list[str]
+    pieces: list[str] = field(default_factory=list)
+    owners: list[int] = field(default_factory=list)
+    weights: list[int] = field(default_factory=list)
+    batches: list[list[str]] = field(default_factory=list)
+    batch_tokens: list[int] = field(default_factory=list)
+
+
+class PlanAssembler:
+    """Collect per‑batch results of a :class:`BatchPlan` as they arrive.
+
+    As soon as every piece of a text is back, *on_texts* is called with the
+    completed texts and their vectors – this is what lets the embedding stage
+    checkpoint each batch instead of waiting for the whole run.  Split texts
+    get the token‑weighted mean of their chunks, re‑normalised to unit length
+    like the vectors the API returns.
+    """
+
+    def __init__(
+        self,
+        plan: BatchPlan,
+        on_texts: Callable[[list[str], np.ndarray], None] | None = None,
+    ) -> None:
+        self.plan = plan
+        self.on_texts = on_texts
+        self._owners = np.asarray(plan.owners, dtype=np.int64)
+        self._weights = np.asarray(plan.weights, dtype=np.float32)
+        self._batch_starts = np.cumsum([0] + [len(b) for b in plan.batches])
+        # Pieces of one text are consecutive in ``plan.pieces``.
+        self._count = np.bincount(self._owners, minlength=len(plan.texts))
+        self._first = np.cumsum(self._count) - self._count
+        self._pending = self._count.copy()
+        self._pieces: np.ndarray | None = None
+
+    def add(self, batch_index: int, vectors: Sequence[Sequence[float]]) -> None:
+        block = np.asarray(vectors, dtype=np.float32)
+        if self._pieces is None:
+            self._pieces = np.empty((len(self.plan.pieces), block.shape[1]), dtype=np.float32)
+
+        start = int(self._batch_starts[batch_index])
+        self._pieces[start : start + len(block)] = block
+
+        owners = self._owners[start : start + len(block)]
+        np.subtract.at(self._pending, owners, 1)
+        complete = np.unique(owners[self._pending[owners] == 0])
+        if self.on_texts is not None and complete.size:
+            self.on_texts([self.plan.texts[i] for i in complete], self._combine(complete))
+
+    def result(self) -> np.ndarray:
+        """One vector per unique text, in ``plan.texts`` order."""
+
+        if self._pending.any():
+            raise RuntimeError("Not all embedding batches have completed.")
+        if self._pieces is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return self._combine(np.arange(len(self.plan.texts)))
+
+    def _combine(self, owners: np.ndarray) -> np.ndarray:
+        assert self._pieces is not None
+        out = self._pieces[self._first[owners]]
+        for row in np.flatnonzero(self._count[owners] > 1):
+            start, n = self._first[owners[row]], self._count[owners[row]]
+            weights = self._weights[start : start + n, None]
+            mean = (self._pieces[start : start + n] * weights).sum(axis=0) / weights.sum()
+            out[row] = mean / max(float(np.linalg.norm(mean)), 1e-12)
+        return out
+
+
+def plan_batches(texts: Sequence[str], limits: BatchLimits) -> BatchPlan:
+    """Pack *texts* into requests that respect *limits*.
+
+    Duplicates are collapsed (``plan.texts`` holds the unique texts in first‑
+    seen order), then pieces are packed next‑fit in that order so a request is
+    closed only once the next piece would exceed ``max_tokens`` or
+    ``max_items``.
+    """
+
+    plan = BatchPlan(texts=list(dict.fromkeys(texts)))
+    overlong = 0
+
+    for owner, text in enumerate(plan.texts):
+        n_tokens = estimate_tokens(text)
+        if n_tokens <= limits.max_input_tokens:
+            chunks, counts = [text], [n_tokens]
+        else:
+            overlong += 1
+            chunks = split_tokens(text, limits.max_input_tokens)
+            if limits.overlong == "truncate":
+                chunks = chunks[:1]
+            counts = [estimate_tokens(c) for c in chunks]
+            preview = text[:60].replace("\n", " ")
+            action = "truncated" if limits.overlong == "truncate" else f"split into {len(chunks)}"
+            print(
+                f"⚠️  Prompt with ~{n_tokens} tokens exceeds the "
+                f"{limits.max_input_tokens}-token input limit – {action}: {preview!r}…",
+                file=sys.stderr,
+            )
+
+        plan.pieces.extend(chunks)
+        plan.owners.extend([owner] * len(chunks))
+        plan.weights.extend(counts)
+
+    current: list[str] = []
+    current_tokens = 0
+    for piece, n_tokens in zip(plan.pieces, plan.weights):
+        if current and (
+            current_tokens + n_tokens > limits.max_tokens or len(current) >= limits.max_items
+        ):
+            plan.batches.append(current)
+            plan.batch_tokens.append(current_tokens)
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += n_tokens
+    if current:
+        plan.batches.append(current)
+        plan.batch_tokens.append(current_tokens)
+
+    if overlong:
+        print(f"⚠️  {overlong} prompt(s) exceeded the model input limit.", file=sys.stderr)
+    return plan
+
+
+class TokenBucket:
+    """Thread‑safe token bucket refilled at ``per_minute / 60`` per second.
+
+    A bucket created with ``per_minute=None`` never blocks.
+    """
+
+    def __init__(self, per_minute: float | None) -> None:
+        self.capacity = per_minute
+        self._tokens = per_minute or 0.0
+        self._rate = (per_minute or 0.0) / 60.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0) -> None:
+        if self.capacity is None:
+            return
+
+        # A single request larger than the whole budget can still go through
+        # once the bucket is full – otherwise it would wait forever.
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) / self._rate
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """Request + token budgets plus a shared cool‑down set by ``Retry-After``."""
+
+    def __init__(self, rpm: float | None = None, tpm: float | None = None) -> None:
+        self._requests = TokenBucket(rpm)
+        self._tokens = TokenBucket(tpm)
+        self._pause_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._pause_until = max(self._pause_until, time.monotonic() + seconds)
+
+    def acquire(self, tokens: int) -> None:
+        while True:
+            with self._lock:
+                delay = self._pause_until - time.monotonic()
+            if delay <= 0:
+                break
+            time.sleep(delay)
+        self._requests.acquire(1)
+        self._tokens.acquire(tokens)
+
+
+def _status_code(exc: BaseException) -> int | None:
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    status = _status_code(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS or status >= 500
+    # No HTTP status – connection resets and timeouts from the SDK.
+    return type(exc).__name__ in {"APIConnectionError", "APITimeoutError"}
+
+
+def retry_after(exc: BaseException) -> float | None:
+    """Return the server‑requested delay in seconds, if any."""
+
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    for name, scale in (("retry-after-ms", 1e-3), ("retry-after", 1.0)):
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            return max(0.0, float(value) * scale)
+        except ValueError:
+            # HTTP‑date form – rare for the OpenAI API, fall back to backoff.
+            return None
+    return None
+
+
+def call_with_retry(
+    fn: Callable[[], T],
+    *,
+    limiter: RateLimiter,
+    tokens: int,
+    options: ClientOptions,
+    what: str = "request",
+) -> T:
+    """Run *fn* under *limiter*, retrying transient failures.
+
+    Non‑retryable errors and the last failure after ``max_retries`` attempts
+    are re‑raised unchanged.  Every attempt counts towards the ``api_calls``
+    and ``api_tokens`` trace counters.
+    """
+
+    attempt = 0
+    while True:
+        limiter.acquire(tokens)
+        tracing.count("api_calls")
+        tracing.count("api_tokens", tokens)
+        try:
+            return fn()
+        except Exception as exc:
+            if attempt >= options.max_retries or not _is_retryable(exc):
+                raise
+
+            delay = retry_after(exc)
+            if delay is not None:
+                limiter.pause(delay)
+            else:
+                backoff = min(options.backoff_cap, options.backoff_base * 2**attempt)
+                delay = backoff * random.uniform(0.5, 1.0)
+                if _status_code(exc) == 429:
+                    limiter.pause(delay)
+
+            attempt += 1
+            print(
+                f"⚠️  {what} failed ({_status_code(exc) or type(exc).__name__}); "
+                f"retry {attempt}/{options.max_retries} in {delay:.1f}s",
+                file=sys.stderr,
+            )
+            time.sleep(delay)
+
+
+def run_concurrently(
+    jobs: Sequence[Callable[[], T]],
+    *,
+    tokens: Sequence[int],
+    options: ClientOptions,
+    on_result: Callable[[int, T], None],
+    limiter: RateLimiter | None = None,
+    what: str = "request",
+    return_exceptions: bool = False,
+) -> int:
+    """Execute *jobs* with at most ``options.concurrency`` in flight.
+
+    Every result goes to *on_result*, called in the calling thread as
+    ``on_result(i, result)`` as soon as job *i* finishes (i.e. in completion
+    order); nothing is kept here, so results can be consumed (e.g. written to
+    the embedding store) and dropped one by one.  Returns the number of jobs
+    delivered.  When a job fails permanently, jobs that have
+    not started yet are cancelled, those in flight still complete and are
+    reported, and then the first error is re‑raised.  With
+    *return_exceptions* a failed job does not stop the others; its exception
+    (after retries) is delivered in place of the result instead.
+    """
+
+    limiter = limiter or RateLimiter(options.rpm, options.tpm)
+    delivered = 0
+
+    def deliver(i: int, result: T) -> None:
+        nonlocal delivered
+        on_result(i, result)
+        delivered += 1
+
+    if options.concurrency <= 1 or len(jobs) <= 1:
+        for i, (job, n) in enumerate(zip(jobs, tokens)):
+            try:
+                result = call_with_retry(job, limiter=limiter, tokens=n, options=options, what=what)
+            except Exception as exc:
+                if not return_exceptions:
+                    raise
+                result = exc  # type: ignore[assignment]
+            deliver(i, result)
+        return delivered
+
+    error: BaseException | None = None
+    with ThreadPoolExecutor(max_workers=options.concurrency) as pool:
+        futures = {
+            pool.submit(
+                tracing.bind(call_with_retry),
+                job,
+                limiter=limiter,
+                tokens=n,
+                options=options,
+                what=what,
+            ): i
+            for i, (job, n) in enumerate(zip(jobs, tokens))
+        }
+        try:
+            for future in as_completed(futures):
+                # Drop the finished future (and with it its result) once delivered.
+                i = futures.pop(future)
+                if future.cancelled():
+                    continue
+                exc = future.exception()
+                if exc is None:
+                    deliver(i, future.result())
+                elif return_exceptions and isinstance(exc, Exception):
+                    deliver(i, exc)  # type: ignore[arg-type]
+                elif error is None:
+                    error = exc
+                    for pending in futures:
+                        pending.cancel()
+        except BaseException:
+            for pending in futures:
+                pending.cancel()
+            raise
+
+    if error is not None:
+        raise error
+    return delivered
+
+
+def embed_batches(
+    client: Any,
+    batches: Sequence[Sequence[str]],
+    *,
+    model: str,
+    options: ClientOptions,
+    on_batch: Callable[[int, list[list[float]]], None],
+    tokens: Sequence[int] | None = None,
+) -> int:
+    """Embed every batch with the OpenAI *client*; returns the number of batches.
+
+    *on_batch* receives each batch's vectors as soon as it completes (see
+    :func:`run_concurrently`); they are not kept otherwise.  *tokens* are the
+    per‑batch token estimates used for the TPM budget; they are computed when
+    not supplied.
+    """
+
+    def make_job(batch: Sequence[str]) -> Callable[[], list[list[float]]]:
+        def job() -> list[list[float]]:
+            response = client.embeddings.create(input=list(batch), model=model)
+            # The API returns the vectors in the same order as the input list.
+            return [data.embedding for data in response.data]
+
+        return job
+
+    return run_concurrently(
+        [make_job(batch) for batch in batches],
+        tokens=tokens or [sum(estimate_tokens(t) for t in batch) for batch in batches],
+        options=options,
+        what="embedding request",
+        on_result=on_batch,
+    )
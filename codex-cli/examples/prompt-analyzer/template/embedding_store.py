@@ -0,0 +1,489 @@
+"""Content‑addressed, memory‑mapped embedding store.
+
+The store replaces the single JSON file that ``cluster_prompts.py`` used to
+keep as an embedding cache.  Layout on disk (one sub‑directory per embedding
+model, so vectors of different models can never be mixed up)::
+
+    <root>/
+        <model-slug>/
+            meta.json          – model, dimension, dtype, generation, segment
+            vectors.<seg>.bin  – raw row‑major matrix (float32 or float16)
+            index.<seg>.bin    – one fixed‑size record per row: text hash + last use
+
+Row *i* of the index describes row *i* of the vector file.  Both files are only
+ever appended to; a compaction writes a fresh segment and then atomically
+replaces ``meta.json`` to point at it, so a crash at any moment leaves either
+the old or the new segment in effect – never a mix of the two.  Lookups go
+through an in‑memory ``dict`` built from the index on open, so they are O(1)
+per text and never touch the (potentially large) vector file.
+
+Least‑recently‑used bookkeeping is done per *generation*: every time the store
+is opened the generation counter in ``meta.json`` is bumped, and rows looked up
+or appended during that session are stamped with it.  When the store grows
+beyond ``max_rows`` the rows with the oldest stamps are evicted first.
+
+The two binary files double as the checkpoint journal of the embedding stage:
+every :meth:`EmbeddingStore.append` is ``fsync``'ed before it returns, so a
+batch that came back from the API survives a crash.  On open, a torn tail
+(a partially written record, or one file ahead of the other) is cut off.
+:meth:`~EmbeddingStore.begin_run` / :meth:`~EmbeddingStore.finish_run` mark
+an embedding run in ``meta.json`` together with the row count at its start;
+if a run never finished, the rows it appended beyond that mark are reported
+as resumed checkpoints by the next session.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import sys
+from pathlib import Path
+from typing import Iterable, Sequence
+
+from lazy_imports import np
+
+STORE_VERSION = 1
+
+# 16‑byte BLAKE2b digest of the UTF‑8 text plus the generation in which the row
+# was last used.  A dtype spec rather than an ``np.dtype`` so that importing
+# this module does not import NumPy.
+KEY_DTYPE = "V16"
+INDEX_DTYPE = [("key", KEY_DTYPE), ("used", "<u4")]
+INDEX_ITEMSIZE = 20
+
+SUPPORTED_DTYPES = ("float32", "float16")
+
+
+def text_key(text: str) -> bytes:
+    """Return the content address of *text* (model‑independent)."""
+
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def _model_slug(model: str) -> str:
+    slug = re.sub(r"[^A-Za-z0-9._-]+", "_", model).strip("_")
+    return slug or "default"
+
+
+def store_directory(root: Path, model: str) -> Path:
+    """Directory that holds the store of *model* underneath *root*."""
+
+    return root / _model_slug(model)
+
+
+def matrix_fingerprint(matrix: np.ndarray, chunk_rows: int = 65_536) -> str:
+    """Content hash of a matrix (shape, dtype and values).
+
+    Hashes row chunks so memory‑mapped matrices are never copied as a whole.
+    """
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{matrix.shape}|{matrix.dtype.str}".encode())
+    for start in range(0, len(matrix), chunk_rows):
+        digest.update(np.ascontiguousarray(matrix[start : start + chunk_rows]).data)
+    return digest.hexdigest()
+
+
+def _file_size(path: Path) -> int:
+    return path.stat().st_size if path.exists() else 0
+
+
+def _fsync_dir(directory: Path) -> None:
+    """Persist directory entries (new / renamed files) where supported."""
+
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:  # pragma: no cover – e.g. Windows cannot open directories.
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _append_durably(path: Path, data: bytes) -> None:
+    with open(path, "ab") as fh:
+        fh.write(data)
+        fh.flush()
+        os.fsync(fh.fileno())
+
+
+class EmbeddingStore:
+    """Append‑only embedding matrix keyed by ``(model, text hash)``.
+
+    Use :meth:`open` rather than instantiating directly; the store is a context
+    manager so ``meta.json`` is flushed on exit.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        model: str,
+        *,
+        dtype: str = "float32",
+        max_rows: int | None = None,
+    ) -> None:
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported store dtype {dtype!r}; use one of {SUPPORTED_DTYPES}.")
+
+        self.directory = directory
+        self.model = model
+        self.max_rows = max_rows
+        self.dtype = np.dtype(dtype)
+        self.dim: int | None = None
+        self.generation = 0
+        self.segment = 0
+        # Generation of an embedding run that started but never finished, and
+        # the number of rows the store had when it started.
+        self.interrupted_generation: int | None = None
+        self.interrupted_start = 0
+        self.resumed_rows = 0
+        self._running = False
+        self._run_start = 0
+
+        self._meta_path = directory / "meta.json"
+
+        self._rows: dict[bytes, int] = {}
+        self._used: np.ndarray | None = None  # writable memmap over the index
+        self._vectors: np.ndarray | None = None  # copy‑on‑write memmap over the vectors
+        self._n = 0
+
+    # ------------------------------------------------------------------
+    # Construction / persistence
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def open(
+        cls,
+        root: Path,
+        model: str,
+        *,
+        dtype: str = "float32",
+        max_rows: int | None = None,
+    ) -> "EmbeddingStore":
+        """Open (or create) the store for *model* underneath *root*."""
+
+        directory = store_directory(root, model)
+        directory.mkdir(parents=True, exist_ok=True)
+        store = cls(directory, model, dtype=dtype, max_rows=max_rows)
+        store._load()
+        return store
+
+    def _load(self) -> None:
+        if self._meta_path.exists():
+            meta = json.loads(self._meta_path.read_text())
+            if meta.get("version") != STORE_VERSION:
+                raise RuntimeError(
+                    f"Embedding store {self.directory} has version {meta.get('version')}, "
+                    f"expected {STORE_VERSION}."
+                )
+            if meta["model"] != self.model:
+                raise RuntimeError(
+                    f"Embedding store {self.directory} belongs to model {meta['model']!r}."
+                )
+            if meta["dtype"] != self.dtype.name:
+                print(
+                    f"⚠️  Embedding store uses {meta['dtype']}; "
+                    f"ignoring requested {self.dtype.name}.",
+                    file=sys.stderr,
+                )
+                self.dtype = np.dtype(meta["dtype"])
+            self.dim = meta["dim"]
+            self.generation = int(meta.get("generation", 0))
+            self.segment = int(meta.get("segment", 0))
+            self.interrupted_generation = meta.get("running")
+            self.interrupted_start = int(meta.get("run_start", 0))
+
+        self.generation += 1
+
+        if self.dim is None:
+            return
+
+        # A crash between (or during) the two appends can leave one file a few
+        # bytes or rows ahead of the other – only rows present in both are
+        # trusted, and the surplus is cut off so later appends stay aligned.
+        row_bytes = self.dim * self.dtype.itemsize
+        n_vectors = _file_size(self._vectors_path) // row_bytes
+        n_index = _file_size(self._index_path) // INDEX_ITEMSIZE
+        self._n = min(n_vectors, n_index)
+        self._truncate_torn_tail(row_bytes)
+
+        # Persist the generation bump right away: if this session crashes,
+        # the next one must not reuse its generation number.
+        self._write_meta()
+
+        if self._n:
+            index = np.fromfile(self._index_path, dtype=INDEX_DTYPE, count=self._n)
+            self._rows = {key: row for row, key in enumerate(index["key"].tolist())}
+
+    def _truncate_torn_tail(self, row_bytes: int) -> None:
+        torn = False
+        files = ((self._vectors_path, row_bytes), (self._index_path, INDEX_ITEMSIZE))
+        for path, size in files:
+            if _file_size(path) > self._n * size:
+                with open(path, "r+b") as fh:
+                    fh.truncate(self._n * size)
+                    os.fsync(fh.fileno())
+                torn = True
+        if torn:
+            print(
+                f"⚠️  Embedding store {self.directory} had a torn tail (interrupted write) – "
+                f"recovered {self._n} complete row(s).",
+                file=sys.stderr,
+            )
+
+    @property
+    def _vectors_path(self) -> Path:
+        return self.directory / f"vectors.{self.segment}.bin"
+
+    @property
+    def _index_path(self) -> Path:
+        return self.directory / f"index.{self.segment}.bin"
+
+    def _write_meta(self) -> None:
+        meta = {
+            "version": STORE_VERSION,
+            "model": self.model,
+            "dim": self.dim,
+            "dtype": self.dtype.name,
+            "generation": self.generation,
+            "segment": self.segment,
+            "rows": self._n,
+            "running": self.generation if self._running else self.interrupted_generation,
+            "run_start": self._run_start if self._running else self.interrupted_start,
+        }
+        tmp = self._meta_path.with_suffix(".json.tmp")
+        with open(tmp, "w") as fh:
+            fh.write(json.dumps(meta, indent=2))
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, self._meta_path)
+        _fsync_dir(self.directory)
+
+    def begin_run(self) -> None:
+        """Mark the start of an embedding run (cleared by :meth:`finish_run`)."""
+
+        self._running = True
+        self._run_start = self._n
+        if self.dim is not None:
+            self._write_meta()
+
+    def finish_run(self) -> None:
+        """Mark the embedding run as complete – nothing left to resume."""
+
+        self._running = False
+        self.interrupted_generation = None
+        if self.dim is not None:
+            self._write_meta()
+
+    def close(self) -> None:
+        """Flush metadata and release the memory maps."""
+
+        if self._used is not None:
+            self._used.flush()
+        self._used = None
+        self._vectors = None
+        if self.dim is not None:
+            self._write_meta()
+
+    def __enter__(self) -> "EmbeddingStore":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self._n
+
+    # ------------------------------------------------------------------
+    # Memory maps (opened lazily, dropped whenever the files change)
+    # ------------------------------------------------------------------
+
+    def _used_map(self) -> np.ndarray:
+        if self._used is None:
+            self._used = np.memmap(
+                self._index_path, dtype=INDEX_DTYPE, mode="r+", shape=(self._n,)
+            )["used"]
+        return self._used
+
+    def _vector_map(self) -> np.ndarray:
+        if self._vectors is None:
+            self._vectors = np.memmap(
+                self._vectors_path, dtype=self.dtype, mode="c", shape=(self._n, self.dim)
+            )
+        return self._vectors
+
+    def _invalidate_maps(self) -> None:
+        if self._used is not None:
+            self._used.flush()
+        self._used = None
+        self._vectors = None
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def lookup(self, texts: Iterable[str]) -> np.ndarray:
+        """Return the store row for every text (``-1`` when absent).
+
+        Hits are stamped with the current generation for LRU eviction.
+        """
+
+        get = self._rows.get
+        rows = np.fromiter((get(text_key(t), -1) for t in texts), dtype=np.int64)
+        hits = rows[rows >= 0]
+        if hits.size:
+            used = self._used_map()
+            if self.interrupted_generation is not None:
+                # Rows the interrupted run appended (plain cache hits of that run
+                # carry its stamp too); still stamped, so not yet counted.
+                appended = hits[hits >= self.interrupted_start]
+                resumed = np.unique(appended[used[appended] == self.interrupted_generation])
+                self.resumed_rows += resumed.size
+            used[hits] = self.generation
+        return rows
+
+    def append(self, texts: Sequence[str], vectors: np.ndarray) -> np.ndarray:
+        """Append *vectors* for *texts* and return their new row numbers.
+
+        Texts that are already present are skipped, so appending is idempotent.
+        Both files are ``fsync``'ed before returning.
+        """
+
+        vectors = np.asarray(vectors)
+        if vectors.ndim != 2 or len(vectors) != len(texts):
+            raise ValueError("Expected one vector per text.")
+
+        if self.dim is None:
+            self.dim = int(vectors.shape[1])
+            self._write_meta()
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(
+                f"Vector dimension {vectors.shape[1]} does not match store dimension {self.dim}."
+            )
+
+        keys = [text_key(t) for t in texts]
+        fresh: list[int] = []
+        seen: set[bytes] = set()
+        for i, key in enumerate(keys):
+            if key not in self._rows and key not in seen:
+                seen.add(key)
+                fresh.append(i)
+
+        if fresh:
+            index = np.empty(len(fresh), dtype=INDEX_DTYPE)
+            index["key"] = [keys[i] for i in fresh]
+            index["used"] = self.generation
+            block = np.ascontiguousarray(vectors[fresh], dtype=self.dtype)
+
+            self._invalidate_maps()
+            created = not self._index_path.exists()
+            # Vectors first: a row only becomes visible once its index record
+            # exists, so a torn write never exposes a half‑written vector.
+            _append_durably(self._vectors_path, block.tobytes())
+            _append_durably(self._index_path, index.tobytes())
+            if created:
+                _fsync_dir(self.directory)
+
+            for offset, i in enumerate(fresh):
+                self._rows[keys[i]] = self._n + offset
+            self._n += len(fresh)
+
+        return np.fromiter((self._rows[k] for k in keys), dtype=np.int64, count=len(keys))
+
+    def matrix(self, rows: np.ndarray) -> np.ndarray:
+        """Return the float32 matrix for *rows* (in the given order).
+
+        When *rows* is a contiguous ascending range and the store holds
+        float32, the result is a copy‑on‑write view of the memory map – no data
+        is copied until somebody writes to it.
+        """
+
+        rows = np.asarray(rows, dtype=np.int64)
+        if (rows < 0).any():
+            raise KeyError("Cannot build a matrix for texts that are not in the store.")
+        if self.dim is None or not rows.size:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+
+        vectors = self._vector_map()
+        start = int(rows[0])
+        contiguous = bool((rows == np.arange(start, start + rows.size)).all())
+        if contiguous and self.dtype == np.float32:
+            return vectors[start : start + rows.size]
+
+        out = np.empty((rows.size, self.dim), dtype=np.float32)
+        if self.dtype == np.float32:
+            np.take(vectors, rows, axis=0, out=out)
+        else:
+            out[:] = vectors[rows]
+        return out
+
+    # ------------------------------------------------------------------
+    # Size cap
+    # ------------------------------------------------------------------
+
+    def needs_compaction(self) -> bool:
+        return self.max_rows is not None and self._n > self.max_rows
+
+    def compact(self) -> int:
+        """Evict least‑recently‑used rows until the store fits ``max_rows``.
+
+        Rows used in the current generation are never evicted, even if that
+        means the cap is temporarily exceeded.  Returns the number of evicted
+        rows.  Row numbers change, so callers must :meth:`lookup` again.
+        """
+
+        if not self.needs_compaction():
+            return 0
+
+        used = np.array(self._used_map())
+        # Stable sort, newest first; ties keep the older (lower) row first.
+        order = np.argsort(-used.astype(np.int64), kind="stable")
+        keep_n = max(int(self.max_rows or 0), int((used == self.generation).sum()))
+        keep = np.sort(order[:keep_n])
+        evicted = self._n - keep.size
+
+        index = np.fromfile(self._index_path, dtype=INDEX_DTYPE, count=self._n)[keep]
+        vectors = np.ascontiguousarray(self._vector_map()[keep])
+
+        self._invalidate_maps()
+        old_paths = (self._vectors_path, self._index_path)
+        self.segment += 1
+        # Leftovers of a compaction that crashed before its commit point.
+        self._vectors_path.unlink(missing_ok=True)
+        self._index_path.unlink(missing_ok=True)
+        _append_durably(self._vectors_path, vectors.tobytes())
+        _append_durably(self._index_path, index.tobytes())
+        self._n = keep.size
+        self._rows = {key: row for row, key in enumerate(index["key"].tolist())}
+        # Row numbers changed, so the interrupted run's mark no longer applies.
+        self.interrupted_generation = None
+        self.interrupted_start = 0
+        # Switching meta.json over is the commit point of the compaction.
+        self._write_meta()
+        for path in old_paths:
+            path.unlink(missing_ok=True)
+        print(f"Embedding store compacted – evicted {evicted} row(s).", flush=True)
+        return evicted
+
+    # ------------------------------------------------------------------
+    # Migration from the legacy JSON cache
+    # ------------------------------------------------------------------
+
+    def import_json(self, json_path: Path) -> int:
+        """Import a legacy ``{text: vector}`` JSON cache; returns rows added."""
+
+        try:
+            legacy: dict[str, list[float]] = json.loads(json_path.read_text())
+        except json.JSONDecodeError:  # pragma: no cover – unlikely.
+            print("⚠️  Legacy JSON cache is not valid JSON – ignoring.", file=sys.stderr)
+            return 0
+        if not legacy:
+            return 0
+
+        before = self._n
+        texts = list(legacy)
+        self.append(texts, np.asarray([legacy[t] for t in texts], dtype=np.float32))
+        return self._n - before
@@ -0,0 +1,111 @@
+"""Registry of the heavy third‑party modules, imported on first use.
+
+NumPy and pandas alone take about a third of a second to import, and
+scikit‑learn, SciPy, matplotlib, pyarrow and openai far more.  None of them
+is needed to print ``--help``, to reject a bad argument or to find that a
+Codex log has no new entries, so no analyzer module imports them directly.
+They all take them from here instead::
+
+    from lazy_imports import np, pd, sklearn_cluster
+
+Every name is a :class:`LazyModule`: a stand‑in that imports the real module
+on first attribute access, copies its namespace and from then on resolves
+attributes as fast as the module itself.  Each first load is timed and
+recorded as a trace span (category ``import``); :func:`format_profile`
+lists them for ``--profile-imports``.
+
+Modules that are optional (openai, pyarrow, tiktoken) raise ``ImportError``
+on first use; :func:`load` imports one eagerly so callers can turn that into
+a helpful message.
+"""
+
+from __future__ import annotations
+
+import importlib
+import sys
+import time
+import types
+from typing import Any
+
+import tracing
+
+_T0 = time.perf_counter()
+_REGISTRY: dict[str, "LazyModule"] = {}
+# (module, seconds, modules added to sys.modules) per first load.
+_PROFILE: list[tuple[str, float, int]] = []
+
+
+class LazyModule(types.ModuleType):
+    """Stand‑in for the module of the same name, imported on first attribute access."""
+
+    def __getattr__(self, attr: str) -> Any:
+        # Only reached for names not copied over (yet), e.g. attributes the
+        # real module creates lazily itself.
+        return getattr(_import(self), attr)
+
+
+def lazy(name: str) -> LazyModule:
+    """The registry's stand‑in for module *name* (one per name)."""
+
+    module = _REGISTRY.get(name)
+    if module is None:
+        module = _REGISTRY[name] = LazyModule(name)
+    return module
+
+
+def load(module: LazyModule) -> LazyModule:
+    """Import the real module behind *module* now and return *module*."""
+
+    _import(module)
+    return module
+
+
+def _import(module: LazyModule) -> types.ModuleType:
+    name = module.__name__
+    loaded = name in sys.modules
+    before = len(sys.modules)
+    start = time.perf_counter()
+    real = importlib.import_module(name)
+    end = time.perf_counter()
+    if not loaded:
+        _PROFILE.append((name, end - start, len(sys.modules) - before))
+        tracing.add_span(f"import {name}", start, end, cat="import")
+    module.__dict__.update(real.__dict__)
+    return real
+
+
+def format_profile() -> str:
+    """Table of the modules loaded through the registry, most expensive first.
+
+    A module's time includes its own dependencies, unless an earlier load
+    (or another import) brought them in already.
+    """
+
+    elapsed = time.perf_counter() - _T0
+    total = sum(seconds for _, seconds, _ in _PROFILE)
+    lines = [f"Imports on first use ({total * 1e3:.0f} ms of {elapsed:.2f} s since startup):"]
+    for name, seconds, added in sorted(_PROFILE, key=lambda row: -row[1]):
+        lines.append(f"  {name:<34} {seconds * 1e3:>8.1f} ms  {added:>5} modules")
+    if not _PROFILE:
+        lines.append("  (none)")
+    return "\n".join(lines)
+
+
+np = lazy("numpy")
+pd = lazy("pandas")
+plt = lazy("matplotlib.pyplot")
+openai = lazy("openai")
+pa = lazy("pyarrow")
+pq = lazy("pyarrow.parquet")
+tiktoken = lazy("tiktoken")
+threadpoolctl = lazy("threadpoolctl")
+scipy_sparse = lazy("scipy.sparse")
+csgraph = lazy("scipy.sparse.csgraph")
+sklearn_cluster = lazy("sklearn.cluster")
+sklearn_decomposition = lazy("sklearn.decomposition")
+sklearn_extmath = lazy("sklearn.utils.extmath")
+sklearn_manifold = lazy("sklearn.manifold")
+sklearn_metrics = lazy("sklearn.metrics")
+sklearn_neighbors = lazy("sklearn.neighbors")
+sklearn_preprocessing = lazy("sklearn.preprocessing")
+sklearn_text = lazy("sklearn.feature_extraction.text")
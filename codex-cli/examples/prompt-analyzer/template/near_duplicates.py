@@ -0,0 +1,147 @@
+"""Near‑duplicate prompt grouping (normalisation + MinHash LSH).
+
+Prompt logs contain many copies of the same prompt that differ only in
+whitespace, casing, a number or a variable name.  Embedding every copy costs
+an API call each and a row in the O(n²) silhouette, without changing the
+clusters.  :func:`group_near_duplicates` therefore collapses them first:
+
+1.  Texts are normalised (Unicode NFKC, case folding, digit runs → ``0``,
+    whitespace collapsed); equal normalised texts form a group straight away.
+2.  Every distinct normalised text is shingled into word uni‑ and bigrams,
+    hashed into a sparse matrix (scikit‑learn's ``HashingVectorizer``) and
+    summarised by a MinHash signature of ``num_perm`` universal hashes,
+    computed per hash function with one ``minimum.reduceat`` over the CSR
+    rows.
+3.  LSH banding: the signature is cut into ``bands`` bands; texts that agree
+    on all rows of any band become candidates.  Candidates are kept when the
+    signature agreement (an estimate of their Jaccard similarity) reaches
+    *threshold*, and groups are the connected components of those pairs.
+
+The first row of every group (in input order) is its representative.
+"""
+
+from __future__ import annotations
+
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import Sequence
+
+from lazy_imports import csgraph, np, scipy_sparse, sklearn_text
+
+_PRIME = (1 << 31) - 1  # hash values fit in uint32; a·x + b fits in uint64
+_WHITESPACE = re.compile(r"\s+")
+_DIGITS = re.compile(r"\d+")
+
+
+@dataclass
+class DuplicateGroups:
+    """``group[i]`` is the group of row *i*; groups are numbered by first row."""
+
+    group: np.ndarray
+    representatives: np.ndarray
+
+    @property
+    def sizes(self) -> np.ndarray:
+        return np.bincount(self.group, minlength=len(self.representatives))
+
+    def __len__(self) -> int:
+        return len(self.representatives)
+
+
+def normalize_text(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = _DIGITS.sub("0", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def minhash_signatures(
+    texts: Sequence[str], num_perm: int = 64, seed: int = 42, chunk_rows: int = 50_000
+) -> np.ndarray:
+    """MinHash signatures of the word 1–2‑gram sets of *texts*, ``(n, num_perm)``."""
+
+    vectorizer = sklearn_text.HashingVectorizer(
+        n_features=2**24,
+        ngram_range=(1, 2),
+        lowercase=False,
+        alternate_sign=False,
+        norm=None,
+        binary=True,
+    )
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, _PRIME, size=num_perm, dtype=np.uint64)
+
+    out = np.full((len(texts), num_perm), _PRIME, dtype=np.uint32)
+    for start in range(0, len(texts), chunk_rows):
+        shingles = vectorizer.transform(texts[start : start + chunk_rows])
+        indptr = shingles.indptr
+        nonempty = np.flatnonzero(np.diff(indptr))
+        if not len(nonempty):
+            continue
+        idx = shingles.indices.astype(np.uint64)
+        for p in range(num_perm):
+            hashed = (a[p] * idx + b[p]) % _PRIME
+            out[start + nonempty, p] = np.minimum.reduceat(hashed, indptr[nonempty])
+    return out
+
+
+def _band_pairs(signatures: np.ndarray, bands: int) -> tuple[np.ndarray, np.ndarray]:
+    """Candidate pairs: every bucket member is paired with the bucket's first."""
+
+    n, num_perm = signatures.shape
+    rows_per_band = num_perm // bands
+    heads, tails = [], []
+    for band in range(bands):
+        part = np.ascontiguousarray(
+            signatures[:, band * rows_per_band : (band + 1) * rows_per_band]
+        )
+        keys = part.view(np.dtype((np.void, part.dtype.itemsize * rows_per_band))).ravel()
+        _, first, bucket = np.unique(keys, return_index=True, return_inverse=True)
+        leader = first[bucket.ravel()]
+        pair = leader != np.arange(n)
+        heads.append(leader[pair])
+        tails.append(np.flatnonzero(pair))
+    return np.concatenate(heads), np.concatenate(tails)
+
+
+def group_near_duplicates(
+    texts: Sequence[str],
+    threshold: float = 0.8,
+    *,
+    num_perm: int = 64,
+    bands: int = 16,
+    seed: int = 42,
+) -> DuplicateGroups:
+    """Group *texts* whose normalised word shingles overlap by ≥ *threshold*."""
+
+    n = len(texts)
+    normalized = [normalize_text(t) for t in texts]
+    distinct, first_row, of_row = np.unique(
+        np.array(normalized, dtype=object), return_index=True, return_inverse=True
+    )
+    of_row = of_row.ravel()
+    m = len(distinct)
+
+    if threshold < 1.0 and m > 1:
+        signatures = minhash_signatures(list(distinct), num_perm=num_perm, seed=seed)
+        heads, tails = _band_pairs(signatures, bands)
+        similar = (signatures[heads] == signatures[tails]).mean(axis=1) >= threshold
+        heads, tails = heads[similar], tails[similar]
+        graph = scipy_sparse.coo_matrix(
+            (np.ones(len(heads), dtype=np.int8), (heads, tails)), shape=(m, m)
+        )
+        _, component = csgraph.connected_components(graph, directed=False)
+    else:
+        component = np.arange(m)
+
+    # Number groups by the first input row they contain.
+    group_first = np.full(component.max() + 1, n, dtype=np.int64)
+    np.minimum.at(group_first, component, first_row)
+    order = np.argsort(group_first, kind="stable")
+    renumber = np.empty_like(order)
+    renumber[order] = np.arange(len(order))
+    return DuplicateGroups(
+        group=renumber[component[of_row]],
+        representatives=group_first[order],
+    )
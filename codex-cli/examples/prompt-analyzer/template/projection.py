@@ -0,0 +1,182 @@
+"""2‑D projections of the embedding matrix for the scatter plot.
+
+Running t‑SNE on every prompt costs minutes and gigabytes at scale, only to
+draw a PNG.  The projection stage therefore works on a *stratified sample*:
+at most ``max_per_cluster`` rows of every cluster (noise included), so small
+clusters stay visible and the cost is bounded by the number of clusters
+rather than the number of prompts.  Three engines are available:
+
+* ``pca`` – a randomised PCA straight to two dimensions.  Fastest, but
+  clusters that differ along many directions overlap.
+* ``tsne`` – PCA down to 50 dimensions followed by t‑SNE (PCA‑initialised)
+  on the sample.
+* ``graph`` – a neighbour‑graph layout in the spirit of UMAP: the k‑NN graph
+  of the PCA‑reduced sample (built with :class:`ann_index.RPForestIndex`) is
+  laid out by a few hundred vectorised epochs of attraction along the edges
+  and repulsion from random negative samples.  Usually seconds where t‑SNE
+  takes minutes.
+
+Projections can be saved as ``.npz`` and are reused as long as the matrix,
+the labels and the parameters are unchanged.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+from pathlib import Path
+
+import tracing
+from ann_index import RPForestIndex
+from lazy_imports import np, sklearn_decomposition, sklearn_manifold
+
+ENGINES = ("pca", "tsne", "graph")
+PROJECTION_VERSION = 1
+PCA_DIMS = 50
+GRAPH_NEIGHBORS = 15
+
+
+def stratified_sample(labels: np.ndarray, max_per_cluster: int, seed: int = 42) -> np.ndarray:
+    """Sorted row numbers with at most *max_per_cluster* rows per label.
+
+    ``max_per_cluster <= 0`` keeps every row.
+    """
+
+    labels = np.asarray(labels)
+    if max_per_cluster <= 0:
+        return np.arange(len(labels))
+    rng = np.random.default_rng(seed)
+    order = np.argsort(labels, kind="stable")
+    _, starts, sizes = np.unique(labels[order], return_index=True, return_counts=True)
+    picked = [
+        rows if len(rows) <= max_per_cluster else rng.choice(rows, max_per_cluster, replace=False)
+        for rows in (order[s : s + n] for s, n in zip(starts, sizes))
+    ]
+    return np.sort(np.concatenate(picked)) if picked else np.arange(0)
+
+
+def _pca(x: np.ndarray, n_components: int, seed: int) -> np.ndarray:
+    n_components = min(n_components, x.shape[0], x.shape[1])
+    if n_components < 1:
+        return np.zeros((len(x), 0), dtype=np.float32)
+    pca = sklearn_decomposition.PCA(n_components, svd_solver="randomized", random_state=seed)
+    return pca.fit_transform(x)
+
+
+def _tsne(x: np.ndarray, seed: int) -> np.ndarray:
+    reduced = _pca(x, PCA_DIMS, seed)
+    perplexity = min(30, max(1, (len(x) - 1) // 3))
+    return sklearn_manifold.TSNE(
+        n_components=2, perplexity=perplexity, init="pca", random_state=seed
+    ).fit_transform(reduced)
+
+
+def _graph_layout(x: np.ndarray, seed: int, epochs: int = 200, negative: int = 5) -> np.ndarray:
+    """Lay out the k‑NN graph of *x* in two dimensions."""
+
+    n = len(x)
+    reduced = np.ascontiguousarray(_pca(x, PCA_DIMS, seed), dtype=np.float32)
+    y = _pca(reduced, 2, seed).astype(np.float64)
+    y = np.pad(y, ((0, 0), (0, 2 - y.shape[1])))
+    y *= 10 / (np.abs(y).max() + 1e-12)
+
+    k = min(GRAPH_NEIGHBORS, n - 1)
+    if k < 1:
+        return y
+    knn = RPForestIndex.build(reduced, k, seed=seed).knn_indices
+    heads = np.repeat(np.arange(n), k)
+    tails = knn.ravel()
+    heads, tails = heads[tails >= 0], tails[tails >= 0]
+    neg_heads = np.repeat(heads, negative)
+    # Every node moves by the mean of its edge gradients, which keeps the
+    # full‑batch update stable regardless of the node degree.
+    degree = np.maximum(np.bincount(heads, minlength=n) + np.bincount(tails, minlength=n), 1)
+
+    def pull(nodes: np.ndarray, coef: np.ndarray, dx: np.ndarray, dy: np.ndarray) -> None:
+        gx[:] += np.bincount(nodes, weights=np.clip(coef * dx, -4, 4), minlength=n)
+        gy[:] += np.bincount(nodes, weights=np.clip(coef * dy, -4, 4), minlength=n)
+
+    # Coordinates are kept column‑wise: reductions over a length‑2 axis are
+    # far slower in NumPy than element‑wise arithmetic on two flat arrays.
+    px, py = (np.ascontiguousarray(c, dtype=np.float32) for c in y.T)
+    rng = np.random.default_rng(seed)
+    for epoch in range(epochs):
+        gx = np.zeros(n)
+        gy = np.zeros(n)
+
+        # Attraction along graph edges (Cauchy kernel 1 / (1 + d²)).
+        dx, dy = px[heads] - px[tails], py[heads] - py[tails]
+        coef = -2 / (1 + dx * dx + dy * dy)
+        pull(heads, coef, dx, dy)
+        pull(tails, coef, -dx, -dy)
+
+        # Repulsion from random nodes.
+        neg = rng.integers(0, n, size=len(neg_heads))
+        dx, dy = px[neg_heads] - px[neg], py[neg_heads] - py[neg]
+        d2 = dx * dx + dy * dy
+        pull(neg_heads, 2 / ((0.001 + d2) * (1 + d2)), dx, dy)
+
+        step = (1 - epoch / epochs) / degree
+        px += (step * gx).astype(np.float32)
+        py += (step * gy).astype(np.float32)
+    return np.stack([px, py], axis=1)
+
+
+def _cache_key(fingerprint: str, labels: np.ndarray, engine: str, cap: int, seed: int) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{PROJECTION_VERSION}:{fingerprint}:{engine}:{cap}:{seed}:".encode())
+    h.update(np.ascontiguousarray(labels, dtype=np.int64).tobytes())
+    return h.hexdigest()
+
+
+def project(
+    matrix: np.ndarray,
+    labels: np.ndarray,
+    *,
+    engine: str = "tsne",
+    max_per_cluster: int = 500,
+    seed: int = 42,
+    cache_path: Path | None = None,
+    fingerprint: str = "",
+    refresh: bool = False,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Project a stratified sample of *matrix* to 2‑D.
+
+    Returns ``(rows, xy)``: the sampled row numbers and their coordinates.
+    With *cache_path*, the result is stored there and reused when
+    *fingerprint* (see :func:`embedding_store.matrix_fingerprint`), the labels
+    and the parameters match – unless *refresh* is set.
+    """
+
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown projection engine: {engine}")
+
+    key = _cache_key(fingerprint, labels, engine, max_per_cluster, seed)
+    if cache_path is not None and cache_path.exists() and not refresh:
+        with np.load(cache_path) as data:
+            if str(data["key"]) == key:
+                print(f"Loaded {engine} projection from {cache_path}.", flush=True)
+                tracing.count("projection_cache_hits")
+                return data["rows"], data["xy"]
+    if cache_path is not None:
+        tracing.count("projection_cache_misses")
+
+    rows = stratified_sample(labels, max_per_cluster, seed)
+    sample = np.asarray(matrix[rows], dtype=np.float32)
+    print(f"Projecting {len(rows)} of {len(matrix)} prompts ({engine})…", flush=True)
+    if engine == "pca":
+        xy = _pca(sample, 2, seed)
+        xy = np.pad(xy, ((0, 0), (0, 2 - xy.shape[1])))
+    elif engine == "tsne":
+        xy = _tsne(sample, seed) if len(rows) > 2 else np.zeros((len(rows), 2))
+    else:
+        xy = _graph_layout(sample, seed)
+    xy = np.asarray(xy, dtype=np.float32)
+
+    if cache_path is not None:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cache_path.with_name(cache_path.name + ".tmp")
+        with open(tmp, "wb") as fh:
+            np.savez(fh, key=key, rows=rows, xy=xy)
+        os.replace(tmp, cache_path)
+    return rows, xy
@@ -0,0 +1,428 @@
+"""Long‑running prompt classification service (``cluster_prompts.py serve``).
+
+Every ``cluster_prompts.py`` invocation pays interpreter start‑up, the
+pandas / scikit‑learn imports, opening the embedding store and loading (or
+fitting) the cluster model before it classifies a single prompt.  ``serve``
+pays that once and keeps everything resident behind a small local HTTP/JSON
+API:
+
+``GET /health``
+    model version, number of indexed prompts and clusters, whether a
+    re‑cluster is running and the last re‑cluster error.
+``GET /clusters``
+    ``[{"cluster", "name", "description", "size"}, ...]``.
+``POST /assign`` ``{"prompts": [...], "neighbors": 5}``
+    per prompt the assigned cluster, the nearest clusters with their
+    distances, whether it lies beyond the cluster radius, and its nearest
+    already indexed prompts.
+``POST /recluster``
+    re‑cluster the corpus plus every new prompt seen since in a background
+    thread (``202``; ``409`` when one is already running).
+
+Prompts from concurrent requests are *micro‑batched* (:class:`MicroBatcher`):
+the first prompt to arrive waits at most ``max_wait`` seconds for others, and
+the whole batch is embedded with one store lookup / API request and assigned
+with one matrix product.  Everything a request reads – model, indexed
+vectors, neighbour index – lives in one immutable :class:`Snapshot`; a
+re‑cluster builds a new one off to the side and swaps the reference, so
+requests never see a half‑updated model.
+
+This module knows nothing about embedding or clustering itself;
+``cluster_prompts.py`` passes in callables for both.
+"""
+
+from __future__ import annotations
+
+import json
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, replace
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Generic, Sequence, TypeVar
+
+from ann_index import RPForestIndex
+from cluster_model import ClusterModel, text_keys
+from lazy_imports import np
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+NEAREST_CLUSTERS = 3
+MAX_NEIGHBORS = 50
+MAX_REQUEST_PROMPTS = 10_000
+
+
+def _distances(vectors: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    sq = (
+        np.einsum("ij,ij->i", vectors, vectors)[:, None]
+        - 2 * vectors @ matrix.T
+        + np.einsum("ij,ij->i", matrix, matrix)
+    )
+    return np.sqrt(np.maximum(sq, 0))
+
+
+# ---------------------------------------------------------------------------
+# Resident state
+# ---------------------------------------------------------------------------
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """Model plus the indexed prompts, swapped as a whole on re‑cluster."""
+
+    model: ClusterModel
+    texts: list[str]  # prompt of every indexed row
+    labels: np.ndarray  # their clusters
+    matrix: np.ndarray  # and their vectors in the model's clustering space
+    index: RPForestIndex | None = None  # None: exact neighbour search
+    version: int = 1
+
+    def neighbors(
+        self, vectors: np.ndarray, k: int, chunk_rows: int = 8192
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """``(indices, distances)`` of the *k* nearest indexed rows (``-1`` pads)."""
+
+        if self.index is not None:
+            return self.index.query(self.matrix, vectors, k)
+        k_eff = min(k, len(self.matrix))
+        best_idx = np.full((len(vectors), k), -1, dtype=np.int64)
+        best_dist = np.full((len(vectors), k), np.inf, dtype=np.float32)
+        for start in range(0, len(self.matrix), chunk_rows):
+            block = self.matrix[start : start + chunk_rows]
+            rows = np.broadcast_to(np.arange(start, start + len(block)), (len(vectors), len(block)))
+            idx = np.concatenate([best_idx, rows], axis=1)
+            dist = np.concatenate([best_dist, _distances(vectors, block)], axis=1)
+            top = np.argsort(dist, axis=1, kind="stable")[:, :k]
+            best_idx = np.take_along_axis(idx, top, axis=1)
+            best_dist = np.take_along_axis(dist, top, axis=1).astype(np.float32)
+        best_idx[:, k_eff:] = -1
+        return best_idx, best_dist
+
+
+# ---------------------------------------------------------------------------
+# Micro‑batching
+# ---------------------------------------------------------------------------
+
+
+class MicroBatcher(Generic[T, R]):
+    """Collect items submitted from many threads and process them in batches.
+
+    ``fn(items) -> results`` runs on one worker thread; a batch closes after
+    *max_items* items or *max_wait* seconds after its first item arrived.
+    """
+
+    def __init__(
+        self, fn: Callable[[list[T]], list[R]], *, max_items: int = 256, max_wait: float = 0.01
+    ) -> None:
+        self._fn = fn
+        self.max_items = max_items
+        self.max_wait = max_wait
+        self._queue: queue.Queue[tuple[list[T], Future] | None] = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, items: Sequence[T]) -> list[R]:
+        """Process *items* as part of the next batch and wait for their results."""
+
+        future: Future = Future()
+        self._queue.put((list(items), future))
+        return future.result()
+
+    def _loop(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            jobs = [job]
+            n_items = len(job[0])
+            deadline = time.monotonic() + self.max_wait
+            while n_items < self.max_items:
+                try:
+                    job = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if job is None:
+                    self._queue.put(None)  # stop after this batch
+                    break
+                jobs.append(job)
+                n_items += len(job[0])
+
+            try:
+                results = self._fn([item for items, _ in jobs for item in items])
+            except BaseException as exc:  # noqa: BLE001 – handed to the callers
+                for _, future in jobs:
+                    future.set_exception(exc)
+                continue
+            start = 0
+            for items, future in jobs:
+                future.set_result(results[start : start + len(items)])
+                start += len(items)
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+
+# ---------------------------------------------------------------------------
+# Service
+# ---------------------------------------------------------------------------
+
+
+class PromptService:
+    """Classify prompts against the resident :class:`Snapshot`.
+
+    *embed* maps prompts to raw embeddings (one row each); *build* re‑clusters
+    the corpus plus the given new prompts and returns a fresh snapshot.
+    """
+
+    def __init__(
+        self,
+        snapshot: Snapshot,
+        *,
+        embed: Callable[[list[str]], np.ndarray],
+        build: Callable[[list[str]], Snapshot],
+        max_batch: int = 256,
+        max_wait: float = 0.01,
+    ) -> None:
+        self._snapshot = snapshot
+        self._embed = embed
+        self._build = build
+        self._lock = threading.Lock()
+        self._seen: dict[str, None] = {}  # new prompts, in arrival order
+        self._refit: threading.Thread | None = None
+        self.last_error: str | None = None
+        self._batcher: MicroBatcher[tuple[str, int], dict[str, Any]] = MicroBatcher(
+            self._classify, max_items=max_batch, max_wait=max_wait
+        )
+
+    @property
+    def snapshot(self) -> Snapshot:
+        return self._snapshot
+
+    @property
+    def reclustering(self) -> bool:
+        return self._refit is not None and self._refit.is_alive()
+
+    def close(self) -> None:
+        self._batcher.close()
+        if self._refit is not None:
+            self._refit.join()
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def assign(self, prompts: Sequence[str], neighbors: int = 5) -> list[dict[str, Any]]:
+        """Assign *prompts* (micro‑batched with concurrent callers)."""
+
+        return self._batcher.submit([(p, neighbors) for p in prompts])
+
+    def _cluster_name(self, model: ClusterModel, label: int) -> str:
+        if label == -1:
+            return "Noise / outliers"
+        return model.meta.get(label, {}).get("name", f"Cluster {label}")
+
+    def _classify(self, items: list[tuple[str, int]]) -> list[dict[str, Any]]:
+        snap = self._snapshot  # one consistent model for the whole batch
+        model = snap.model
+        texts = [text for text, _ in items]
+        vectors = model.transform(self._embed(texts))
+
+        distances = _distances(vectors, model.centroids)
+        order = np.argsort(distances, axis=1, kind="stable")[:, :NEAREST_CLUSTERS]
+        nearest = order[:, 0]
+        distance = distances[np.arange(len(items)), nearest]
+        outside = distance > model.radii[nearest]
+        labels = model.centroid_labels[nearest]
+        if model.method == "dbscan":
+            labels = np.where(outside, -1, labels)
+
+        k = max(n for _, n in items)
+        if k:
+            neighbor_idx, neighbor_dist = snap.neighbors(vectors, k)
+        unknown = model.unknown(text_keys(texts))
+        with self._lock:
+            self._seen.update(dict.fromkeys(t for t, new in zip(texts, unknown) if new))
+
+        results = []
+        for i, (text, n) in enumerate(items):
+            label = int(labels[i])
+            result: dict[str, Any] = {
+                "prompt": text,
+                "cluster": label,
+                "name": self._cluster_name(model, label),
+                "distance": float(distance[i]),
+                "outside_radius": bool(outside[i]),
+                "known": not unknown[i],
+                "nearest_clusters": [
+                    {
+                        "cluster": int(model.centroid_labels[j]),
+                        "name": self._cluster_name(model, int(model.centroid_labels[j])),
+                        "distance": float(distances[i, j]),
+                    }
+                    for j in order[i]
+                ],
+                "neighbors": [],
+            }
+            for j, d in zip(neighbor_idx[i, :n] if n else (), neighbor_dist[i, :n] if n else ()):
+                if j >= 0:
+                    result["neighbors"].append(
+                        {
+                            "prompt": snap.texts[j],
+                            "cluster": int(snap.labels[j]),
+                            "distance": float(d),
+                        }
+                    )
+            results.append(result)
+        return results
+
+    def clusters(self) -> list[dict[str, Any]]:
+        snap = self._snapshot
+        model = snap.model
+        labels, counts = np.unique(snap.labels, return_counts=True)
+        sizes = dict(zip(labels.tolist(), counts.tolist()))
+        return [
+            {
+                "cluster": int(label),
+                "name": self._cluster_name(model, int(label)),
+                "description": model.meta.get(int(label), {}).get("description", ""),
+                "size": sizes.get(int(label), 0),
+            }
+            for label in model.centroid_labels
+        ]
+
+    def health(self) -> dict[str, Any]:
+        snap = self._snapshot
+        return {
+            "status": "ok",
+            "model_version": snap.version,
+            "prompts": len(snap.texts),
+            "clusters": len(snap.model.centroids),
+            "new_prompts": len(self._seen),
+            "reclustering": self.reclustering,
+            "last_error": self.last_error,
+        }
+
+    # ------------------------------------------------------------------
+    # Re‑clustering
+    # ------------------------------------------------------------------
+
+    def recluster(self) -> bool:
+        """Start a background re‑cluster; ``False`` if one is already running."""
+
+        with self._lock:
+            if self.reclustering:
+                return False
+            extra = list(self._seen)
+            self._refit = threading.Thread(
+                target=self._recluster, args=(extra,), name="recluster", daemon=True
+            )
+            self._refit.start()
+        return True
+
+    def _recluster(self, extra: list[str]) -> None:
+        start = time.perf_counter()
+        print(f"Re‑clustering with {len(extra)} new prompt(s)…", flush=True)
+        try:
+            snapshot = self._build(extra)
+        except (Exception, SystemExit) as exc:  # keep serving the old model
+            self.last_error = str(exc)
+            print(f"⚠️  Re‑cluster failed: {exc}", file=sys.stderr)
+            return
+        with self._lock:
+            self._snapshot = replace(snapshot, version=self._snapshot.version + 1)
+            for text in extra:
+                self._seen.pop(text, None)
+            self.last_error = None
+        print(
+            f"Model v{self._snapshot.version} live: {len(snapshot.model.centroids)} clusters, "
+            f"{len(snapshot.texts)} prompts ({time.perf_counter() - start:.1f} s).",
+            flush=True,
+        )
+
+
+# ---------------------------------------------------------------------------
+# HTTP front end
+# ---------------------------------------------------------------------------
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "ServiceServer"
+
+    def _reply(self, status: HTTPStatus, body: Any) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status: HTTPStatus, message: str) -> None:
+        self._reply(status, {"error": message})
+
+    def do_GET(self) -> None:  # noqa: N802 – http.server API
+        service = self.server.service
+        if self.path == "/health":
+            self._reply(HTTPStatus.OK, service.health())
+        elif self.path == "/clusters":
+            self._reply(HTTPStatus.OK, service.clusters())
+        else:
+            self._error(HTTPStatus.NOT_FOUND, f"Unknown endpoint {self.path}.")
+
+    def do_POST(self) -> None:  # noqa: N802 – http.server API
+        service = self.server.service
+        if self.path == "/recluster":
+            if service.recluster():
+                self._reply(HTTPStatus.ACCEPTED, {"started": True})
+            else:
+                self._error(HTTPStatus.CONFLICT, "A re-cluster is already running.")
+            return
+        if self.path != "/assign":
+            self._error(HTTPStatus.NOT_FOUND, f"Unknown endpoint {self.path}.")
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            prompts = body["prompts"]
+            neighbors = int(body.get("neighbors", 5))
+        except (KeyError, TypeError, ValueError) as exc:
+            self._error(HTTPStatus.BAD_REQUEST, f"Expected {{\"prompts\": [...]}}: {exc}")
+            return
+        if (
+            not isinstance(prompts, list)
+            or not all(isinstance(p, str) and p for p in prompts)
+            or len(prompts) > MAX_REQUEST_PROMPTS
+        ):
+            self._error(
+                HTTPStatus.BAD_REQUEST,
+                f"'prompts' must be a list of at most {MAX_REQUEST_PROMPTS} non-empty strings.",
+            )
+            return
+        if not 0 <= neighbors <= MAX_NEIGHBORS:
+            self._error(HTTPStatus.BAD_REQUEST, f"'neighbors' must be in [0, {MAX_NEIGHBORS}].")
+            return
+
+        try:
+            results = service.assign(prompts, neighbors) if prompts else []
+        except (Exception, SystemExit) as exc:  # e.g. the embedding API failed
+            self._error(HTTPStatus.BAD_GATEWAY, str(exc))
+            return
+        self._reply(
+            HTTPStatus.OK, {"model_version": service.snapshot.version, "results": results}
+        )
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        pass  # one line per request is too chatty for a classification endpoint
+
+
+class ServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], service: PromptService) -> None:
+        super().__init__(address, _Handler)
+        self.service = service
@@ -0,0 +1,165 @@
+"""Spherical k‑means for L2‑normalised embeddings.
+
+OpenAI embeddings are compared by cosine similarity, but scikit‑learn's
+KMeans minimises squared Euclidean distances to centroids that are plain
+means (inside the unit sphere).  Spherical k‑means instead maximises the
+summed cosine similarity of every row to its centroid, and keeps every
+centroid on the sphere as the normalised mean direction of its members.
+
+* Rows are expected to be L2‑normalised; ``cluster_prompts.py`` does that
+  once, in place.  Blocks of a :class:`~compact_matrix.QuantizedMatrix` are
+  renormalised as they are dequantised.
+* The assignment step is a matrix–matrix product ``block @ centroids.T`` per
+  *chunk_rows* rows, so memory stays at ``chunk_rows × k`` and the work runs
+  through the (multi‑threaded) BLAS.  The centroid update is a second
+  product, ``one_hot.T @ block``, in the same pass.
+* Seeding is k‑means++ with ``1 − cos`` as distance, on a sample of at most
+  *init_sample* rows.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+from lazy_imports import np
+
+
+@dataclass
+class SphericalKMeans:
+    """A fitted model, with the attribute names of scikit‑learn's KMeans."""
+
+    cluster_centers_: np.ndarray  # (k, dim), unit rows
+    labels_: np.ndarray
+    inertia_: float  # Σ weight · (1 − cos) over all rows
+    n_iter_: int
+
+    def predict(self, matrix: np.ndarray, chunk_rows: int = 8192) -> np.ndarray:
+        return _assign(matrix, self.cluster_centers_, None, chunk_rows)[0]
+
+
+def _block(matrix: np.ndarray, start: int, stop: int) -> np.ndarray:
+    block = matrix[start:stop]
+    if isinstance(block, np.ndarray):
+        return np.asarray(block, dtype=np.float32)
+    block = np.asarray(block, dtype=np.float32)  # dequantised copy – normalise it
+    block /= np.maximum(np.linalg.norm(block, axis=1, keepdims=True), 1e-12)
+    return block
+
+
+def _assign(
+    matrix: np.ndarray,
+    centers: np.ndarray,
+    sample_weight: np.ndarray | None,
+    chunk_rows: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Nearest centroid and cosine of every row, plus the weighted row sums per cluster."""
+
+    n = len(matrix)
+    k, dim = centers.shape
+    labels = np.empty(n, dtype=np.int64)
+    similarity = np.empty(n, dtype=np.float32)
+    sums = np.zeros((k, dim), dtype=np.float64)
+    for start in range(0, n, chunk_rows):
+        block = _block(matrix, start, start + chunk_rows)
+        rows = np.arange(len(block))
+        sim = block @ centers.T
+        best = sim.argmax(axis=1)
+        labels[start : start + len(block)] = best
+        similarity[start : start + len(block)] = sim[rows, best]
+        one_hot = np.zeros((len(block), k), dtype=np.float32)
+        one_hot[rows, best] = (
+            1 if sample_weight is None else sample_weight[start : start + len(block)]
+        )
+        sums += one_hot.T @ block
+    return labels, similarity, sums
+
+
+def kmeans_plusplus(
+    matrix: np.ndarray,
+    k: int,
+    *,
+    rng: np.random.Generator,
+    sample_weight: np.ndarray | None = None,
+    init_sample: int = 10_000,
+) -> np.ndarray:
+    """k‑means++ seeds (unit rows) drawn from a sample of *matrix*."""
+
+    n = len(matrix)
+    rows = np.sort(rng.choice(n, size=init_sample, replace=False)) if n > init_sample else None
+    sample = _block(matrix[rows] if rows is not None else matrix, 0, n)
+    weight = np.ones(len(sample)) if sample_weight is None else np.asarray(sample_weight, float)
+    if rows is not None and sample_weight is not None:
+        weight = weight[rows]
+
+    centers = np.empty((k, sample.shape[1]), dtype=np.float32)
+    first = rng.choice(len(sample), p=weight / weight.sum())
+    centers[0] = sample[first]
+    distance = np.maximum(1 - sample @ centers[0], 0)
+    for j in range(1, k):
+        p = weight * distance
+        total = p.sum()
+        pick = rng.choice(len(sample), p=p / total) if total > 0 else rng.integers(len(sample))
+        centers[j] = sample[pick]
+        distance = np.minimum(distance, np.maximum(1 - sample @ centers[j], 0))
+    return centers
+
+
+def fit_spherical_kmeans(
+    matrix: np.ndarray,
+    k: int,
+    *,
+    seed: int = 42,
+    sample_weight: np.ndarray | None = None,
+    max_iter: int = 100,
+    tol: float = 1e-4,
+    init_sample: int = 10_000,
+    chunk_rows: int = 8192,
+) -> SphericalKMeans:
+    """Fit spherical k‑means with *k* clusters (see module docstring).
+
+    Stops when no row changes cluster or the objective (summed cosine
+    similarity) improves by less than *tol* relative to its value.
+    """
+
+    if len(matrix) < k:
+        raise ValueError(f"Need at least {k} rows for {k} clusters.")
+    rng = np.random.default_rng(seed)
+    centers = kmeans_plusplus(
+        matrix, k, rng=rng, sample_weight=sample_weight, init_sample=init_sample
+    )
+    weight = None if sample_weight is None else np.asarray(sample_weight, dtype=np.float32)
+
+    def objective(similarity: np.ndarray) -> float:
+        return float(similarity.sum() if weight is None else similarity @ weight)
+
+    previous: np.ndarray | None = None
+    value = -np.inf
+    for iteration in range(1, max_iter + 1):
+        labels, similarity, sums = _assign(matrix, centers, weight, chunk_rows)
+        last, value = value, objective(similarity)
+        if previous is not None and (
+            np.array_equal(labels, previous) or value - last <= tol * abs(value)
+        ):
+            break
+        previous = labels
+
+        norms = np.linalg.norm(sums, axis=1)
+        empty = np.flatnonzero(norms <= 0)
+        if len(empty):
+            # Re‑seed empty clusters with the rows worst served by their centroid.
+            worst = np.argsort(similarity, kind="stable")[: len(empty)]
+            sums[empty] = np.stack([_block(matrix, int(r), int(r) + 1)[0] for r in worst])
+            norms[empty] = 1.0
+        centers = (sums / np.maximum(norms, 1e-12)[:, None]).astype(np.float32)
+    else:
+        # Out of iterations: make the labels match the last update.
+        labels, similarity, _ = _assign(matrix, centers, weight, chunk_rows)
+        value = objective(similarity)
+
+    total = float(len(matrix) if weight is None else weight.sum())
+    return SphericalKMeans(
+        cluster_centers_=centers,
+        labels_=labels,
+        inertia_=total - value,
+        n_iter_=iteration,
+    )
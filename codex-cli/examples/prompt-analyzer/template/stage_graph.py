@@ -0,0 +1,181 @@
+"""A tiny dependency graph of pipeline stages.
+
+After clustering, ``cluster_prompts.py`` has several stages that need only
+the labels and the matrix: labelling (network‑bound), plotting
+(CPU‑bound projection plus matplotlib) and the ambiguity analysis.  Run one
+after the other, the end‑to‑end time is their sum.  Declared as
+:class:`Stage` objects with named inputs and an output, :func:`run_stages`
+starts every stage as soon as its inputs exist, so independent stages
+overlap and the wall time approaches that of the slowest chain.
+
+* ``executor="thread"`` stages (network or light work) run on a thread
+  pool.
+* ``executor="process"`` stages (CPU‑bound Python) run in a process pool.
+  NumPy array inputs (including memory maps) are copied into
+  ``multiprocessing.shared_memory`` once and attached in the worker instead
+  of being pickled; other inputs are pickled as usual.
+
+Every stage is recorded as a trace span (see :mod:`tracing`).  When a stage
+fails, stages that have not started are dropped, running ones are waited
+for and the first error is re‑raised.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Any, Callable, Iterable, Sequence
+
+import tracing
+from lazy_imports import np
+
+EXECUTORS = ("thread", "process")
+
+
+@dataclass(frozen=True)
+class Stage:
+    """``run(**{name: value for name in inputs})`` produces value *output*."""
+
+    name: str
+    run: Callable[..., Any]
+    inputs: tuple[str, ...] = ()
+    output: str | None = None
+    executor: str = "thread"
+
+
+@dataclass(frozen=True)
+class SharedArray:
+    """Picklable handle of an array placed in shared memory."""
+
+    name: str
+    shape: tuple[int, ...]
+    dtype: str
+
+    @classmethod
+    def create(cls, array: np.ndarray) -> tuple["SharedArray", shared_memory.SharedMemory]:
+        shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+        view[...] = array
+        return cls(shm.name, array.shape, array.dtype.str), shm
+
+    def attach(self) -> tuple[np.ndarray, shared_memory.SharedMemory]:
+        # Pool workers share the parent's resource tracker, which keeps a set
+        # of names: attaching registers nothing new, and the parent's unlink
+        # releases the segment.
+        shm = shared_memory.SharedMemory(name=self.name)
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf), shm
+
+
+def _run_in_process(fn: Callable[..., Any], kwargs: dict[str, Any]) -> tuple[Any, dict[str, Any]]:
+    """Process‑pool entry point: attach shared inputs, run, report timing."""
+
+    attached = []
+    for key, value in kwargs.items():
+        if isinstance(value, SharedArray):
+            kwargs[key], shm = value.attach()
+            attached.append(shm)
+    timing: dict[str, Any] = dict(
+        start=time.perf_counter(), cpu=time.process_time(), pid=os.getpid()
+    )
+    try:
+        with tracing.span("worker") as frame:
+            result = fn(**kwargs)
+    finally:
+        kwargs.clear()  # drop the array views before closing their buffers
+        for shm in attached:
+            shm.close()
+    timing.update(frame, end=time.perf_counter(), cpu=time.process_time() - timing["cpu"])
+    return result, timing
+
+
+def _run_in_thread(stage: Stage, kwargs: dict[str, Any]) -> Any:
+    with tracing.span(stage.name, executor="thread"):
+        return stage.run(**kwargs)
+
+
+def _check(stages: Sequence[Stage], available: Iterable[str]) -> None:
+    known = set(available)
+    for stage in stages:
+        if stage.executor not in EXECUTORS:
+            raise ValueError(f"Stage {stage.name!r}: unknown executor {stage.executor!r}.")
+        if stage.output is not None:
+            if stage.output in known:
+                raise ValueError(f"Value {stage.output!r} is produced twice.")
+            known.add(stage.output)
+    for stage in stages:
+        missing = set(stage.inputs) - known
+        if missing:
+            raise ValueError(f"Stage {stage.name!r} needs {sorted(missing)}; nothing produces it.")
+
+
+def run_stages(stages: Sequence[Stage], values: dict[str, Any]) -> dict[str, Any]:
+    """Run *stages* as their inputs become available; returns all values.
+
+    *values* holds the inputs that exist up front (e.g. ``df`` and
+    ``result``); it is not modified.
+    """
+
+    _check(stages, values)
+    values = dict(values)
+    pending = list(stages)
+    running: dict[Future, Stage] = {}
+    shared: dict[int, tuple[SharedArray, shared_memory.SharedMemory]] = {}
+    n_threads = sum(s.executor == "thread" for s in stages)
+    n_processes = sum(s.executor == "process" for s in stages)
+    error: BaseException | None = None
+
+    threads = ThreadPoolExecutor(max_workers=max(1, n_threads), thread_name_prefix="stage")
+    processes = ProcessPoolExecutor(max_workers=n_processes) if n_processes else None
+    try:
+        while pending or running:
+            ready = [s for s in pending if error is None and set(s.inputs) <= values.keys()]
+            # Process stages first, so worker processes are forked before
+            # this round's thread stages start their own threads.
+            for stage in sorted(ready, key=lambda s: s.executor != "process"):
+                pending.remove(stage)
+                kwargs = {name: values[name] for name in stage.inputs}
+                if stage.executor == "process":
+                    for key, value in kwargs.items():
+                        if isinstance(value, np.ndarray):
+                            if id(value) not in shared:
+                                shared[id(value)] = SharedArray.create(value)
+                            kwargs[key] = shared[id(value)][0]
+                    future = processes.submit(_run_in_process, stage.run, kwargs)
+                else:
+                    future = threads.submit(tracing.bind(_run_in_thread), stage, kwargs)
+                running[future] = stage
+            if error is not None:
+                pending.clear()
+            if not running:
+                if pending:  # pragma: no cover – excluded by _check
+                    raise RuntimeError(f"Stages {[s.name for s in pending]} cannot run.")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                exc = future.exception()
+                if exc is not None:
+                    error = error or exc
+                    continue
+                value = future.result()
+                if stage.executor == "process":
+                    value, timing = value
+                    tracing.add_span(stage.name, cat="stage", executor="process", **timing)
+                if stage.output is not None:
+                    values[stage.output] = value
+    finally:
+        threads.shutdown(wait=True)
+        if processes is not None:
+            processes.shutdown(wait=True)
+        for _, shm in shared.values():
+            shm.close()
+            shm.unlink()
+
+    if error is not None:
+        raise error
+    return values
@@ -0,0 +1,178 @@
+"""Per‑stage profiling in Chrome trace‑event format.
+
+``cluster_prompts.py --trace out.json`` records one *complete* event
+(``"ph": "X"``) per pipeline stage – CSV load, embedding, every candidate *k*
+of the K‑Means sweep, ambiguity analysis, labelling, plotting, report – with
+
+* wall time (the event's ``dur``) and CPU time of the process (``cpu_ms``),
+* the peak resident set size so far (``peak_rss_mib``, also emitted as a
+  counter track),
+* counters reported while the stage was open, e.g. ``api_calls``,
+  ``api_tokens`` and cache hits / misses, and
+* free‑form arguments such as matrix shapes.
+
+The file loads in ``chrome://tracing``, `Perfetto <https://ui.perfetto.dev>`_
+and ``speedscope``, so two runs can be compared side by side.
+
+Open spans are tracked in a context variable, so stages running concurrently
+on threads each collect their own counters.  :func:`count` is attributed to
+every span open in the calling context; worker pools run their jobs through
+:func:`bind` so that, e.g., API calls made on behalf of the labelling stage
+are counted there.  Work done in other processes (the parallel k sweep, the
+plot stage) is measured there and added afterwards with :func:`add_span`.  Recording is
+always on and costs two clock reads and a ``getrusage`` per span; the events
+are only written when :func:`write` is called.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator, TypeVar
+
+try:
+    import resource
+except ImportError:  # pragma: no cover – Windows
+    resource = None  # type: ignore[assignment]
+
+T = TypeVar("T")
+
+_T0 = time.perf_counter()
+_PID = os.getpid()
+_EVENTS: list[dict[str, Any]] = []
+_OPEN: contextvars.ContextVar[tuple[dict[str, Any], ...]] = contextvars.ContextVar(
+    "open_spans", default=()
+)
+_LOCK = threading.Lock()
+
+
+def peak_rss_mib() -> float | None:
+    """Peak resident set size of this process so far, in MiB."""
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def _micros(perf: float) -> float:
+    return round((perf - _T0) * 1e6, 1)
+
+
+def add_span(
+    name: str,
+    start: float,
+    end: float,
+    *,
+    cpu: float | None = None,
+    pid: int | None = None,
+    cat: str = "stage",
+    **args: Any,
+) -> None:
+    """Record a finished span measured with ``time.perf_counter`` timestamps.
+
+    ``perf_counter`` is a system‑wide monotonic clock on the supported
+    platforms, so timestamps taken in worker processes line up with ours;
+    spans of another process *pid* are drawn on a track of their own.
+    """
+
+    if cpu is not None:
+        args["cpu_ms"] = round(cpu * 1e3, 1)
+    pid = pid or _PID
+    with _LOCK:
+        _EVENTS.append(
+            {
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                "ts": _micros(start),
+                "dur": round((end - start) * 1e6, 1),
+                "pid": _PID,
+                "tid": pid,
+                "args": args,
+            }
+        )
+
+
+@contextmanager
+def span(name: str, **args: Any) -> Iterator[dict[str, Any]]:
+    """Time the enclosed block as stage *name*.
+
+    Yields the span's argument dict; entries added to it (e.g. matrix shapes)
+    end up in the trace.
+    """
+
+    frame: dict[str, Any] = dict(args)
+    token = _OPEN.set(_OPEN.get() + (frame,))
+    start, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield frame
+    finally:
+        end = time.perf_counter()
+        _OPEN.reset(token)
+        rss = peak_rss_mib()
+        if rss is not None:
+            frame["peak_rss_mib"] = round(rss, 1)
+            with _LOCK:
+                _EVENTS.append(
+                    {
+                        "name": "peak RSS (MiB)",
+                        "ph": "C",
+                        "ts": _micros(end),
+                        "pid": _PID,
+                        "args": {"MiB": round(rss, 1)},
+                    }
+                )
+        add_span(name, start, end, cpu=time.process_time() - cpu, **frame)
+
+
+def count(name: str, n: int | float = 1) -> None:
+    """Add *n* to counter *name* of every span open in this context (thread‑safe)."""
+
+    with _LOCK:
+        for frame in _OPEN.get():
+            frame[name] = frame.get(name, 0) + n
+
+
+def bind(fn: Callable[..., T]) -> Callable[..., T]:
+    """*fn* running in a copy of the caller's context (for thread pools)."""
+
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+def write(path: Path, **metadata: Any) -> None:
+    """Write all recorded events to *path* as a Chrome trace‑event JSON file."""
+
+    with _LOCK:
+        events = list(_EVENTS)
+    events.append(
+        {"name": "process_name", "ph": "M", "pid": _PID, "args": {"name": "cluster_prompts"}}
+    )
+    for tid in sorted({e["tid"] for e in events if "tid" in e} - {_PID}):
+        events.append(
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": _PID,
+                "tid": tid,
+                "args": {"name": f"worker {tid}"},
+            }
+        )
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(
+        json.dumps(
+            {"traceEvents": events, "displayTimeUnit": "ms", "otherData": metadata},
+            default=lambda value: value.item() if hasattr(value, "item") else str(value),
+        ),
+        encoding="utf-8",
+    )
+    os.replace(tmp, path)
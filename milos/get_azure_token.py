@@ -2,19 +2,188 @@
 """
 Script to obtain Azure AD token for OpenAI API access
 Reads configuration from milos/.env file
+
+Tokens are cached on disk (keyed by tenant, client ID and scope) and reused
+until shortly before they expire, so repeated and parallel launches share one
+token instead of each requesting a new one from Azure AD.
 """
 
+import argparse
+import contextlib
+import hashlib
 import json
 import os
 import sys
+import tempfile
+import time
+from datetime import datetime
 from pathlib import Path
+from typing import Iterator, Tuple, cast
 
 import requests
 from dotenv import load_dotenv
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore[assignment]
+    import msvcrt
 
-def get_azure_token(env_path: Path | None = None) -> str:
-    """Get Azure AD token using service principal credentials."""
+# Seconds before expiry from which a cached token is no longer reused
+DEFAULT_REFRESH_MARGIN = 300.0
+CACHE_FILE_NAME = "azure_tokens.json"
+# Seconds to wait for Azure AD; the request runs while other launches wait on the cache lock
+REQUEST_TIMEOUT = 30
+
+
+def default_cache_dir() -> Path:
+    """Per-user cache directory, overridable with AZURE_TOKEN_CACHE_DIR."""
+    override = os.getenv("AZURE_TOKEN_CACHE_DIR")
+    if override:
+        return Path(override).expanduser()
+    if os.name == "nt" and os.getenv("LOCALAPPDATA"):
+        return Path(os.environ["LOCALAPPDATA"]) / "codex-azure"
+    base = os.getenv("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    return Path(base) / "codex-azure"
+
+
+def _cache_key(tenant_id: str, client_id: str, scope: str) -> str:
+    return hashlib.sha256(f"{tenant_id}\n{client_id}\n{scope}".encode()).hexdigest()
+
+
+@contextlib.contextmanager
+def _locked(lock_path: Path) -> Iterator[None]:
+    """Hold an exclusive lock on lock_path while the block runs."""
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is None:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    finally:
+        os.close(fd)  # also releases the flock
+
+
+def _read_cache(cache_path: Path) -> dict:
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            entries = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    return entries if isinstance(entries, dict) else {}
+
+
+def _write_cache(cache_path: Path, entries: dict) -> None:
+    """Replace the cache file atomically with one only its owner can read."""
+    fd, tmp_path = tempfile.mkstemp(dir=cache_path.parent, prefix=f".{CACHE_FILE_NAME}.")
+    try:
+        os.chmod(tmp_path, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
+        raise
+
+
+def _warn_cache_unavailable(error: OSError) -> None:
+    print(f"Warning: token cache unavailable ({error})", file=sys.stderr)
+
+
+def _request_token(
+    tenant_id: str, client_id: str, client_secret: str, scope: str
+) -> Tuple[str, float]:
+    """Request a new token from Azure AD. Returns the token and its expiry (epoch seconds)."""
+    token_url = f"https://login.microsoftonline.com/{tenant_id}/oauth2/v2.0/token"
+    token_data = {
+        "client_id": client_id,
+        "client_secret": client_secret,
+        "scope": scope,
+        "grant_type": "client_credentials",
+    }
+
+    # Request token from Azure AD
+    requested_at = time.time()
+    response = requests.post(token_url, data=token_data, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+
+    token_response = response.json()
+    access_token = token_response.get("access_token")
+
+    if not access_token:
+        raise ValueError(
+            f"No access token in response\nResponse: {json.dumps(token_response, indent=2)}"
+        )
+
+    # Count the lifetime from before the request, so the round trip only shortens it
+    expires_at = requested_at + float(token_response.get("expires_in", 0))
+    return access_token, expires_at
+
+
+def _cached_token(
+    tenant_id: str,
+    client_id: str,
+    client_secret: str,
+    scope: str,
+    refresh_margin: float,
+    cache_dir: Path,
+) -> Tuple[str, float]:
+    """Return the cached token if it is still fresh, otherwise request and store a new one.
+
+    The lock is held across the request, so processes starting together wait
+    for the first one's token instead of each requesting their own.  An
+    unusable cache only costs the reuse: the token is then requested directly.
+    Errors of the request itself propagate (requests' exceptions are OSErrors
+    too, so they must stay outside the cache's error handling).
+    """
+    cache_path = cache_dir / CACHE_FILE_NAME
+    key = _cache_key(tenant_id, client_id, scope)
+
+    with contextlib.ExitStack() as stack:
+        try:
+            cache_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+            stack.enter_context(_locked(cache_dir / f"{CACHE_FILE_NAME}.lock"))
+            entries = _read_cache(cache_path)
+        except OSError as e:
+            _warn_cache_unavailable(e)
+            return _request_token(tenant_id, client_id, client_secret, scope)
+
+        now = time.time()
+        entry = entries.get(key)
+        if isinstance(entry, dict) and entry.get("expires_at", 0) - refresh_margin > now:
+            return entry["access_token"], float(entry["expires_at"])
+
+        access_token, expires_at = _request_token(tenant_id, client_id, client_secret, scope)
+        # Drop expired entries of other credentials while rewriting the file
+        entries = {
+            k: v for k, v in entries.items() if isinstance(v, dict) and v.get("expires_at", 0) > now
+        }
+        entries[key] = {"access_token": access_token, "expires_at": expires_at}
+        try:
+            _write_cache(cache_path, entries)
+        except OSError as e:
+            _warn_cache_unavailable(e)
+        return access_token, expires_at
+
+
+def get_azure_token_with_expiry(
+    env_path: Path | None = None,
+    use_cache: bool = True,
+    refresh_margin: float | None = None,
+) -> Tuple[str, float]:
+    """Get Azure AD token and its expiry time (epoch seconds).
+
+    Unless use_cache is False, a cached token is returned while it is valid for
+    more than refresh_margin seconds (default: AZURE_TOKEN_REFRESH_MARGIN or
+    DEFAULT_REFRESH_MARGIN).
+    """
     # Load environment variables
     if env_path is None:
         env_path = Path(__file__).parent / ".env"
@@ -40,37 +209,71 @@ def get_azure_token(env_path: Path | None = None) -> str:
             f"Please ensure these are defined in {env_path}"
         )
 
-    # Prepare token request
-    token_url = (
-        f"https://login.microsoftonline.com/{required_vars['AZURE_TENANT_ID']}/oauth2/v2.0/token"
+    # All set (checked above); cast narrows the Optional values for mypy
+    credentials = cast(
+        Tuple[str, str, str, str],
+        (
+            required_vars["AZURE_TENANT_ID"],
+            required_vars["AZURE_CLIENT_ID"],
+            required_vars["AZURE_CLIENT_SECRET"],
+            required_vars["AZURE_SCOPE"],
+        ),
     )
-    token_data = {
-        "client_id": required_vars["AZURE_CLIENT_ID"],
-        "client_secret": required_vars["AZURE_CLIENT_SECRET"],
-        "scope": required_vars["AZURE_SCOPE"],
-        "grant_type": "client_credentials",
-    }
+    if not use_cache:
+        return _request_token(*credentials)
 
-    # Request token from Azure AD
-    response = requests.post(token_url, data=token_data)
-    response.raise_for_status()
+    if refresh_margin is None:
+        try:
+            refresh_margin = float(os.getenv("AZURE_TOKEN_REFRESH_MARGIN", DEFAULT_REFRESH_MARGIN))
+        except ValueError:
+            raise ValueError("AZURE_TOKEN_REFRESH_MARGIN must be a number of seconds")
 
-    token_response = response.json()
-    access_token = token_response.get("access_token")
+    return _cached_token(*credentials, refresh_margin, default_cache_dir())
 
-    if not access_token:
-        raise ValueError(
-            f"No access token in response\nResponse: {json.dumps(token_response, indent=2)}"
-        )
 
-    return access_token
+def get_azure_token(
+    env_path: Path | None = None,
+    use_cache: bool = True,
+    refresh_margin: float | None = None,
+) -> str:
+    """Get Azure AD token using service principal credentials."""
+    return get_azure_token_with_expiry(env_path, use_cache, refresh_margin)[0]
 
 
 def main() -> int:
     """CLI entry point."""
+    parser = argparse.ArgumentParser(description="Print an Azure AD token for Azure OpenAI.")
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always request a new token; neither read nor update the token cache",
+    )
+    parser.add_argument(
+        "--print-expiry",
+        action="store_true",
+        help="Also print when the token expires (to stderr, so $(get-azure-token) still works)",
+    )
+    parser.add_argument(
+        "--refresh-margin",
+        type=float,
+        metavar="SECONDS",
+        help="Request a new token once the cached one expires within SECONDS "
+        f"(default: $AZURE_TOKEN_REFRESH_MARGIN or {DEFAULT_REFRESH_MARGIN:.0f})",
+    )
+    args = parser.parse_args()
+
     try:
-        token = get_azure_token()
+        token, expires_at = get_azure_token_with_expiry(
+            use_cache=not args.no_cache, refresh_margin=args.refresh_margin
+        )
         print(token)
+        if args.print_expiry:
+            expiry = datetime.fromtimestamp(expires_at).astimezone()
+            remaining = max(0, int(expires_at - time.time()))
+            print(
+                f"Expires at {expiry.isoformat(timespec='seconds')} (in {remaining // 60} min)",
+                file=sys.stderr,
+            )
         # Also export to environment variable
         os.environ["AZURE_OPENAI_TOKEN"] = token
         return 0